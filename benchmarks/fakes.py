@@ -0,0 +1,203 @@
+"""
+Offline stand-ins for Azure Document Intelligence and Gemini, used by the
+benchmark suite so the pipeline can run without credentials or network access.
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from langchain_core.runnables import RunnableLambda
+
+from src.models import BatchComparisonResult, ComparisonResult, KeyedComparisonResult
+
+
+class Latency:
+    """Injected delay: `base` seconds plus up to `jitter` seconds of uniform noise."""
+
+    def __init__(self, base: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        self.base = base
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+
+    def sample(self) -> float:
+        return self.base + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def sleep(self):
+        delay = self.sample()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def asleep(self):
+        delay = self.sample()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# --- Azure Document Intelligence ---
+
+def _field(value) -> SimpleNamespace:
+    """One DocumentField from its recorded dict form (AnalyzeResult.as_dict())."""
+    if not isinstance(value, dict):
+        value = {"content": None if value is None else str(value)}
+    value_array = value.get("valueArray")
+    value_object = value.get("valueObject")
+    return SimpleNamespace(
+        content=value.get("content"),
+        value_string=value.get("valueString"),
+        value_array=[_field(item) for item in value_array] if value_array is not None else None,
+        value_object={name: _field(field) for name, field in value_object.items()} if value_object is not None else None,
+    )
+
+def analyze_result_from_dict(recorded: dict) -> SimpleNamespace:
+    """
+    Rebuilds an AnalyzeResult-like object from a recorded response, i.e. the
+    output of `result.as_dict()` on a real PI_Extraction call.
+    """
+    documents = [
+        SimpleNamespace(fields={name: _field(field) for name, field in document.get("fields", {}).items()})
+        for document in recorded.get("documents", [])
+    ]
+    return SimpleNamespace(documents=documents)
+
+def recorded_response(header: dict, items: list) -> dict:
+    """
+    Builds a response in the recorded (as_dict) shape from plain values:
+    `header` maps PI_Extraction field names to strings, `items` holds
+    (description, quantity, amount) tuples.
+    """
+    fields = {name: {"valueString": value, "content": value} for name, value in header.items() if value is not None}
+    fields["line_items"] = {"valueArray": [
+        {"valueObject": {
+            "charge_description": {"content": description},
+            "Qty": {"content": f"{quantity:g}"},
+            "Amount": {"content": f"{amount:,.2f}"},
+        }}
+        for description, quantity, amount in items
+    ]}
+    return {"documents": [{"fields": fields}]}
+
+
+class FakeAnalyzeRegistry:
+    """Recorded Azure responses keyed by the SHA-256 of the submitted PDF bytes."""
+
+    def __init__(self, latency: Optional[Latency] = None):
+        self.latency = latency or Latency()
+        self.responses: Dict[str, dict] = {}
+        self.calls = 0
+
+    def record(self, pdf_bytes: bytes, response: dict):
+        self.responses[hashlib.sha256(pdf_bytes).hexdigest()] = response
+
+    def load(self, path: str, pdf_bytes: bytes):
+        """Registers a response saved with `json.dump(result.as_dict(), f)`."""
+        with open(path, "r", encoding="utf-8") as f:
+            self.record(pdf_bytes, json.load(f))
+
+    def lookup(self, body: bytes) -> SimpleNamespace:
+        self.calls += 1
+        digest = hashlib.sha256(bytes(body)).hexdigest()
+        if digest not in self.responses:
+            raise KeyError(f"No recorded Azure response for document {digest[:12]}")
+        return analyze_result_from_dict(self.responses[digest])
+
+    def client_class(self):
+        """A drop-in for azure.ai.documentintelligence.DocumentIntelligenceClient."""
+        registry = self
+
+        class FakePoller:
+            def __init__(self, body):
+                self._body = body
+
+            def result(self):
+                registry.latency.sleep()
+                return registry.lookup(self._body)
+
+        class FakeDocumentIntelligenceClient:
+            def __init__(self, endpoint=None, credential=None, **kwargs):
+                pass
+
+            def begin_analyze_document(self, model_id, body, content_type=None, **kwargs):
+                return FakePoller(body)
+
+        return FakeDocumentIntelligenceClient
+
+    def async_client_class(self):
+        """A drop-in for the aio DocumentIntelligenceClient."""
+        registry = self
+
+        class FakeAsyncPoller:
+            def __init__(self, body):
+                self._body = body
+
+            async def result(self):
+                await registry.latency.asleep()
+                return registry.lookup(self._body)
+
+        class FakeAsyncDocumentIntelligenceClient:
+            def __init__(self, endpoint=None, credential=None, **kwargs):
+                pass
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc_info):
+                return False
+
+            async def begin_analyze_document(self, model_id, body, content_type=None, **kwargs):
+                return FakeAsyncPoller(body)
+
+        return FakeAsyncDocumentIntelligenceClient
+
+
+# --- Gemini ---
+
+_INVOICE_KEY = re.compile(r'"invoice_key": "((?:[^"\\]|\\.)*)"')
+
+def _default_decision(prompt_value, schema):
+    """MATCH for every invoice in the prompt, in the requested schema."""
+    decision = {"status": "MATCH", "analysis": "Offline benchmark decision.", "field_level_comparison": {"benchmark": "fake LLM"}}
+    if schema is BatchComparisonResult:
+        keys = [json.loads(f'"{key}"') for key in _INVOICE_KEY.findall(prompt_value.to_string())]
+        return BatchComparisonResult(results=[KeyedComparisonResult(invoice_key=key, **decision) for key in keys])
+    return ComparisonResult(**decision)
+
+class FakeStructuredLLM:
+    """
+    Stands in for ChatGoogleGenerativeAI: accepts the same constructor arguments
+    and returns a structured-output runnable that sleeps for the injected latency.
+    `decide(prompt_value, schema)` produces the structured result.
+    """
+
+    latency = Latency()
+    decide = staticmethod(_default_decision)
+    calls = 0
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def with_structured_output(self, schema):
+        cls = type(self)
+
+        def invoke(prompt_value):
+            cls.calls += 1
+            cls.latency.sleep()
+            return cls.decide(prompt_value, schema)
+
+        async def ainvoke(prompt_value):
+            cls.calls += 1
+            await cls.latency.asleep()
+            return cls.decide(prompt_value, schema)
+
+        return RunnableLambda(invoke, afunc=ainvoke)
+
+def fake_llm_class(latency: Optional[Latency] = None, decide=None):
+    """Returns a FakeStructuredLLM subclass with its own latency, decision function and call counter."""
+    attributes = {"latency": latency or Latency(), "calls": 0}
+    if decide is not None:
+        attributes["decide"] = staticmethod(decide)
+    return type("FakeChatGoogleGenerativeAI", (FakeStructuredLLM,), attributes)
@@ -0,0 +1,302 @@
+"""
+Offline benchmark suite for the invoice pipeline.
+
+Azure Document Intelligence and Gemini are replaced by the stand-ins in
+benchmarks/fakes.py (with optional injected latency), and the CRM is a
+synthetic database from benchmarks/synthetic_crm.py. Run from the repo root:
+
+    python -m benchmarks.run --crm-rows 100000 --azure-latency 0.8 --llm-latency 1.5
+    python -m benchmarks.run --baseline benchmarks/results/<earlier run>.json
+
+Results are written as JSON to benchmarks/results/ so runs can be compared.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from contextlib import redirect_stdout
+from typing import Callable, List, Optional
+from unittest import mock
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+
+from src.models import InvoiceData, InvoiceItem
+from src.crm_schema import SCHEMA_VERSION, read_schema_version
+from benchmarks.fakes import Latency, FakeAnalyzeRegistry, fake_llm_class, recorded_response
+from benchmarks.synthetic_crm import CHARGES, build_crm_db, invoice_number, job_reference, synthetic_invoice
+
+logger = logging.getLogger("Benchmarks")
+
+BENCHMARKS = ("fetch_crm_data", "fetch_crm_data_bulk", "fetch_line_item_arrays", "calculate_fuzzy_scores", "compare_invoice_data_llm",
+              "compare_invoice_data_fast_path", "compare_invoice_batch", "generate_verified_invoice", "main_end_to_end")
+
+OFFLINE_ENV = {
+    "AZURE_FORM_ENDPOINT": "https://offline.invalid",
+    "AZURE_FORM_KEY": "offline",
+    "GOOGLE_API_KEY": "offline",
+    # Benchmarks measure the work itself, not cache hits
+    "EXTRACTION_CACHE": "0",
+    "COMPARISON_CACHE": "0",
+}
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def measure(name: str, func: Callable[[int], object], iterations: int, warmup: int = 1) -> dict:
+    """Calls func(i) `iterations` times after `warmup` untimed calls and summarizes the latencies."""
+    for i in range(warmup):
+        func(i)
+
+    timings = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        call_start = time.perf_counter()
+        func(i)
+        timings.append(time.perf_counter() - call_start)
+    wall = time.perf_counter() - start
+
+    result = {
+        "name": name,
+        "iterations": iterations,
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "p50_ms": _percentile(timings, 0.50) * 1000,
+        "p95_ms": _percentile(timings, 0.95) * 1000,
+        "max_ms": max(timings) * 1000,
+        "ops_per_sec": iterations / wall if wall else None,
+    }
+    logger.info(f"{name:<32} mean {result['mean_ms']:>9.2f} ms   p95 {result['p95_ms']:>9.2f} ms   {result['ops_per_sec']:>9.1f} ops/s")
+    return result
+
+def extracted_invoice(index: int, items_per_invoice: int) -> InvoiceData:
+    """What the extractor would return for synthetic CRM invoice `index`."""
+    header, items = synthetic_invoice(index, items_per_invoice)
+    return InvoiceData(
+        supplier="Synthetic Shipper Co",
+        supplier_inv_no=header[1],
+        due_date=header[12],
+        currency=header[14],
+        total_amount=header[13],
+        items=[InvoiceItem(description=item[2], quantity=1.0, unit_price=item[3], amount=item[3]) for item in items],
+    )
+
+def synthetic_pdf(index: int) -> bytes:
+    # The fake Azure client only hashes the body, so any unique bytes will do
+    return f"%PDF-1.4\n% synthetic invoice {index}\n%%EOF\n".encode("ascii")
+
+def record_extraction(registry: FakeAnalyzeRegistry, index: int, items_per_invoice: int) -> bytes:
+    invoice = extracted_invoice(index, items_per_invoice)
+    response = recorded_response(
+        {
+            "supplier": invoice.supplier,
+            "supplier_inv_no": invoice.supplier_inv_no,
+            "due_date": invoice.due_date,
+            "currency": invoice.currency,
+            "total_amount": f"{invoice.total_amount:,.2f}",
+        },
+        [(item.description, item.quantity, item.amount) for item in invoice.items],
+    )
+    pdf_bytes = synthetic_pdf(index)
+    registry.record(pdf_bytes, response)
+    return pdf_bytes
+
+def fuzzy_items(size: int, seed: int = 7):
+    """Invoice items and reworded, shuffled CRM lines of `size` entries each."""
+    rng = random.Random(seed)
+    invoice_items, crm_line_items = [], []
+    for i in range(size):
+        charge = rng.choice(CHARGES)
+        amount = round(rng.uniform(10, 5000), 2)
+        invoice_items.append(InvoiceItem(description=f"{charge} CNTR{i % 40:04d}", quantity=1.0, unit_price=amount, amount=amount))
+        crm_line_items.append({"internal_code": "N/A", "description": f"CNTR{i % 40:04d} - {charge.upper()}", "amount": amount})
+    rng.shuffle(crm_line_items)
+    return invoice_items, crm_line_items
+
+def prepare_workdir(workdir: str, crm_db: str):
+    """Lays out data/crm.db, the voucher template and output/ the way main.py expects them."""
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    os.makedirs(os.path.join(workdir, "output"), exist_ok=True)
+    os.symlink(os.path.abspath(crm_db), os.path.join(workdir, "data", "crm.db"))
+
+    template = os.path.join(workdir, "data", "VoucherPrintingBatch.pdf")
+    repo_template = os.path.join(REPO_ROOT, "data", "VoucherPrintingBatch.pdf")
+    if os.path.exists(repo_template):
+        shutil.copyfile(repo_template, template)
+    else:
+        c = canvas.Canvas(template, pagesize=A4)
+        c.drawString(40, 800, "VOUCHER TEMPLATE (benchmark placeholder)")
+        c.rect(30, 30, 535, 760)
+        c.save()
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def print_comparison(results: List[dict], baseline_path: str):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {entry["name"]: entry for entry in json.load(f)["results"]}
+
+    print(f"\n{'Benchmark':<32}{'Baseline (ms)':>15}{'Current (ms)':>15}{'Change':>10}")
+    for entry in results:
+        before = baseline.get(entry["name"])
+        if before is None:
+            print(f"{entry['name']:<32}{'-':>15}{entry['mean_ms']:>15.2f}{'new':>10}")
+            continue
+        change = (entry["mean_ms"] - before["mean_ms"]) / before["mean_ms"] * 100 if before["mean_ms"] else 0.0
+        print(f"{entry['name']:<32}{before['mean_ms']:>15.2f}{entry['mean_ms']:>15.2f}{change:>+9.1f}%")
+
+def run(args) -> List[dict]:
+    selected = set(args.only or BENCHMARKS)
+    rng = random.Random(args.seed)
+
+    crm_db = args.crm_db or os.path.join(REPO_ROOT, "benchmarks", "data", f"crm_{args.crm_rows}x{args.items_per_invoice}.db")
+    # A cached synthetic CRM from an older schema would fail the startup check
+    if args.rebuild_crm or not os.path.exists(crm_db) or read_schema_version(crm_db) < SCHEMA_VERSION:
+        logger.info(f"Building synthetic CRM with {args.crm_rows} invoices at {crm_db}")
+        build_time = build_crm_db(crm_db, args.crm_rows, args.items_per_invoice)
+        logger.info(f"CRM built in {build_time:.1f}s")
+
+    azure = FakeAnalyzeRegistry(Latency(args.azure_latency, args.jitter, seed=args.seed))
+    llm_class = fake_llm_class(Latency(args.llm_latency, args.jitter, seed=args.seed + 1))
+
+    workdir = tempfile.mkdtemp(prefix="invoice_bench_")
+    prepare_workdir(workdir, crm_db)
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    results = []
+    try:
+        with mock.patch.dict(os.environ, OFFLINE_ENV), \
+             mock.patch("azure.ai.documentintelligence.DocumentIntelligenceClient", azure.client_class()), \
+             mock.patch("azure.ai.documentintelligence.aio.DocumentIntelligenceClient", azure.async_client_class()), \
+             mock.patch("langchain_google_genai.ChatGoogleGenerativeAI", llm_class):
+            # Imported here so main.py's log file lands in the scratch directory
+            import main as pipeline_main
+            from src.crm_tool import init_crm, dispose_crm, fetch_crm_data, fetch_crm_data_bulk, fetch_line_item_arrays, crm_key
+            from src.comparator import calculate_fuzzy_scores, compare_invoice_data, compare_invoice_batch, reset_comparison_chain
+            from src.generator import generate_verified_invoice
+            if not args.verbose:
+                logging.getLogger().setLevel(logging.WARNING)
+                logger.setLevel(logging.INFO)
+
+            init_crm()
+            indices = [rng.randrange(args.crm_rows) for _ in range(args.iterations + 1)]
+
+            if "fetch_crm_data" in selected:
+                results.append(measure("fetch_crm_data", lambda i: fetch_crm_data(invoice_number=invoice_number(indices[i])), args.iterations))
+
+            if "fetch_crm_data_bulk" in selected:
+                def bulk(i):
+                    fetch_crm_data_bulk([crm_key(invoice_number=invoice_number(rng.randrange(args.crm_rows))) for _ in range(args.bulk_size)])
+                results.append(measure(f"fetch_crm_data_bulk[{args.bulk_size}]", bulk, max(1, args.iterations // 10)))
+
+            if "fetch_line_item_arrays" in selected:
+                def arrays(i):
+                    for lines in fetch_line_item_arrays([job_reference(rng.randrange(args.crm_rows)) for _ in range(args.bulk_size)]).values():
+                        lines.total()
+                results.append(measure(f"fetch_line_item_arrays[{args.bulk_size}]", arrays, max(1, args.iterations // 10)))
+
+            if "calculate_fuzzy_scores" in selected:
+                invoice_items, crm_line_items = fuzzy_items(args.fuzzy_items)
+                results.append(measure(f"calculate_fuzzy_scores[{args.fuzzy_items}]", lambda i: calculate_fuzzy_scores(invoice_items, crm_line_items), args.iterations))
+
+            pairs = [(extracted_invoice(index, args.items_per_invoice), fetch_crm_data(invoice_number=invoice_number(index))) for index in indices]
+            if "compare_invoice_data_llm" in selected:
+                results.append(measure("compare_invoice_data_llm", lambda i: compare_invoice_data(*pairs[i], use_fast_path=False, use_cache=False), args.iterations))
+
+            if "compare_invoice_data_fast_path" in selected:
+                results.append(measure("compare_invoice_data_fast_path", lambda i: compare_invoice_data(*pairs[i], use_cache=False), args.iterations))
+
+            if "compare_invoice_batch" in selected:
+                def batch(i):
+                    chunk = range(i * args.batch_size, (i + 1) * args.batch_size)
+                    compare_invoice_batch({str(j): pairs[j % len(pairs)] for j in chunk}, use_fast_path=False, use_cache=False)
+                results.append(measure(f"compare_invoice_batch[{args.batch_size}]", batch, max(1, args.iterations // args.batch_size)))
+
+            if "generate_verified_invoice" in selected:
+                results.append(measure("generate_verified_invoice", lambda i: generate_verified_invoice(pairs[i][0], "output/bench_voucher.pdf"), args.iterations))
+
+            if "main_end_to_end" in selected:
+                paths = []
+                for i, index in enumerate(indices):
+                    path = os.path.join(workdir, f"invoice_{i}.pdf")
+                    with open(path, "wb") as f:
+                        f.write(record_extraction(azure, index, args.items_per_invoice))
+                    paths.append(path)
+
+                def end_to_end(i):
+                    with redirect_stdout(io.StringIO()):
+                        pipeline_main.main(paths[i])
+                results.append(measure("main_end_to_end", end_to_end, args.iterations))
+
+            dispose_crm()
+            # The cached chain wraps the fake LLM; do not leak it past the patch
+            reset_comparison_chain()
+            logger.info(f"Fake Azure calls: {azure.calls}, fake Gemini calls: {llm_class.calls}")
+    finally:
+        os.chdir(original_cwd)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the invoice pipeline")
+    parser.add_argument("--crm-rows", type=int, default=10_000, help="Synthetic CRM invoices (10k to 10M)")
+    parser.add_argument("--items-per-invoice", type=int, default=3, help="Line items per synthetic invoice")
+    parser.add_argument("--crm-db", help="Use this synthetic CRM file instead of benchmarks/data/crm_<rows>x<items>.db")
+    parser.add_argument("--rebuild-crm", action="store_true", help="Rebuild the synthetic CRM even if it exists")
+    parser.add_argument("--iterations", type=int, default=100, help="Timed calls per benchmark")
+    parser.add_argument("--bulk-size", type=int, default=100, help="Keys per fetch_crm_data_bulk call")
+    parser.add_argument("--batch-size", type=int, default=20, help="Invoices per compare_invoice_batch call")
+    parser.add_argument("--fuzzy-items", type=int, default=50, help="Line items per side for fuzzy scoring")
+    parser.add_argument("--azure-latency", type=float, default=0.0, help="Injected seconds per fake Azure call")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Injected seconds per fake Gemini call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra uniform random latency, in seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Run only these benchmarks")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the scratch directory (logs, vouchers)")
+    parser.add_argument("--verbose", action="store_true", help="Keep pipeline INFO logging enabled")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    timestamp = datetime.now(timezone.utc)
+    report = {
+        "timestamp": timestamp.isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "keep_workdir", "verbose")},
+        "results": results,
+    }
+    output = args.output or os.path.join(REPO_ROOT, "benchmarks", "results", f"{timestamp.strftime('%Y%m%dT%H%M%SZ')}.json")
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {output}")
+
+    if args.baseline:
+        print_comparison(results, args.baseline)
+
+if __name__ == "__main__":
+    main()
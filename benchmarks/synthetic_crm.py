@@ -0,0 +1,114 @@
+"""
+Synthetic CRM database generator for benchmarks.
+
+    python -m benchmarks.synthetic_crm --rows 1000000 --db benchmarks/data/crm_1m.db
+
+Every row is derived from its index, so a benchmark can pick any invoice
+number and know its CRM record (see `synthetic_invoice`) without querying.
+"""
+import os
+import time
+import random
+import sqlite3
+import logging
+import argparse
+from typing import List, Tuple
+
+from src.crm_schema import migrate
+from src.charge_index import rebuild_charge_descriptions
+
+logger = logging.getLogger(__name__)
+
+CHARGES = [
+    "Ocean Freight", "Terminal Handling Charges", "Bill of Lading Fee", "Documentation Fee",
+    "Customs Clearance", "Delivery Order Fee", "Container Cleaning", "Demurrage", "Detention",
+    "Inland Haulage", "Port Security Surcharge", "Bunker Adjustment Factor", "Seal Fee", "Storage",
+    "Fuel Surcharge", "Insurance", "Telex Release", "Courier Charges",
+]
+CUSTOMERS = ["Acme Trading LLC", "Blue Ocean Imports", "Gulf Star General Trading", "Northwind Foods", "Orion Textiles"]
+PORTS = ["JEBEL ALI", "SHANGHAI", "NHAVA SHEVA", "ROTTERDAM", "SINGAPORE", "HAMBURG"]
+
+INSERT_BATCH = 50_000
+
+def job_reference(index: int) -> str:
+    return f"JOB{index:09d}"
+
+def invoice_number(index: int) -> str:
+    return f"INV-{index:09d}"
+
+def synthetic_invoice(index: int, items_per_invoice: int = 3) -> Tuple[tuple, List[tuple]]:
+    """
+    The CRM header row and line-item rows for invoice `index`, in column order
+    of the INSERT statements below. Deterministic for a given index.
+    """
+    rng = random.Random(index)
+    items = [
+        (job_reference(index), f"C{rng.randint(100, 999)}", rng.choice(CHARGES), round(rng.uniform(25, 2500), 2))
+        for _ in range(items_per_invoice)
+    ]
+    total = round(sum(item[3] for item in items), 2)
+    header = (
+        job_reference(index), invoice_number(index), rng.choice(CUSTOMERS),
+        f"MBL{index:09d}", f"HBL{index:09d}", f"CNTR{index % 10_000_000:07d}", rng.choice(["20GP", "40HC"]),
+        rng.choice(PORTS), rng.choice(PORTS), "Synthetic Shipper Co", rng.choice(CUSTOMERS), "30 DAYS",
+        f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}", total, "USD",
+    )
+    return header, items
+
+def build_crm_db(db_path: str, rows: int, items_per_invoice: int = 3) -> float:
+    """
+    Creates (or replaces) a migrated CRM database holding `rows` synthetic
+    invoices. Returns the build time in seconds.
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        migrate(conn)
+        # Throwaway data: durability does not matter, build speed does
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+
+        for batch_start in range(0, rows, INSERT_BATCH):
+            headers, items = [], []
+            for index in range(batch_start, min(rows, batch_start + INSERT_BATCH)):
+                header, line_items = synthetic_invoice(index, items_per_invoice)
+                headers.append(header)
+                items.extend(line_items)
+
+            conn.execute("BEGIN")
+            conn.executemany('''
+            INSERT INTO crm_invoices (job_reference, invoice_number, customer_name, mbl_no, hbl_no, container_no, container_type, loading_port, discharge_port, shipper, consignee, terms, due_date, total_amount, currency)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', headers)
+            conn.executemany(
+                "INSERT INTO crm_line_items (job_reference, internal_code, description, amount) VALUES (?, ?, ?, ?)",
+                items
+            )
+            conn.execute("COMMIT")
+            logger.info(f"Inserted {min(rows, batch_start + INSERT_BATCH)}/{rows} invoices")
+
+        rebuild_charge_descriptions(conn)
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return time.perf_counter() - start
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build a synthetic CRM database for benchmarks")
+    parser.add_argument("--rows", type=int, default=10_000, help="Number of CRM invoices (10k to 10M)")
+    parser.add_argument("--items-per-invoice", type=int, default=3, help="Line items per invoice")
+    parser.add_argument("--db", default="benchmarks/data/crm.db", help="Output SQLite file")
+    args = parser.parse_args()
+
+    elapsed = build_crm_db(args.db, args.rows, args.items_per_invoice)
+    logger.info(f"Built {args.db} with {args.rows} invoices in {elapsed:.1f}s")
+
+if __name__ == "__main__":
+    main()
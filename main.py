@@ -1,14 +1,14 @@
 import os
+import sys
 import logging
 import argparse
 import json
-from dotenv import load_dotenv
 
-# Import components
-from src.extractor_azure import extract_invoice_data_llm
-from src.crm_tool import fetch_crm_data
-from src.comparator import compare_invoice_data
-from src.generator import generate_verified_invoice
+# Pipeline stages are imported inside main(), right before each step runs, so
+# argument parsing and early exits do not pay for the Azure SDK, LangChain,
+# Gemini, reportlab or pypdf imports.
+from src.config import load_env
+from src.metrics import format_summary
 
 # Configure logging
 logging.basicConfig(
@@ -22,8 +22,8 @@ logging.basicConfig(
 logger = logging.getLogger("MainPipeline")
 
 def main(pdf_path: str):
-    load_dotenv()
-    
+    load_env()
+
     if not os.path.exists(pdf_path):
         logger.error(f"File not found: {pdf_path}")
         return
@@ -34,6 +34,7 @@ def main(pdf_path: str):
     # Step 1: Extract Data (Azure Doc Intelligence)
     logger.info("Step 1: Extracting Structured Data using Azure Document Intelligence...")
     try:
+        from src.extractor_azure import extract_invoice_data_llm
         extracted_data = extract_invoice_data_llm(pdf_path)
         logger.info(f"Extracted Data: {extracted_data.model_dump_json(indent=2)}")
     except Exception as e:
@@ -42,13 +43,21 @@ def main(pdf_path: str):
 
     # Step 3: Fetch CRM Data
     logger.info("Step 3: Fetching CRM Data...")
+    from src.crm_tool import candidate_retrieval_enabled, candidate_summary, fetch_crm_data, find_crm_candidates
     # Use flexible matching with available fields
     crm_data = fetch_crm_data(
         job_reference=extracted_data.job_no,
         invoice_number=extracted_data.supplier_inv_no
     )
+
+    # No usable lookup key: retrieve likely records by party name, amount and due date
+    candidates = []
+    if not crm_data and candidate_retrieval_enabled():
+        candidates = find_crm_candidates(extracted_data)
+        if candidates:
+            logger.info(f"CRM candidates: {json.dumps(candidate_summary(candidates))}")
     
-    if not crm_data:
+    if not crm_data and not candidates:
         logger.warning(f"No matching CRM data found for extracted info.")
         print(json.dumps({
             "status": "MISMATCH",
@@ -56,11 +65,16 @@ def main(pdf_path: str):
             "differences": {"job_reference": "Not Found"}
         }, indent=2))
         return
-    logger.info(f"CRM Data: {json.dumps(crm_data, indent=2, default=str)}")
 
     # Step 4: AI Comparison
     logger.info("Step 4: Performing AI Comparison...")
-    comparison_result = compare_invoice_data(extracted_data, crm_data)
+    if candidates:
+        from src.comparator import compare_with_candidates
+        comparison_result, crm_data = compare_with_candidates(extracted_data, [candidate.crm_data for candidate in candidates])
+    else:
+        from src.comparator import compare_invoice_data
+        comparison_result = compare_invoice_data(extracted_data, crm_data)
+    logger.info(f"CRM Data: {json.dumps(crm_data, indent=2, default=str)}")
     logger.info(f"Comparison Result: {comparison_result.model_dump_json(indent=2)}")
 
     # Step 5 & 6: Generate Output
@@ -71,11 +85,14 @@ def main(pdf_path: str):
         "extracted": extracted_data.model_dump(),
         "crm": crm_data
     }
+    if candidates:
+        output_result["crm_candidates"] = candidate_summary(candidates)
 
     if comparison_result.status == "MATCH":
         logger.info("Step 5: Generating Verified Invoice...")
         output_pdf_path = "output/verified_invoice.pdf"
         try:
+            from src.generator import generate_verified_invoice
             generate_verified_invoice(extracted_data, output_pdf_path)
             output_result["verified_invoice_path"] = output_pdf_path
             logger.info(f"Verified invoice saved to {output_pdf_path}")
@@ -92,5 +109,20 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="AI Invoice Processing Pipeline")
     parser.add_argument("pdf_path", help="Path to the invoice PDF file")
     args = parser.parse_args()
-    
-    main(args.pdf_path)
+
+    # Before anything reads a setting (init_crm reads CRM_POOL_SIZE)
+    load_env()
+
+    from src.crm_tool import init_crm, dispose_crm
+    from src.crm_schema import SchemaVersionError
+    try:
+        init_crm()
+    except SchemaVersionError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    try:
+        main(args.pdf_path)
+    finally:
+        dispose_crm()
+        print("\n=== STAGE TIMINGS ===\n")
+        print(format_summary())
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+# Add parent directory to path to import src modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from thefuzz import process as legacy_process, fuzz as legacy_fuzz
+
+from src.models import InvoiceItem
+from src.comparator import calculate_fuzzy_scores
+
+CHARGES = [
+    "Ocean Freight", "Terminal Handling Charges", "THC", "Bill of Lading Fee", "Documentation Fee",
+    "Customs Clearance", "Delivery Order Fee", "Container Cleaning", "Demurrage", "Detention",
+    "Inland Haulage", "Port Security Surcharge", "Bunker Adjustment Factor", "Seal Fee", "Storage",
+    "Fuel Surcharge", "Insurance", "Telex Release", "Equipment Imbalance Surcharge", "Courier Charges",
+]
+
+def make_items(size: int, seed: int = 42):
+    """
+    Synthetic consolidated invoice: `size` charges with repetitive descriptions
+    and a CRM side holding the same charges reworded and shuffled.
+    """
+    rng = random.Random(seed)
+    # Consolidated statements repeat the same charge on a handful of containers
+    containers = [f"CNTR{rng.randint(1000000, 9999999)}" for _ in range(max(1, size // 25))]
+    invoice_items, crm_line_items = [], []
+    for i in range(size):
+        charge = rng.choice(CHARGES)
+        container = rng.choice(containers)
+        amount = round(rng.uniform(10, 5000), 2)
+        invoice_items.append(InvoiceItem(description=f"{charge} {container}", quantity=1.0, unit_price=amount, amount=amount))
+        crm_line_items.append({"internal_code": "N/A", "description": f"{container} - {charge.upper()}", "amount": amount})
+    rng.shuffle(crm_line_items)
+    return invoice_items, crm_line_items
+
+def legacy_scores(invoice_items, crm_line_items):
+    """The previous per-item extractOne loop, kept here for comparison."""
+    crm_desc_map = {item['description']: item for item in crm_line_items}
+    crm_descriptions = list(crm_desc_map.keys())
+    results = []
+    for item in invoice_items:
+        best_match, score = legacy_process.extractOne(item.description, crm_descriptions, scorer=legacy_fuzz.token_sort_ratio)
+        results.append({"best_crm_match": best_match, "similarity_score": score, "crm_item_details": crm_desc_map.get(best_match)})
+    return results
+
+def summarize(name, results, invoice_items, elapsed):
+    # Count by CRM line identity: descriptions themselves repeat
+    matched = [id(r["crm_item_details"]) for r in results if r["crm_item_details"] is not None]
+    duplicates = len(matched) - len(set(matched))
+    amount_ok = sum(
+        1 for item, r in zip(invoice_items, results)
+        if r["crm_item_details"] and abs(r["crm_item_details"]["amount"] - item.amount) <= 0.05
+    )
+    print(f"{name:<12} {elapsed * 1000:>10.1f} ms   duplicate CRM lines: {duplicates:>4}   amount-correct pairs: {amount_ok}/{len(invoice_items)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark line-item fuzzy scoring")
+    parser.add_argument("--size", type=int, default=500, help="Invoice and CRM line items per side")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed repetitions (best is reported)")
+    args = parser.parse_args()
+
+    invoice_items, crm_line_items = make_items(args.size)
+    print(f"Synthetic {args.size}x{args.size} line items")
+
+    for name, func in (("legacy", legacy_scores), ("vectorized", calculate_fuzzy_scores)):
+        best, results = None, None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results = func(invoice_items, crm_line_items)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        summarize(name, results, invoice_items, best)
+
+if __name__ == "__main__":
+    main()
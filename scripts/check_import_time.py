@@ -0,0 +1,82 @@
+import os
+import sys
+import argparse
+import subprocess
+
+# Run from the repository root so `src` and `main` resolve as they do in production
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heavy backends that must only load when their pipeline stage runs
+DEFERRED_MODULES = (
+    "azure.ai.documentintelligence",
+    "langchain_core",
+    "langchain_google_genai",
+    "langchain_community",
+    "google.generativeai",
+    "thefuzz",
+    "scipy",
+    "reportlab",
+    "pypdf",
+)
+
+# Entry point -> (budget in ms, deferred modules it may not import)
+ENTRY_POINTS = {
+    "main": (200, DEFERRED_MODULES),
+    "src.api": (1500, DEFERRED_MODULES),
+    "src.pipeline": (800, DEFERRED_MODULES),
+    "src.comparator": (600, DEFERRED_MODULES),
+    "src.extractor_azure": (600, DEFERRED_MODULES),
+    "src.extractor_llm": (600, DEFERRED_MODULES),
+    "src.crm_tool": (600, DEFERRED_MODULES),
+}
+
+def import_profile(module: str):
+    """
+    Imports `module` in a fresh interpreter with `-X importtime` and returns
+    (cumulative import time in ms, set of every module imported).
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr}")
+
+    total_us, imported = 0, set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative.isdigit():
+            continue  # header row
+        imported.add(name)
+        if name == module:
+            total_us = int(cumulative)
+    return total_us / 1000, imported
+
+def main():
+    parser = argparse.ArgumentParser(description="Check import-time budgets for the CLI and worker entry points")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget, e.g. for slow CI machines")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh-interpreter imports per entry point (best is used)")
+    args = parser.parse_args()
+
+    failures = []
+    for module, (budget_ms, deferred) in ENTRY_POINTS.items():
+        best_ms, imported = min(import_profile(module) for _ in range(args.repeat))
+        budget_ms *= args.scale
+        leaked = sorted(name for name in deferred if name in imported)
+
+        status = "OK" if best_ms <= budget_ms and not leaked else "FAIL"
+        print(f"[{status}] {module:<22} {best_ms:>8.1f} ms (budget {budget_ms:.0f} ms)")
+        if leaked:
+            print(f"       eagerly imports: {', '.join(leaked)}")
+        if status == "FAIL":
+            failures.append(module)
+
+    if failures:
+        print(f"\nImport-time budget exceeded for: {', '.join(failures)}")
+        sys.exit(1)
+    print("\nAll entry points are within their import-time budget.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import sqlite3
+import argparse
+import tempfile
+
+# Add parent directory to path to import src modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.crm_schema import migrate
+from src.crm_tool import lookup_query_plans, plan_scans
+
+def check_query_plans(conn: sqlite3.Connection) -> bool:
+    """
+    Verifies that every CRM lookup on `conn` is answered from an index rather
+    than a full table scan, printing each plan.
+    """
+    ok = True
+    for name, plan in lookup_query_plans(conn).items():
+        scans = plan_scans(plan)
+        status = "OK" if not scans else "FULL SCAN"
+        print(f"[{status}] {name}")
+        for step in plan:
+            print(f"    {step}")
+        ok = ok and not scans
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that CRM lookups use indexes")
+    parser.add_argument("--db", help="Check this (already migrated) CRM database instead of a fresh, empty one")
+    args = parser.parse_args()
+
+    if args.db:
+        conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+        try:
+            return check_query_plans(conn)
+        finally:
+            conn.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "crm.db"), isolation_level=None)
+        try:
+            migrate(conn)
+            return check_query_plans(conn)
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -1,14 +1,19 @@
 import os
 import sys
-import sqlite3
 import logging
-import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 # Add parent directory to path to import src modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.extractor_azure import extract_invoice_data_llm
+from src.rate_limit import TokenBucket
+from src.crm_tool import dispose_crm
+from src.crm_schema import migrate_db
+from src.crm_loader import CRMBulkWriter, DONE, source_file_info
+from src.comparison_cache import invalidate_comparisons
 
 # Configure logging
 logging.basicConfig(
@@ -20,100 +25,110 @@ logger = logging.getLogger("SystemInitializer")
 def setup_database(db_path="data/crm.db"):
     """Creates the database schema."""
     if os.path.exists(db_path):
+        # Drop pooled connections to the old file before it is replaced
+        dispose_crm(db_path)
         logger.info(f"Removing existing database: {db_path}")
         os.remove(db_path)
-        
+    # A leftover WAL from the old file must not be replayed into the new one
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
     logger.info(f"Creating new database: {db_path}")
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Create Invoices Table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS crm_invoices (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        job_reference TEXT,
-        customer_name TEXT,
-        mbl_no TEXT,
-        hbl_no TEXT,
-        container_no TEXT,
-        container_type TEXT,
-        loading_port TEXT,
-        discharge_port TEXT,
-        shipper TEXT,
-        consignee TEXT,
-        terms TEXT,
-        due_date TEXT,
-        total_amount REAL,
-        currency TEXT DEFAULT 'USD'
-    )
-    ''')
-    
-    # Create Line Items Table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS crm_line_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        job_reference TEXT,
-        internal_code TEXT,
-        description TEXT,
-        amount REAL,
-        FOREIGN KEY (job_reference) REFERENCES crm_invoices (job_reference)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("Database schema created successfully.")
-
-def process_invoices(sample_dir="data/sample_invoices", db_path="data/crm.db"):
-    """Processes all PDFs in the sample directory and populates the DB."""
+    version = migrate_db(db_path)
+    # Every CRM record is about to be rewritten
+    invalidate_comparisons()
+    logger.info(f"Database schema created successfully (version {version}).")
+
+def plan_ingestion(sample_dir, pdf_files, manifest):
+    """
+    Splits `pdf_files` into SourceFiles that need (re)processing and the names
+    of files already ingested at their current content. A file whose size and
+    mtime match its manifest entry is skipped without being hashed.
+    """
+    to_process, unchanged = [], []
+    for pdf_file in pdf_files:
+        path = os.path.join(sample_dir, pdf_file)
+        entry = manifest.get(pdf_file)
+        done = entry is not None and entry[3] == DONE
+
+        stat = os.stat(path)
+        if done and entry[1] == stat.st_size and entry[2] == stat.st_mtime_ns:
+            unchanged.append(pdf_file)
+            continue
+
+        source = source_file_info(path, pdf_file)
+        if done and entry[0] == source.sha256:
+            unchanged.append(pdf_file)
+            continue
+        to_process.append(source)
+    return to_process, unchanged
+
+def process_invoices(sample_dir="data/sample_invoices", db_path="data/crm.db", workers=None, rate=None, burst=None, batch_size=None):
+    """
+    Ingests the PDFs in the sample directory that are new or changed since the
+    last run, according to the ingestion manifest in the CRM database. Files
+    that failed or were not finished last time are retried, so an interrupted
+    run resumes where it stopped.
+
+    Extraction runs on `workers` threads that share one token bucket of `rate`
+    Azure calls per second, so throughput is bounded by the Azure tier rather
+    than a fixed sleep. Extracted invoices feed a single CRMBulkWriter on the
+    calling thread, which writes them in batched `executemany` transactions.
+    """
     if not os.path.exists(sample_dir):
         logger.error(f"Directory not found: {sample_dir}")
         return
 
-    pdf_files = [f for f in os.listdir(sample_dir) if f.lower().endswith('.pdf')]
-    total_files = len(pdf_files)
-    logger.info(f"Found {total_files} PDFs to process in {sample_dir}.")
-    
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    for i, pdf_file in enumerate(pdf_files):
-        pdf_path = os.path.join(sample_dir, pdf_file)
-        logger.info(f"Processing {i+1}/{total_files}: {pdf_file}...")
-        
-        try:
-            # Extract Data
-            data = extract_invoice_data_llm(pdf_path)
-            
-            # Insert Invoice
-            cursor.execute('''
-            INSERT INTO crm_invoices (job_reference, customer_name, mbl_no, hbl_no, container_no, container_type, loading_port, discharge_port, shipper, consignee, terms, due_date, total_amount, currency)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (data.job_reference, data.customer_name, data.mbl_no, data.hbl_no, data.container_no, data.container_type, data.loading_port, data.discharge_port, data.shipper, data.consignee, data.terms, data.due_date, data.total_amount, data.currency))
-            
-            # Insert Line Items
-            for item in data.items:
-                cursor.execute('''
-                INSERT INTO crm_line_items (job_reference, internal_code, description, amount)
-                VALUES (?, ?, ?, ?)
-                ''', (data.job_reference, "N/A", item.description, item.amount))
-            
-            conn.commit()
-            logger.info(f"Successfully processed {pdf_file}")
-            
-            # Add delay to avoid Rate Limit (429)
-            time.sleep(5)
-            
-        except Exception as e:
-            logger.error(f"Failed to process {pdf_file}: {e}")
+    workers = workers or int(os.getenv("INGEST_WORKERS", "4"))
+    rate = rate or float(os.getenv("AZURE_DI_RATE_LIMIT", "1.0"))
+    limiter = TokenBucket(rate=rate, capacity=burst)
+    batch_size = batch_size or int(os.getenv("INGEST_BATCH_SIZE", "500"))
+
+    pdf_files = sorted(f for f in os.listdir(sample_dir) if f.lower().endswith('.pdf'))
+
+    with CRMBulkWriter(db_path, batch_size=batch_size) as writer, ThreadPoolExecutor(max_workers=workers) as executor:
+        manifest = writer.manifest()
+        if not manifest and writer.untracked_invoices():
+            logger.warning("The CRM already holds invoices loaded without a manifest; run with --rebuild to avoid duplicates.")
+
+        to_process, unchanged = plan_ingestion(sample_dir, pdf_files, manifest)
+        total_files = len(to_process)
+        logger.info(f"Found {len(pdf_files)} PDFs in {sample_dir}: {total_files} new or changed, {len(unchanged)} unchanged ({workers} workers, {rate} req/s).")
+
+        futures = {
+            executor.submit(extract_invoice_data_llm, os.path.join(sample_dir, source.name), rate_limiter=limiter): source
+            for source in to_process
+        }
+
+        for i, future in enumerate(as_completed(futures)):
+            source = futures[future]
+            logger.info(f"Processing {i+1}/{total_files}: {source.name}...")
             
-    conn.close()
-    logger.info("Batch processing complete.")
+            try:
+                writer.add(future.result(), source=source)
+                logger.info(f"Successfully processed {source.name}")
+                
+            except Exception as e:
+                logger.error(f"Failed to process {source.name}: {e}")
+                writer.record_failure(source, str(e))
+
+    logger.info(f"Batch processing complete: {writer.invoices_written} invoices, {writer.line_items_written} line items.")
 
 def main():
     load_dotenv()
-    setup_database()
-    process_invoices()
+
+    parser = argparse.ArgumentParser(description="Initialize the CRM database from sample invoices")
+    parser.add_argument("--workers", type=int, default=None, help="Concurrent extraction workers (default: INGEST_WORKERS or 4)")
+    parser.add_argument("--rate", type=float, default=None, help="Azure requests per second (default: AZURE_DI_RATE_LIMIT or 1.0)")
+    parser.add_argument("--burst", type=float, default=None, help="Token bucket capacity (default: rate)")
+    parser.add_argument("--rebuild", action="store_true", help="Delete the CRM database and re-ingest every PDF")
+    parser.add_argument("--batch-size", type=int, default=None, help="Invoices per write transaction (default: INGEST_BATCH_SIZE or 500)")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        setup_database()
+    process_invoices(workers=args.workers, rate=args.rate, burst=args.burst, batch_size=args.batch_size)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+
+# Add parent directory to path to import src modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.crm_schema import SCHEMA_VERSION, migrate_db, read_schema_version
+from src.crm_tool import lookup_query_plans, plan_scans
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("CRMMigration")
+
+def main() -> int:
+    """
+    Applies pending CRM schema migrations ahead of a deploy (the API and CLI
+    refuse to start on an outdated schema), then verifies that every CRM lookup
+    on the migrated database uses an index. Exits 1 on either failure.
+    """
+    parser = argparse.ArgumentParser(description="Apply pending CRM schema migrations and verify lookup query plans")
+    parser.add_argument("--db", default="data/crm.db", help="CRM database (default: data/crm.db)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        logger.error(f"CRM database not found: {args.db} (create it with scripts/initialize_system.py)")
+        return 1
+
+    before = read_schema_version(args.db)
+    if before >= SCHEMA_VERSION:
+        logger.info(f"{args.db} is already at schema version {before}")
+    else:
+        start = time.perf_counter()
+        try:
+            version = migrate_db(args.db)
+        except Exception as e:
+            logger.error(f"Migration failed; {args.db} stays at schema version {read_schema_version(args.db)}: {e}")
+            return 1
+        logger.info(f"Migrated {args.db} from schema version {before} to {version} in {time.perf_counter() - start:.1f}s")
+
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    try:
+        failures = {name: plan_scans(plan) for name, plan in lookup_query_plans(conn).items()}
+    finally:
+        conn.close()
+    failures = {name: scans for name, scans in failures.items() if scans}
+    for name, scans in failures.items():
+        logger.error(f"Lookup '{name}' falls back to a full scan: {'; '.join(scans)}")
+    if failures:
+        return 1
+    logger.info("All CRM lookups use an index")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,7 @@
 import os
-import sqlite3
 import logging
 from src.extractor_azure import extract_invoice_data_llm
+from src.crm_loader import CRMBulkWriter, source_file_info
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -24,22 +24,9 @@ def process_single():
         data = extract_invoice_data_llm(pdf_path)
         logger.info(f"Extracted: {data}")
         
-        conn = sqlite3.connect("data/crm.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        INSERT INTO crm_invoices (job_reference, customer_name, total_amount, currency)
-        VALUES (?, ?, ?, ?)
-        ''', (data.job_reference, data.customer_name, data.total_amount, data.currency))
-        
-        for item in data.items:
-            cursor.execute('''
-            INSERT INTO crm_line_items (job_reference, internal_code, description, amount)
-            VALUES (?, ?, ?, ?)
-            ''', (data.job_reference, "N/A", item.description, item.amount))
-            
-        conn.commit()
-        conn.close()
+        # Same write path as the bulk seeding script (one transaction, stale comparisons invalidated)
+        with CRMBulkWriter("data/crm.db") as writer:
+            writer.add(data, source=source_file_info(pdf_path))
         logger.info("Successfully processed single invoice.")
         
     except Exception as e:
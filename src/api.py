@@ -1,85 +1,229 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-import shutil
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import json
+import asyncio
 import os
 import logging
-from dotenv import load_dotenv
+import zipfile
+from typing import BinaryIO, List, Tuple
+from contextlib import ExitStack, asynccontextmanager
 
-from src.extractor_azure import extract_invoice_data_llm
-from src.crm_tool import fetch_crm_data
-from src.comparator import compare_invoice_data
-from src.generator import generate_verified_invoice
+from src.extractor_azure import extract_invoice_data_async
+from src.pipeline import match_extracted_async, process_invoice_async, process_batch_async
+from src.crm_tool import init_crm, dispose_crm
+from src.job_queue import JobQueue, QueueFullError
+from src.metrics import render_prometheus
+from src.config import getenv
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("API")
 
-load_dotenv()
+JOB_WORKERS = int(getenv("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_SWEEP_INTERVAL = float(getenv("JOB_SWEEP_INTERVAL", "3600"))
+# Largest PDF accepted by POST /jobs; the payload is held in jobs.db until the job finishes
+JOB_MAX_BYTES = int(getenv("JOB_MAX_BYTES", str(50 * 1024 * 1024)))
 
-app = FastAPI(title="Invoice Matcher Service")
+async def _job_worker(queue: JobQueue, wake: asyncio.Event, worker_id: int):
+    """Drains the job queue; at most JOB_WORKERS of these run at once."""
+    while True:
+        job = await asyncio.to_thread(queue.claim)
+        if job is None:
+            # Sleep until a new job is enqueued (or poll again after a while)
+            try:
+                await asyncio.wait_for(wake.wait(), timeout=JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+            continue
+
+        job_id, filename, payload = job
+        logger.info(f"Worker {worker_id} processing job {job_id} ({filename})")
+        try:
+            # Prefix outputs with the job id so same-named uploads don't collide
+            result = await process_invoice_async(payload, f"{job_id}_{filename}")
+            await asyncio.to_thread(queue.complete, job_id, result)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            await asyncio.to_thread(queue.fail, job_id, str(e))
+
+async def _job_sweeper(queue: JobQueue):
+    """Deletes finished jobs past JOB_TTL every JOB_SWEEP_INTERVAL seconds, so jobs.db stays bounded."""
+    while True:
+        try:
+            await asyncio.to_thread(queue.purge_finished)
+        except Exception as e:
+            logger.warning(f"Job purge failed: {e}")
+        await asyncio.sleep(JOB_SWEEP_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Share one pooled CRM engine across all requests
+    init_crm()
+
+    # Build the Gemini comparison chain before the first request needs it
+    warmup = getenv("COMPARATOR_WARMUP", "1")
+    if warmup != "0":
+        from src.comparator import warm_up_comparator
+        try:
+            await asyncio.to_thread(warm_up_comparator, ping=(warmup == "ping"))
+        except Exception as e:
+            logger.warning(f"Comparator warm-up failed: {e}")
+
+    # Persistent job queue and its bounded worker pool
+    app.state.job_queue = JobQueue(
+        db_path=getenv("JOB_QUEUE_PATH", "data/jobs.db"),
+        max_pending=int(getenv("JOB_QUEUE_MAX", "100")),
+        ttl_seconds=int(getenv("JOB_TTL", str(7 * 24 * 3600))),
+        max_attempts=int(getenv("JOB_MAX_ATTEMPTS", "3"))
+    )
+    app.state.job_wake = asyncio.Event()
+    workers = [
+        asyncio.create_task(_job_worker(app.state.job_queue, app.state.job_wake, i))
+        for i in range(JOB_WORKERS)
+    ]
+    workers.append(asyncio.create_task(_job_sweeper(app.state.job_queue)))
+
+    yield
+
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    app.state.job_queue.close()
+    dispose_crm()
+
+app = FastAPI(title="Invoice Matcher Service", lifespan=lifespan)
 
 @app.post("/match")
 async def match_invoice(file: UploadFile = File(...)):
     """
     Endpoint to process an invoice PDF and match it against CRM data.
+    The upload is passed to the extractor in memory; nothing is written to disk.
     """
-    temp_file_path = f"temp_{file.filename}"
+    # Only the base name is used for the output file
+    filename = os.path.basename(file.filename or "invoice.pdf")
     
     try:
-        # Save uploaded file temporarily
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        logger.info(f"Processing file: {temp_file_path}")
+        logger.info(f"Processing file: {filename}")
 
-        # Step 1: Extract Data (Azure handles loading)
+        # Step 1: Extract Data straight from the (spooled) upload stream
         try:
-            logger.info("Step 1: Extracting Structured Data using Gemini LLM...")
-            extracted_data = extract_invoice_data_llm(temp_file_path)
+            logger.info("Step 1: Extracting Structured Data using Azure Document Intelligence...")
+            extracted_data = await extract_invoice_data_async(file.file)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to extract data: {str(e)}")
 
-        # Step 3: Fetch CRM Data
-        crm_data = fetch_crm_data(extracted_data.job_reference)
-        if not crm_data:
-            return JSONResponse(content={
-                "status": "MISMATCH",
-                "analysis": f"Job Reference {extracted_data.job_reference} not found in CRM.",
-                "differences": {"job_reference": "Not Found"}
-            })
-
-        # Step 4: AI Comparison (Hybrid: Fuzzy + LLM)
-        comparison_result = compare_invoice_data(extracted_data, crm_data)
-
-        # Step 5: Prepare Response
-        response_data = {
-            "status": comparison_result.status,
-            "analysis": comparison_result.analysis,
-            "field_level_comparison": comparison_result.field_level_comparison,
-            "extracted": extracted_data.model_dump(),
-            "crm": crm_data
-        }
-
-        # Generate Verified Invoice if MATCH
-        if comparison_result.status == "MATCH":
-            output_dir = "output"
-            os.makedirs(output_dir, exist_ok=True)
-            output_pdf_path = os.path.join(output_dir, f"verified_{file.filename}")
-            try:
-                generate_verified_invoice(extracted_data, output_pdf_path)
-                response_data["verified_invoice_path"] = output_pdf_path
-            except Exception as e:
-                logger.error(f"Failed to generate verified invoice: {e}")
-                response_data["verified_invoice_error"] = str(e)
-
-        return response_data
+        # Steps 3-5: CRM lookup, comparison and verified invoice generation
+        return await match_extracted_async(extracted_data, filename)
 
     except HTTPException as he:
         raise he
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
-    finally:
-        # Cleanup temp file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+
+@app.post("/jobs", status_code=202)
+async def create_job(file: UploadFile = File(...)):
+    """
+    Queues an invoice PDF for matching and returns immediately with a job id.
+    Responds 413 for files over JOB_MAX_BYTES and 503 when the queue is full.
+    """
+    filename = os.path.basename(file.filename or "invoice.pdf")
+    # The upload is already spooled to disk; check its size before reading it into memory
+    if _stream_size(file.file) > JOB_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File exceeds the limit of {JOB_MAX_BYTES} bytes.")
+    payload = await file.read()
+
+    try:
+        job_id = await asyncio.to_thread(app.state.job_queue.enqueue, filename, payload)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+    app.state.job_wake.set()
+    return {"job_id": job_id, "status": "pending"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Returns the status of a queued job and, once finished, its match result or error.
+    """
+    job = await asyncio.to_thread(app.state.job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+BATCH_MAX_FILES = int(getenv("BATCH_MAX_FILES", "500"))
+# Total uncompressed size of the PDFs in one batch
+BATCH_MAX_BYTES = int(getenv("BATCH_MAX_BYTES", str(512 * 1024 * 1024)))
+
+def _stream_size(stream: BinaryIO) -> int:
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+def _expand_uploads(uploads: List[Tuple[str, BinaryIO]]) -> List[Tuple[str, bytes]]:
+    """
+    Returns the PDFs contained in a batch upload: each file itself, or every PDF
+    inside a zip. The document count and uncompressed size are checked against
+    BATCH_MAX_FILES and BATCH_MAX_BYTES from upload sizes and zip directories
+    (ZipInfo.file_size) before any document is read; over the limit is a 413.
+    """
+    planned = []
+    count = size = 0
+    with ExitStack() as archives:
+        for filename, stream in uploads:
+            if zipfile.is_zipfile(stream):
+                archive = archives.enter_context(zipfile.ZipFile(stream))
+                members = [
+                    member for member in archive.infolist()
+                    if not member.is_dir() and member.filename.lower().endswith(".pdf")
+                ]
+                planned.extend((os.path.basename(member.filename), archive, member) for member in members)
+                count += len(members)
+                size += sum(member.file_size for member in members)
+            else:
+                planned.append((filename, stream, None))
+                count += 1
+                size += _stream_size(stream)
+
+            if count > BATCH_MAX_FILES:
+                raise HTTPException(status_code=413, detail=f"Batch of more than {BATCH_MAX_FILES} invoices exceeds the limit.")
+            if size > BATCH_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Batch exceeds the limit of {BATCH_MAX_BYTES} uncompressed bytes.")
+
+        # Reads are bounded by the checked sizes: zipfile stops at ZipInfo.file_size
+        return [
+            (name, source.read(member) if member is not None else source.read())
+            for name, source, member in planned
+        ]
+
+@app.post("/match/batch")
+async def match_invoice_batch(files: List[UploadFile] = File(...)):
+    """
+    Matches a bundle of invoices (several PDFs and/or zip archives of PDFs).
+    Results are streamed back as newline-delimited JSON, one line per invoice,
+    in the order they complete.
+    """
+    uploads = [(os.path.basename(file.filename or "invoice.pdf"), file.file) for file in files]
+    documents = await asyncio.to_thread(_expand_uploads, uploads)
+
+    if not documents:
+        raise HTTPException(status_code=400, detail="No PDF files found in upload.")
+
+    logger.info(f"Processing batch of {len(documents)} invoices")
+
+    async def stream_results():
+        async for result in process_batch_async(documents):
+            yield json.dumps(result, default=str) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Per-stage latency histograms, error counts and in-flight gauges in the
+    Prometheus text exposition format.
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """
+    Small persistent key/value cache backed by a SQLite file.
+
+    Entries are evicted least-recently-used first once the cache grows past
+    `max_bytes`, and expire after `ttl_seconds` (0 disables expiry).
+    Each entry may carry a `tag` so that related entries can be dropped together.
+    """
+
+    def __init__(self, db_path: str, namespace: str = "default", max_bytes: int = 256 * 1024 * 1024, ttl_seconds: int = 30 * 24 * 3600):
+        self.db_path = db_path
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            tag TEXT,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (namespace, accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_tag ON cache_entries (namespace, tag)")
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached value for `key`, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+
+            if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                row = None
+
+            if not row:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str, tag: Optional[str] = None):
+        """Stores `value` under `key` and evicts old entries if the cache is over budget."""
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, tag, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, value, tag, size, now, now)
+            )
+            self._evict(now)
+
+    def get_json(self, key: str) -> Optional[Any]:
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key: str, value: Any, tag: Optional[str] = None):
+        self.set(key, json.dumps(value, default=str), tag=tag)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def invalidate_tag(self, tag: str) -> int:
+        """Drops every entry carrying `tag`. Returns the number of entries removed."""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND tag = ?", (self.namespace, tag))
+            return cursor.rowcount
+
+    def clear(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+            return cursor.rowcount
+
+    def _evict(self, now: float):
+        if self.ttl_seconds:
+            self._conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND created_at < ?",
+                (self.namespace, now - self.ttl_seconds)
+            )
+
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Walk entries oldest-access first until we are back under budget
+        to_delete = []
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM cache_entries WHERE namespace = ? ORDER BY accessed_at ASC", (self.namespace,)
+        ):
+            if total <= self.max_bytes:
+                break
+            to_delete.append((self.namespace, key))
+            total -= size
+
+        self._conn.executemany("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", to_delete)
+        logger.info(f"Evicted {len(to_delete)} entries from cache '{self.namespace}'")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "entries": entries,
+            "size_bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,234 @@
+import re
+import time
+import sqlite3
+import logging
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.config import getenv
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = "data/crm.db"
+
+# Alias sources. Manual aliases are never overwritten by learned ones.
+MANUAL = "manual"
+LEARNED = "match"
+
+# Description score of an exact key hit or a manual alias
+EXACT_SCORE = 100
+
+_UPSERT_DESCRIPTION = '''
+INSERT INTO charge_descriptions (description_key, description, internal_code)
+VALUES (?, ?, ?)
+ON CONFLICT (description_key) DO NOTHING
+'''
+
+_UPSERT_ALIAS = '''
+INSERT INTO charge_aliases (alias_key, description_key, source, score, updated_at)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (alias_key) DO UPDATE SET
+    description_key = excluded.description_key, source = excluded.source, score = excluded.score, updated_at = excluded.updated_at
+WHERE charge_aliases.source != 'manual' OR excluded.source = 'manual'
+'''
+
+# Codes the loader writes for charges without an internal code
+_PLACEHOLDER_CODES = ("", "N/A")
+
+_indexes: Dict[str, "ChargeIndex"] = {}
+_indexes_lock = threading.Lock()
+
+@lru_cache(maxsize=65536)
+def description_key(description: Optional[str]) -> str:
+    """
+    Normalized token key of a charge description: lower-cased alphanumeric
+    tokens, sorted. Two descriptions share a key exactly when their
+    `token_sort_ratio` is 100, e.g. "Ocean Freight" and "FREIGHT - OCEAN".
+    """
+    return " ".join(sorted(re.findall(r"[^\W_]+", str(description or "").lower())))
+
+def description_rows(line_items: Iterable[tuple]) -> List[tuple]:
+    """charge_descriptions rows for (description, internal_code) pairs."""
+    return [
+        (description_key(description), description, internal_code)
+        for description, internal_code in line_items
+        if description and description_key(description)
+    ]
+
+def index_descriptions(conn: sqlite3.Connection, line_items: Iterable[tuple]):
+    """Adds new (description, internal_code) pairs to charge_descriptions, inside the caller's transaction."""
+    conn.executemany(_UPSERT_DESCRIPTION, description_rows(line_items))
+
+def rebuild_charge_descriptions(conn: sqlite3.Connection):
+    """Re-indexes every CRM line-item description (e.g. after a bulk load that bypassed the writer)."""
+    rows = description_rows(conn.execute("SELECT DISTINCT description, internal_code FROM crm_line_items"))
+    conn.execute("BEGIN")
+    try:
+        conn.execute("DELETE FROM charge_descriptions")
+        conn.executemany(_UPSERT_DESCRIPTION, rows)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+class ChargeIndex:
+    """
+    In-memory view of the persisted charge tables: the alias table maps the
+    description key of supplier wording to the key of the CRM charge it stands
+    for, and charge_descriptions maps CRM charge keys to their internal code.
+
+    `resolve` is a dictionary lookup: a supplier line whose key equals a CRM
+    line's key, directly or through an alias, needs no fuzzy scoring, and
+    `charge_code` names the CRM charge it resolved to. A learned alias keeps
+    the fuzzy score it was learned with, so it is not mistaken for an exact hit.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        # alias key -> (CRM description key, description score)
+        self._aliases: Dict[str, Tuple[str, int]] = {}
+        self._codes: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def _connect(self) -> sqlite3.Connection:
+        # mode=rw: never create an empty database where the CRM is missing
+        return sqlite3.connect(f"file:{self.db_path}?mode=rw", uri=True, isolation_level=None, timeout=5.0)
+
+    def load(self):
+        """(Re)reads the alias and charge code tables. A missing or unmigrated database leaves the index empty."""
+        try:
+            conn = self._connect()
+            try:
+                aliases = {
+                    alias_key: (target_key, score)
+                    for alias_key, target_key, score in conn.execute("SELECT alias_key, description_key, score FROM charge_aliases")
+                }
+                codes = dict(conn.execute(
+                    f"SELECT description_key, internal_code FROM charge_descriptions "
+                    f"WHERE internal_code IS NOT NULL AND internal_code NOT IN ({','.join('?' * len(_PLACEHOLDER_CODES))})",
+                    _PLACEHOLDER_CODES
+                ))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Charge tables unavailable in {self.db_path}: {e}")
+            aliases, codes = {}, {}
+        with self._lock:
+            self._aliases = aliases
+            self._codes = codes
+        logger.info(f"Loaded {len(aliases)} charge aliases and {len(codes)} charge codes from {self.db_path}")
+
+    def resolve(self, description: Optional[str]) -> Tuple[str, str, int]:
+        """(CRM description key, "alias" or "exact", description score) for a supplier description."""
+        key = description_key(description)
+        alias = self._aliases.get(key)
+        return (alias[0], "alias", alias[1]) if alias else (key, "exact", EXACT_SCORE)
+
+    def charge_code(self, key: Optional[str]) -> Optional[str]:
+        """Internal code of the CRM charge with description key `key`, if it has one."""
+        return self._codes.get(key) if key else None
+
+    def learn(self, pairs: Iterable[Tuple[str, str, int]], source: str = LEARNED) -> int:
+        """
+        Persists (supplier description, CRM description, description score)
+        triples as aliases and returns how many were stored. Pairs that already
+        share a key need no alias, and learned pairs never replace a manual alias.
+        """
+        rows = {}
+        for supplier_description, crm_description, score in pairs:
+            alias_key, target_key = description_key(supplier_description), description_key(crm_description)
+            if alias_key and target_key and alias_key != target_key and self._aliases.get(alias_key) != (target_key, score):
+                rows[alias_key] = (target_key, score)
+        if not rows:
+            return 0
+
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(_UPSERT_ALIAS, [
+                (alias_key, target_key, source, score, now) for alias_key, (target_key, score) in rows.items()
+            ])
+            # Re-read what was kept: learned rows do not replace manual aliases
+            stored = {
+                alias_key: (target_key, score)
+                for alias_key, target_key, score in conn.execute(
+                    f"SELECT alias_key, description_key, score FROM charge_aliases WHERE alias_key IN ({','.join('?' * len(rows))})",
+                    list(rows)
+                )
+            }
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._aliases.update(stored)
+        learned = sum(1 for alias_key, alias in rows.items() if stored.get(alias_key) == alias)
+        logger.info(f"Learned {learned} charge alias(es) ({source})")
+        return learned
+
+    def __len__(self) -> int:
+        return len(self._aliases)
+
+
+def get_charge_index(db_path: str = DEFAULT_DB_PATH) -> Optional[ChargeIndex]:
+    """Process-wide ChargeIndex for `db_path`, or None if disabled via CHARGE_INDEX=0."""
+    if getenv("CHARGE_INDEX", "1") == "0":
+        return None
+    index = _indexes.get(db_path)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(db_path)
+            if index is None:
+                index = ChargeIndex(db_path)
+                _indexes[db_path] = index
+    return index
+
+def reset_charge_index():
+    """Drops the cached indexes; the next lookup re-reads the alias table."""
+    with _indexes_lock:
+        _indexes.clear()
+
+def add_alias(supplier_description: str, crm_description: str, db_path: str = DEFAULT_DB_PATH) -> bool:
+    """Maps supplier wording to a CRM charge by hand. Manual aliases take precedence over learned ones."""
+    index = get_charge_index(db_path)
+    if index is None:
+        index = ChargeIndex(db_path)
+    conn = index._connect()
+    try:
+        known = conn.execute(
+            "SELECT 1 FROM charge_descriptions WHERE description_key = ?", (description_key(crm_description),)
+        ).fetchone()
+    finally:
+        conn.close()
+    if not known:
+        logger.warning(f"'{crm_description}' does not match any indexed CRM charge description")
+    return index.learn([(supplier_description, crm_description, EXACT_SCORE)], source=MANUAL) > 0
+
+def learn_from_fuzzy_results(fuzzy_results: List[dict], db_path: str = DEFAULT_DB_PATH) -> int:
+    """
+    Records confident fuzzy pairs from a MATCHed comparison as aliases, so the
+    same wording resolves without fuzzy scoring next time. Each alias keeps its
+    fuzzy score: the MATCH may be an LLM decision, and the rule-based fast path
+    (which wants a score of 100) must not treat it as verified.
+    """
+    index = get_charge_index(db_path)
+    if index is None:
+        return 0
+    # Fuzzy description score from which a pair is learned as an alias
+    threshold = int(getenv("CHARGE_ALIAS_LEARN_THRESHOLD", "85"))
+    pairs = [
+        (result["invoice_item"], result["best_crm_match"], int(result["similarity_score"]))
+        for result in fuzzy_results
+        if result.get("match_source") == "fuzzy" and result.get("similarity_score", 0) >= threshold
+    ]
+    if not pairs:
+        return 0
+    try:
+        return index.learn(pairs)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not store learned charge aliases: {e}")
+        return 0
@@ -1,67 +1,137 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
-from src.models import ComparisonResult, InvoiceData
-from thefuzz import process, fuzz
+from src.models import BatchComparisonResult, ComparisonResult, InvoiceData
+from src.reconciler import reconcile, get_fast_path_stats
+from src.comparison_cache import BATCH_PROMPT_VERSION, MODEL_NAME, get_cached_comparison, store_comparison
+from src.metrics import timed, track
+from src.config import getenv
+from src.charge_index import description_key, get_charge_index, learn_from_fuzzy_results
+from src.line_items import LineItemArray
+from src.rate_limit import outbound_limit
+from rapidfuzz import process, fuzz, utils
+import numpy as np
 import logging
-import os
 import json
+import asyncio
+import threading
+from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+def _amount_similarity(invoice_amounts: np.ndarray, crm_amounts: np.ndarray) -> np.ndarray:
+    """
+    0-100 closeness of every invoice amount to every CRM amount, on the same
+    scale as the description scores (100 = identical amounts).
+    """
+    diff = np.abs(invoice_amounts[:, None] - crm_amounts[None, :])
+    scale = np.maximum(np.maximum(np.abs(invoice_amounts[:, None]), np.abs(crm_amounts[None, :])), 1.0)
+    return 100.0 * (1.0 - np.minimum(diff / scale, 1.0))
+
+@timed("fuzzy_scoring")
 def calculate_fuzzy_scores(invoice_items: list, crm_line_items: list) -> list:
     """
     Pre-calculates fuzzy match scores between invoice items and CRM line items.
     Returns a list of dictionaries containing match details.
-    """
-    # Create a dictionary of CRM descriptions to their full objects for easy lookup
-    crm_desc_map = {item['description']: item for item in crm_line_items}
-    crm_descriptions = list(crm_desc_map.keys())
 
-    if not crm_descriptions:
+    Invoice items are first resolved through the charge index (src/charge_index):
+    an item whose normalized description key equals a CRM line's key, directly
+    or through an alias, is paired with such a line by amount without fuzzy
+    matching. Exact keys and manual aliases score 100; a learned alias keeps
+    the fuzzy score it was learned with. The remaining items get their description score
+    matrix in one batched rapidfuzz `cdist` call, and are assigned to at most
+    one remaining CRM line (and vice versa) by an optimal assignment over
+    description similarity and amount proximity. Invoice items left without a
+    CRM line get `best_crm_match=None` and a score of 0.
+
+    `match_source` records how each pair was found: "exact", "alias" or "fuzzy".
+    `charge_code` is the internal code of the CRM charge the item resolved to
+    (or, for a fuzzy pair, of its CRM line's charge) from charge_descriptions.
+    """
+    if not crm_line_items:
         return []
 
-    fuzzy_matches = []
+    from scipy.optimize import linear_sum_assignment
+
+    invoice_lines = LineItemArray.from_items(invoice_items)
+    crm_lines = LineItemArray.from_crm_items(crm_line_items)
+    invoice_descriptions, invoice_amounts = invoice_lines.descriptions, invoice_lines.amounts
+    crm_descriptions, crm_amounts = crm_lines.descriptions, crm_lines.amounts
+
+    # (crm index, description score, match source) per assigned invoice item
+    assignment: Dict[int, Tuple[int, int, str]] = {}
+    codes: Dict[int, Optional[str]] = {}
+
+    # 1. Dictionary hits: same normalized key as a CRM line, or a known alias of one
+    charge_index = get_charge_index()
+    if charge_index is not None:
+        crm_by_key: Dict[str, List[int]] = {}
+        for j, description in enumerate(crm_descriptions):
+            crm_by_key.setdefault(description_key(description), []).append(j)
+
+        invoice_by_key: Dict[str, List[int]] = {}
+        sources, scores = {}, {}
+        for i, description in enumerate(invoice_descriptions):
+            key, sources[i], scores[i] = charge_index.resolve(description)
+            codes[i] = charge_index.charge_code(key)
+            if key and key in crm_by_key:
+                invoice_by_key.setdefault(key, []).append(i)
+
+        for key, group_rows in invoice_by_key.items():
+            group_cols = crm_by_key[key]
+            # Repeated charges on one key pair up by closest amount
+            rows, cols = linear_sum_assignment(
+                _amount_similarity(invoice_amounts[group_rows], crm_amounts[group_cols]), maximize=True
+            )
+            for r, c in zip(rows.tolist(), cols.tolist()):
+                i = group_rows[r]
+                assignment[i] = (group_cols[c], scores[i], sources[i])
+
+    # 2. Fuzzy scoring for the items and CRM lines left over
+    open_rows = [i for i in range(len(invoice_items)) if i not in assignment]
+    taken = {j for j, _, _ in assignment.values()}
+    open_cols = [j for j in range(len(crm_line_items)) if j not in taken]
+
+    if open_rows and open_cols:
+        # Parallelising only pays off once the matrix is reasonably large
+        workers = int(getenv("FUZZY_WORKERS", "-1")) if len(open_rows) * len(open_cols) >= 10000 else 1
+        description_scores = process.cdist(
+            [invoice_descriptions[i] for i in open_rows],
+            [crm_descriptions[j] for j in open_cols],
+            scorer=fuzz.token_sort_ratio,
+            processor=utils.default_process,
+            workers=workers
+        )
+        # Share of the assignment score given to amount proximity (rest: description)
+        amount_weight = float(getenv("FUZZY_AMOUNT_WEIGHT", "0.3"))
+        combined = (1 - amount_weight) * description_scores + amount_weight * _amount_similarity(
+            invoice_amounts[open_rows], crm_amounts[open_cols]
+        )
 
-    for item in invoice_items:
-        # Find best match for invoice item description in CRM descriptions
-        result = process.extractOne(item.description, crm_descriptions, scorer=fuzz.token_sort_ratio)
-        if result:
-            best_match, score = result
+        rows, cols = linear_sum_assignment(combined, maximize=True)
+        for r, c in zip(rows.tolist(), cols.tolist()):
+            assignment[open_rows[r]] = (open_cols[c], int(round(float(description_scores[r, c]))), "fuzzy")
+
+    fuzzy_matches = []
+    for i, item in enumerate(invoice_items):
+        if i in assignment:
+            j, score, source = assignment[i]
+            best_match, details = crm_descriptions[j], crm_line_items[j]
+            if codes.get(i) is None and charge_index is not None:
+                codes[i] = charge_index.charge_code(description_key(best_match))
         else:
-            best_match, score = None, 0
-        
+            best_match, score, details, source = None, 0, None, None
+
         match_details = {
             "invoice_item": item.description,
             "best_crm_match": best_match,
             "similarity_score": score,
-            "crm_item_details": crm_desc_map.get(best_match)
+            "match_source": source,
+            "charge_code": codes.get(i),
+            "crm_item_details": details
         }
         fuzzy_matches.append(match_details)
         
     return fuzzy_matches
 
-def compare_invoice_data(extracted: InvoiceData, crm_data: dict) -> ComparisonResult:
-    """
-    Compares extracted invoice data with CRM data using a hybrid approach:
-    1. Fuzzy Matching for line item descriptions.
-    2. LLM for reasoning and final decision making.
-    """
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY environment variable is not set.")
-
-    # 1. Perform Fuzzy Matching
-    logger.info("Performing fuzzy matching on line items...")
-    crm_line_items = crm_data.get("line_items", [])
-    fuzzy_results = calculate_fuzzy_scores(extracted.items, crm_line_items)
-    logger.info(f"Fuzzy Match Results: {json.dumps(fuzzy_results, indent=2)}")
-
-    # 2. Prepare LLM
-    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0, google_api_key=api_key)
-    structured_llm = llm.with_structured_output(ComparisonResult)
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are an expert financial auditor. Your task is to compare data extracted from an Agent Invoice against the Internal Purchase Records (CRM).
+_SYSTEM_PROMPT = """You are an expert financial auditor. Your task is to compare data extracted from an Agent Invoice against the Internal Purchase Records (CRM).
         
         You have access to:
         1. Extracted Invoice Data.
@@ -95,8 +165,9 @@ def compare_invoice_data(extracted: InvoiceData, crm_data: dict) -> ComparisonRe
         
         4. Output:
            - Return the result in the specified JSON structure.
-        """),
-        ("user", """
+        """
+
+_USER_PROMPT = """
         Extracted Agent Invoice Data:
         {extracted_json}
         
@@ -107,39 +178,372 @@ def compare_invoice_data(extracted: InvoiceData, crm_data: dict) -> ComparisonRe
         {fuzzy_json}
         
         Compare them and provide the status and analysis.
-        """)
+        """
+
+# Appended to the system prompt when several invoices share one request
+_BATCH_INSTRUCTIONS = """
+        BATCH MODE:
+        - You will receive several independent comparisons, each tagged with an 'invoice_key'.
+        - Apply the rules above to each comparison on its own; never use data from one comparison in another.
+        - Return exactly one result per comparison, copying its 'invoice_key' unchanged.
+        """
+
+_BATCH_USER_PROMPT = """
+        Comparisons (each has invoice_key, extracted invoice, CRM data and fuzzy match scores):
+        {comparisons_json}
+
+        Compare each invoice with its CRM data and provide the status and analysis for every invoice_key.
+        """
+
+# Long-lived comparison chains keyed by (kind, API key). The chains and the
+# Gemini client they share, with its HTTP connections, are built once per
+# process; LangChain runnables are safe to invoke from several threads at once.
+_chains = {}
+_llms = {}
+_chains_lock = threading.Lock()
+
+def _build_comparison_chain(llm):
+    """
+    Builds the prompt | structured LLM chain used for the final comparison.
+    LangChain is imported here, so processes that never reach the LLM step
+    (fast path, cache hits) do not pay for loading it.
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+
+    structured_llm = llm.with_structured_output(ComparisonResult)
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", _SYSTEM_PROMPT),
+        ("user", _USER_PROMPT)
     ])
 
-    chain = prompt | structured_llm
+    return prompt | structured_llm
 
-    logger.info("Invoking LLM for data comparison...")
-    try:
-        # Convert models/dicts to JSON strings for the prompt
-        extracted_json = extracted.model_dump_json(indent=2)
-        crm_json = json.dumps(crm_data, default=str, indent=2)
-        fuzzy_json = json.dumps(fuzzy_results, indent=2)
-
-        result = chain.invoke({
-            "extracted_json": extracted_json,
-            "crm_json": crm_json,
-            "fuzzy_json": fuzzy_json
-        })
-         
-        if result is None:
-            logger.error("LLM returned None. Creating default MISMATCH response.")
-            return ComparisonResult(
-                status="MISMATCH",
-                analysis="LLM comparison failed to return a result.",
-                field_level_comparison={"error": "LLM returned None"}
-            )
-        
-        logger.info(f"Comparison complete. Status: {result.status}")
-        return result
-    except Exception as e:
-        logger.error(f"Error during comparison: {e}")
-        # Return a default MISMATCH result instead of raising
+def _build_batch_comparison_chain(llm):
+    """Same rules as the single chain, answering with one keyed result per invoice."""
+    from langchain_core.prompts import ChatPromptTemplate
+
+    structured_llm = llm.with_structured_output(BatchComparisonResult)
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", _SYSTEM_PROMPT + _BATCH_INSTRUCTIONS),
+        ("user", _BATCH_USER_PROMPT)
+    ])
+
+    return prompt | structured_llm
+
+_CHAIN_BUILDERS = {
+    "single": _build_comparison_chain,
+    "batch": _build_batch_comparison_chain,
+}
+
+def _get_chain(kind: str, api_key: str = None):
+    api_key = api_key or getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable is not set.")
+
+    chain = _chains.get((kind, api_key))
+    if chain is None:
+        with _chains_lock:
+            chain = _chains.get((kind, api_key))
+            if chain is None:
+                llm = _llms.get(api_key)
+                if llm is None:
+                    from langchain_google_genai import ChatGoogleGenerativeAI
+                    llm = ChatGoogleGenerativeAI(model=MODEL_NAME, temperature=0, google_api_key=api_key)
+                    _llms[api_key] = llm
+
+                logger.info(f"Building LLM comparison chain ({kind})")
+                chain = _CHAIN_BUILDERS[kind](llm)
+                _chains[(kind, api_key)] = chain
+    return chain
+
+def get_comparison_chain(api_key: str = None):
+    """
+    Returns the process-wide comparison chain, building it on first use.
+    Raises ValueError when no GOOGLE_API_KEY is configured.
+    """
+    return _get_chain("single", api_key)
+
+def get_batch_comparison_chain(api_key: str = None):
+    """Process-wide chain for compare_invoice_batch; shares the Gemini client with the single chain."""
+    return _get_chain("batch", api_key)
+
+def reset_comparison_chain():
+    """Drops cached chains, e.g. after rotating GOOGLE_API_KEY."""
+    with _chains_lock:
+        _chains.clear()
+        _llms.clear()
+
+def warm_up_comparator(ping: bool = False):
+    """
+    Builds the comparison chain ahead of the first invoice. With `ping`, also
+    sends one minimal request so the Gemini connection is already open.
+    """
+    get_comparison_chain()
+    if ping:
+        api_key = getenv("GOOGLE_API_KEY")
+        _llms[api_key].invoke("ping")
+    logger.info("LLM comparison chain is warm")
+
+def _prompt_inputs(extracted: InvoiceData, crm_data: dict, fuzzy_results: list) -> dict:
+    # Convert models/dicts to JSON strings for the prompt
+    return {
+        "extracted_json": extracted.model_dump_json(indent=2),
+        "crm_json": json.dumps(crm_data, default=str, indent=2),
+        "fuzzy_json": json.dumps(fuzzy_results, indent=2)
+    }
+
+def _handle_llm_result(result) -> ComparisonResult:
+    if result is None:
+        logger.error("LLM returned None. Creating default MISMATCH response.")
         return ComparisonResult(
             status="MISMATCH",
-            analysis=f"Error during comparison: {str(e)}",
-            field_level_comparison={"error": str(e)}
+            analysis="LLM comparison failed to return a result.",
+            field_level_comparison={"error": "LLM returned None"}
         )
+    
+    logger.info(f"Comparison complete. Status: {result.status}")
+    return result
+
+def _error_result(e: Exception) -> ComparisonResult:
+    logger.error(f"Error during comparison: {e}")
+    # Return a default MISMATCH result instead of raising
+    return ComparisonResult(
+        status="MISMATCH",
+        analysis=f"Error during comparison: {str(e)}",
+        field_level_comparison={"error": str(e)}
+    )
+
+def _fast_path(extracted: InvoiceData, crm_data: dict, fuzzy_results: list, use_fast_path: bool):
+    if not use_fast_path or getenv("COMPARATOR_FAST_PATH", "1") == "0":
+        return None
+    result = reconcile(extracted, crm_data, fuzzy_results)
+    logger.info(f"Fast path stats: {get_fast_path_stats()}")
+    return result
+
+def _learn_aliases(result: ComparisonResult, fuzzy_results: list):
+    """A MATCH confirms its fuzzy line pairings; remember the confident ones as charge aliases."""
+    if result is not None and result.status == "MATCH":
+        learn_from_fuzzy_results(fuzzy_results)
+
+def compare_invoice_data(extracted: InvoiceData, crm_data: dict, use_fast_path: bool = True, use_cache: bool = True) -> ComparisonResult:
+    """
+    Compares extracted invoice data with CRM data using a hybrid approach:
+    1. Fuzzy Matching for line item descriptions.
+    2. Rule-based reconciliation, which settles unambiguous cases on its own.
+    3. LLM for reasoning and final decision making on everything else.
+       LLM decisions are cached by a canonical hash of the inputs, so identical
+       comparisons return instantly and deterministically.
+    A MATCH teaches the charge index the confident fuzzy line pairings.
+    """
+    # 1. Perform Fuzzy Matching
+    logger.info("Performing fuzzy matching on line items...")
+    crm_line_items = crm_data.get("line_items", [])
+    fuzzy_results = calculate_fuzzy_scores(extracted.items, crm_line_items)
+    logger.info(f"Fuzzy Match Results: {json.dumps(fuzzy_results, indent=2)}")
+
+    # 2. Deterministic fast path
+    result = _fast_path(extracted, crm_data, fuzzy_results, use_fast_path)
+
+    # 3. Reuse an earlier LLM decision on identical inputs
+    if result is None and use_cache:
+        result = get_cached_comparison(extracted, crm_data)
+
+    # 4. LLM decision
+    if result is None:
+        result = _compare_with_llm(extracted, crm_data, fuzzy_results, use_cache)
+
+    _learn_aliases(result, fuzzy_results)
+    return result
+
+def _compare_with_llm(extracted: InvoiceData, crm_data: dict, fuzzy_results: list, use_cache: bool) -> ComparisonResult:
+    # Shared, pre-built LLM chain
+    chain = get_comparison_chain()
+
+    logger.info("Invoking LLM for data comparison...")
+    try:
+        with track("llm_comparison"), outbound_limit("gemini").hold():
+            result = chain.invoke(_prompt_inputs(extracted, crm_data, fuzzy_results))
+    except Exception as e:
+        return _error_result(e)
+
+    if result is not None and use_cache:
+        store_comparison(extracted, crm_data, result)
+    return _handle_llm_result(result)
+
+async def compare_invoice_data_async(extracted: InvoiceData, crm_data: dict, use_fast_path: bool = True, use_cache: bool = True) -> ComparisonResult:
+    """
+    Async variant of compare_invoice_data. Fuzzy scoring runs in a worker thread
+    and the LLM is awaited via `ainvoke`, so the event loop is never blocked.
+    """
+    logger.info("Performing fuzzy matching on line items...")
+    crm_line_items = crm_data.get("line_items", [])
+    fuzzy_results = await asyncio.to_thread(calculate_fuzzy_scores, extracted.items, crm_line_items)
+    logger.info(f"Fuzzy Match Results: {json.dumps(fuzzy_results, indent=2)}")
+
+    result = _fast_path(extracted, crm_data, fuzzy_results, use_fast_path)
+
+    if result is None and use_cache:
+        result = await asyncio.to_thread(get_cached_comparison, extracted, crm_data)
+
+    if result is None:
+        result = await _compare_with_llm_async(extracted, crm_data, fuzzy_results, use_cache)
+
+    await asyncio.to_thread(_learn_aliases, result, fuzzy_results)
+    return result
+
+async def _compare_with_llm_async(extracted: InvoiceData, crm_data: dict, fuzzy_results: list, use_cache: bool) -> ComparisonResult:
+    chain = get_comparison_chain()
+
+    logger.info("Invoking LLM for data comparison (async)...")
+    try:
+        async with outbound_limit("gemini").ahold():
+            with track("llm_comparison"):
+                result = await chain.ainvoke(_prompt_inputs(extracted, crm_data, fuzzy_results))
+    except Exception as e:
+        return _error_result(e)
+
+    if result is not None and use_cache:
+        await asyncio.to_thread(store_comparison, extracted, crm_data, result)
+    return _handle_llm_result(result)
+
+def estimate_tokens(text: str) -> int:
+    """Rough Gemini token count (about four characters per token)."""
+    return len(text) // 4 + 1
+
+def _batch_entry(invoice_key: str, extracted: InvoiceData, crm_data: dict, fuzzy_results: list) -> dict:
+    return {
+        "invoice_key": invoice_key,
+        "extracted": extracted.model_dump(mode="json"),
+        "crm": crm_data,
+        "fuzzy_scores": fuzzy_results,
+    }
+
+def pack_batches(entries: List[dict], token_budget: int = None, max_invoices: int = None) -> List[List[dict]]:
+    """
+    Splits batch entries, in order, into requests whose estimated prompt size
+    (instructions included) stays within `token_budget` and which hold at most
+    `max_invoices` entries (defaults: COMPARISON_BATCH_TOKEN_BUDGET and
+    COMPARISON_BATCH_MAX_INVOICES). An entry too large for the budget on its
+    own is sent in a request of its own.
+    """
+    token_budget = token_budget or int(getenv("COMPARISON_BATCH_TOKEN_BUDGET", "30000"))
+    max_invoices = max_invoices or int(getenv("COMPARISON_BATCH_MAX_INVOICES", "10"))
+    overhead = estimate_tokens(_SYSTEM_PROMPT + _BATCH_INSTRUCTIONS + _BATCH_USER_PROMPT)
+
+    batches, current, used = [], [], overhead
+    for entry in entries:
+        size = estimate_tokens(json.dumps(entry, default=str, indent=2))
+        if current and (used + size > token_budget or len(current) >= max_invoices):
+            batches.append(current)
+            current, used = [], overhead
+        current.append(entry)
+        used += size
+    if current:
+        batches.append(current)
+    return batches
+
+def compare_invoice_batch(
+    invoices: Dict[str, Tuple[InvoiceData, dict]],
+    use_fast_path: bool = True,
+    use_cache: bool = True,
+    token_budget: Optional[int] = None,
+    max_invoices: Optional[int] = None
+) -> Dict[str, ComparisonResult]:
+    """
+    Batch mode of compare_invoice_data for offline reconciliation runs.
+    `invoices` maps a caller-chosen key to an (extracted, crm_data) pair; the
+    result maps every key to its ComparisonResult.
+
+    Fuzzy scoring, the fast path and the comparison cache apply per invoice as
+    usual. The remaining invoices are packed into as few Gemini requests as the
+    token budget allows, each returning one result per invoice key. Invoices a
+    batch response leaves out (or a failed batch request) fall back to a
+    single-invoice LLM call.
+    """
+    results: Dict[str, ComparisonResult] = {}
+    pending: Dict[str, Tuple[InvoiceData, dict, list]] = {}
+    all_fuzzy_results: Dict[str, list] = {}
+
+    for key, (extracted, crm_data) in invoices.items():
+        fuzzy_results = calculate_fuzzy_scores(extracted.items, crm_data.get("line_items", []))
+        all_fuzzy_results[key] = fuzzy_results
+
+        fast_result = _fast_path(extracted, crm_data, fuzzy_results, use_fast_path)
+        if fast_result is not None:
+            results[key] = fast_result
+            continue
+
+        if use_cache:
+            # Either prompt's decision will do; fallbacks below are cached under the single-invoice one
+            cached = get_cached_comparison(extracted, crm_data, BATCH_PROMPT_VERSION) or get_cached_comparison(extracted, crm_data)
+            if cached is not None:
+                results[key] = cached
+                continue
+
+        pending[key] = (extracted, crm_data, fuzzy_results)
+
+    if pending:
+        _compare_pending_batches(pending, results, use_cache, token_budget, max_invoices)
+
+    for key, result in results.items():
+        _learn_aliases(result, all_fuzzy_results[key])
+    return results
+
+def _compare_pending_batches(
+    pending: Dict[str, Tuple[InvoiceData, dict, list]],
+    results: Dict[str, ComparisonResult],
+    use_cache: bool,
+    token_budget: Optional[int],
+    max_invoices: Optional[int]
+):
+    """Batched LLM requests for the invoices compare_invoice_batch could not settle locally; fills `results`."""
+    chain = get_batch_comparison_chain()
+    batches = pack_batches(
+        [_batch_entry(key, *entry) for key, entry in pending.items()],
+        token_budget=token_budget,
+        max_invoices=max_invoices
+    )
+    logger.info(f"Comparing {len(pending)} invoice(s) in {len(batches)} batched LLM request(s)")
+
+    for batch in batches:
+        keys = [entry["invoice_key"] for entry in batch]
+        requested = set(keys)
+        returned: Dict[str, ComparisonResult] = {}
+        try:
+            with track("llm_comparison_batch"), outbound_limit("gemini").hold():
+                response = chain.invoke({"comparisons_json": json.dumps(batch, default=str, indent=2)})
+            for item in (response.results if response is not None else []):
+                # Ignore keys the model invented or repeated
+                if item.invoice_key in requested and item.invoice_key not in returned:
+                    returned[item.invoice_key] = ComparisonResult(**item.model_dump(exclude={"invoice_key"}))
+        except Exception as e:
+            logger.error(f"Batched comparison request failed: {e}")
+
+        for key in keys:
+            extracted, crm_data, fuzzy_results = pending[key]
+            result = returned.get(key)
+            if result is None:
+                logger.warning(f"Batch response did not cover invoice {key}; comparing it on its own")
+                results[key] = _compare_with_llm(extracted, crm_data, fuzzy_results, use_cache)
+                continue
+            if use_cache:
+                store_comparison(extracted, crm_data, result, BATCH_PROMPT_VERSION)
+            results[key] = _handle_llm_result(result)
+
+def compare_with_candidates(extracted: InvoiceData, crm_candidates: List[dict], use_fast_path: bool = True, use_cache: bool = True) -> Tuple[ComparisonResult, dict]:
+    """
+    Compares `extracted` against several retrieved CRM records (best first) with
+    one compare_invoice_batch call. Returns the first MATCH with its record, or
+    the result for the best-ranked record when none matches.
+    """
+    results = compare_invoice_batch(
+        {str(rank): (extracted, crm_data) for rank, crm_data in enumerate(crm_candidates)},
+        use_fast_path=use_fast_path,
+        use_cache=use_cache
+    )
+    for rank, crm_data in enumerate(crm_candidates):
+        if results[str(rank)].status == "MATCH":
+            return results[str(rank)], crm_data
+    return results["0"], crm_candidates[0]
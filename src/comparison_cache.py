@@ -0,0 +1,93 @@
+import json
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+from src.cache import DiskCache
+from src.config import getenv
+from src.models import ComparisonResult, InvoiceData
+
+logger = logging.getLogger(__name__)
+
+# Bump PROMPT_VERSION whenever the comparison prompt or output handling changes,
+# and BATCH_PROMPT_VERSION whenever the batched comparison prompt does
+PROMPT_VERSION = "1"
+BATCH_PROMPT_VERSION = "batch-1"
+MODEL_NAME = "gemini-2.0-flash"
+
+_comparison_cache: Optional[DiskCache] = None
+_comparison_cache_lock = threading.Lock()
+
+def get_comparison_cache() -> Optional[DiskCache]:
+    """
+    Returns the process-wide LLM comparison cache, or None if disabled via COMPARISON_CACHE=0.
+    """
+    global _comparison_cache
+    if getenv("COMPARISON_CACHE", "1") == "0":
+        return None
+    with _comparison_cache_lock:
+        if _comparison_cache is None:
+            _comparison_cache = DiskCache(
+                db_path=getenv("COMPARISON_CACHE_PATH", "data/comparison_cache.db"),
+                namespace="llm_comparison",
+                max_bytes=int(getenv("COMPARISON_CACHE_MAX_BYTES", str(128 * 1024 * 1024))),
+                ttl_seconds=int(getenv("COMPARISON_CACHE_TTL", str(90 * 24 * 3600)))
+            )
+    return _comparison_cache
+
+def _sorted_items(items: list) -> list:
+    # Line-item order carries no meaning for the comparison
+    return sorted(items, key=lambda item: json.dumps(item, sort_keys=True, default=str))
+
+def comparison_cache_key(extracted: InvoiceData, crm_data: dict, prompt_version: str = PROMPT_VERSION) -> str:
+    """
+    Canonical hash of the comparison inputs: the extracted invoice, the CRM record
+    (line items order-independent) and the prompt/model version. Decisions from
+    the batched prompt use BATCH_PROMPT_VERSION, so they are keyed apart.
+    """
+    extracted_dump = extracted.model_dump(mode="json")
+    extracted_dump["items"] = _sorted_items(extracted_dump.get("items", []))
+    crm_dump = dict(crm_data)
+    crm_dump["line_items"] = _sorted_items(list(crm_dump.get("line_items", [])))
+
+    canonical = json.dumps(
+        {"extracted": extracted_dump, "crm": crm_dump, "prompt_version": prompt_version, "model": MODEL_NAME},
+        sort_keys=True, default=str, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _crm_tag(crm_data: dict) -> Optional[str]:
+    return crm_data.get("job_reference")
+
+def get_cached_comparison(extracted: InvoiceData, crm_data: dict, prompt_version: str = PROMPT_VERSION) -> Optional[ComparisonResult]:
+    cache = get_comparison_cache()
+    if cache is None:
+        return None
+    cached = cache.get(comparison_cache_key(extracted, crm_data, prompt_version))
+    if cached is None:
+        return None
+    logger.info(f"Comparison cache hit for Job Reference {_crm_tag(crm_data)}")
+    return ComparisonResult.model_validate_json(cached)
+
+def store_comparison(extracted: InvoiceData, crm_data: dict, result: ComparisonResult, prompt_version: str = PROMPT_VERSION):
+    cache = get_comparison_cache()
+    if cache is not None:
+        cache.set(comparison_cache_key(extracted, crm_data, prompt_version), result.model_dump_json(), tag=_crm_tag(crm_data))
+
+def invalidate_comparisons(job_reference: Optional[str] = None) -> int:
+    """
+    Drops cached comparisons for a CRM record that changed, or every cached
+    comparison when `job_reference` is None. Returns the number of entries removed.
+    """
+    cache = get_comparison_cache()
+    if cache is None:
+        return 0
+    if job_reference is None:
+        removed = cache.clear()
+        logger.info(f"Cleared {removed} cached comparisons")
+        return removed
+    removed = cache.invalidate_tag(job_reference)
+    if removed:
+        logger.info(f"Invalidated {removed} cached comparisons for Job Reference {job_reference}")
+    return removed
@@ -0,0 +1,26 @@
+import os
+import threading
+from typing import Optional
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+def load_env():
+    """
+    Loads `.env` into os.environ once per process. Variables that are already
+    set win. Entry points call this explicitly; library modules read settings
+    through getenv() below instead of loading `.env` at import time.
+    """
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _env_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_loaded = True
+
+def getenv(name: str, default: Optional[str] = None) -> Optional[str]:
+    """os.getenv, after making sure `.env` has been loaded."""
+    load_env()
+    return os.getenv(name, default)
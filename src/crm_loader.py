@@ -0,0 +1,206 @@
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+from typing import Dict, List, NamedTuple, Optional
+
+from src.models import InvoiceData
+from src.crm_schema import migrate
+from src.reconciler import normalize_date
+from src.charge_index import index_descriptions
+from src.comparison_cache import invalidate_comparisons
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = "data/crm.db"
+
+_INSERT_INVOICE = '''
+INSERT INTO crm_invoices (job_reference, invoice_number, customer_name, mbl_no, hbl_no, container_no, container_type, loading_port, discharge_port, shipper, consignee, terms, due_date, total_amount, currency, source_file)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+_INSERT_LINE_ITEM = '''
+INSERT INTO crm_line_items (job_reference, internal_code, description, amount, source_file)
+VALUES (?, ?, ?, ?, ?)
+'''
+
+_UPSERT_MANIFEST = '''
+INSERT INTO ingest_manifest (source_file, sha256, size, mtime_ns, status, error, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (source_file) DO UPDATE SET
+    sha256 = excluded.sha256, size = excluded.size, mtime_ns = excluded.mtime_ns,
+    status = excluded.status, error = excluded.error, updated_at = excluded.updated_at
+'''
+
+# Manifest statuses. Only DONE files are skipped by incremental ingestion.
+DONE = "done"
+FAILED = "failed"
+
+# Loader connection settings: WAL lets readers (the API) keep working during a
+# load, and synchronous=NORMAL only fsyncs at checkpoints, not on every commit.
+LOADER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA busy_timeout=5000",
+)
+
+class SourceFile(NamedTuple):
+    """A PDF being ingested, identified by its name within the sample directory."""
+    name: str
+    sha256: str
+    size: int
+    mtime_ns: int
+
+def source_file_info(path: str, name: Optional[str] = None) -> SourceFile:
+    """Hashes `path` and captures its size and modification time."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    stat = os.stat(path)
+    return SourceFile(name or os.path.basename(path), digest.hexdigest(), stat.st_size, stat.st_mtime_ns)
+
+def load_manifest(conn: sqlite3.Connection) -> Dict[str, tuple]:
+    """source_file -> (sha256, size, mtime_ns, status) for every file ingested so far."""
+    rows = conn.execute("SELECT source_file, sha256, size, mtime_ns, status FROM ingest_manifest")
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def invoice_row(data: InvoiceData, source_file: Optional[str] = None) -> tuple:
+    """
+    crm_invoices row for an extracted invoice; CRM-only columns are read if
+    present. due_date is stored as YYYY-MM-DD so candidate retrieval can range
+    over it as text.
+    """
+    return (
+        data.job_no, data.supplier_inv_no, data.customer_name,
+        getattr(data, "mbl_no", None), getattr(data, "hbl_no", None), getattr(data, "container_no", None),
+        getattr(data, "container_type", None), getattr(data, "loading_port", None), getattr(data, "discharge_port", None),
+        getattr(data, "shipper", None), getattr(data, "consignee", None), getattr(data, "terms", None),
+        normalize_date(data.due_date) or None, getattr(data, "total_amount", None), data.currency, source_file
+    )
+
+def line_item_rows(data: InvoiceData, source_file: Optional[str] = None) -> List[tuple]:
+    return [(data.job_no, "N/A", item.description, item.amount, source_file) for item in data.items]
+
+
+class CRMBulkWriter:
+    """
+    Single writer for seeding the CRM database.
+
+    Extraction can run on any number of threads, but every row goes through one
+    writer (on one thread), which buffers invoices and writes them with
+    `executemany` in one transaction per batch. A batch is flushed once it holds
+    `batch_size` invoices or its oldest invoice has waited `flush_seconds`.
+
+    Invoices added with a `source` also record that file in the ingestion
+    manifest, in the same transaction as its rows. Rows previously loaded from
+    the same file are replaced, so a file is either fully ingested at its
+    current hash or not at all, even if the process stops mid-run.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, batch_size: int = 500, flush_seconds: float = 5.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.invoices_written = 0
+        self.line_items_written = 0
+
+        self._conn = sqlite3.connect(db_path, isolation_level=None)
+        migrate(self._conn)
+        for pragma in LOADER_PRAGMAS:
+            self._conn.execute(pragma)
+
+        self._invoices: List[tuple] = []
+        self._line_items: List[tuple] = []
+        self._job_references: List[str] = []
+        self._sources: Dict[str, SourceFile] = {}
+        # Files whose earlier rows were already replaced by this writer
+        self._replaced: set = set()
+        self._oldest = None
+
+    def add(self, data: InvoiceData, source: Optional[SourceFile] = None):
+        """Buffers one extracted invoice and its line items."""
+        source_file = source.name if source else None
+        self._invoices.append(invoice_row(data, source_file))
+        self._line_items.extend(line_item_rows(data, source_file))
+        if source:
+            self._sources[source.name] = source
+        if data.job_no:
+            self._job_references.append(data.job_no)
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+        if len(self._invoices) >= self.batch_size or time.monotonic() - self._oldest >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Writes every buffered invoice in a single transaction."""
+        if not self._invoices:
+            return
+
+        replace = [(name,) for name in self._sources if name not in self._replaced]
+        now = time.time()
+
+        self._conn.execute("BEGIN")
+        try:
+            if replace:
+                # Comparisons against the rows being replaced go stale as well
+                self._job_references.extend(
+                    row[0] for row in self._conn.execute(
+                        f"SELECT DISTINCT job_reference FROM crm_invoices WHERE source_file IN ({','.join('?' * len(replace))}) AND job_reference IS NOT NULL",
+                        [name for (name,) in replace]
+                    )
+                )
+                self._conn.executemany("DELETE FROM crm_line_items WHERE source_file = ?", replace)
+                self._conn.executemany("DELETE FROM crm_invoices WHERE source_file = ?", replace)
+            self._conn.executemany(_INSERT_INVOICE, self._invoices)
+            self._conn.executemany(_INSERT_LINE_ITEM, self._line_items)
+            index_descriptions(self._conn, ((row[2], row[1]) for row in self._line_items))
+            self._conn.executemany(_UPSERT_MANIFEST, [
+                (source.name, source.sha256, source.size, source.mtime_ns, DONE, None, now)
+                for source in self._sources.values()
+            ])
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._replaced.update(name for (name,) in replace)
+
+        self.invoices_written += len(self._invoices)
+        self.line_items_written += len(self._line_items)
+        logger.info(f"Wrote {len(self._invoices)} invoices / {len(self._line_items)} line items ({self.invoices_written} invoices total)")
+
+        # Cached LLM comparisons against these records are now stale
+        for job_reference in dict.fromkeys(self._job_references):
+            invalidate_comparisons(job_reference)
+
+        self._invoices, self._line_items, self._job_references = [], [], []
+        self._sources = {}
+        self._oldest = None
+
+    def record_failure(self, source: SourceFile, error: str):
+        """Marks a file as failed so the next incremental run retries it; its earlier rows are kept."""
+        self._conn.execute(_UPSERT_MANIFEST, (source.name, source.sha256, source.size, source.mtime_ns, FAILED, error, time.time()))
+
+    def manifest(self) -> Dict[str, tuple]:
+        return load_manifest(self._conn)
+
+    def untracked_invoices(self) -> int:
+        """Invoices loaded without a source file (before the manifest existed)."""
+        return self._conn.execute("SELECT COUNT(*) FROM crm_invoices WHERE source_file IS NULL").fetchone()[0]
+
+    def close(self):
+        try:
+            self.flush()
+            self._conn.execute("PRAGMA optimize")
+        finally:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,216 @@
+import sqlite3
+import logging
+import re
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Ordered schema migrations: (version, description, statements).
+# The applied version is tracked in SQLite's PRAGMA user_version.
+# Never edit a released migration; append a new one instead.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "initial schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS crm_invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_reference TEXT,
+            customer_name TEXT,
+            mbl_no TEXT,
+            hbl_no TEXT,
+            container_no TEXT,
+            container_type TEXT,
+            loading_port TEXT,
+            discharge_port TEXT,
+            shipper TEXT,
+            consignee TEXT,
+            terms TEXT,
+            due_date TEXT,
+            total_amount REAL,
+            currency TEXT DEFAULT 'USD'
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS crm_line_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_reference TEXT,
+            internal_code TEXT,
+            description TEXT,
+            amount REAL,
+            FOREIGN KEY (job_reference) REFERENCES crm_invoices (job_reference)
+        )
+        ''',
+    ]),
+    (2, "lookup indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_crm_invoices_job_reference ON crm_invoices (job_reference)",
+        "CREATE INDEX IF NOT EXISTS idx_crm_invoices_mbl_no ON crm_invoices (mbl_no)",
+        "CREATE INDEX IF NOT EXISTS idx_crm_invoices_hbl_no ON crm_invoices (hbl_no)",
+        "CREATE INDEX IF NOT EXISTS idx_crm_line_items_job_reference ON crm_line_items (job_reference)",
+    ]),
+    (3, "supplier invoice number", [
+        "ALTER TABLE crm_invoices ADD COLUMN invoice_number TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_crm_invoices_invoice_number ON crm_invoices (invoice_number)",
+    ]),
+    (4, "ingestion manifest", [
+        "ALTER TABLE crm_invoices ADD COLUMN source_file TEXT",
+        "ALTER TABLE crm_line_items ADD COLUMN source_file TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_crm_invoices_source_file ON crm_invoices (source_file)",
+        "CREATE INDEX IF NOT EXISTS idx_crm_line_items_source_file ON crm_line_items (source_file)",
+        '''
+        CREATE TABLE IF NOT EXISTS ingest_manifest (
+            source_file TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            size INTEGER,
+            mtime_ns INTEGER,
+            status TEXT NOT NULL,
+            error TEXT,
+            updated_at REAL NOT NULL
+        )
+        ''',
+    ]),
+    (5, "candidate retrieval", [
+        # Nearest-amount / nearest-date probes within one currency are index seeks
+        "CREATE INDEX IF NOT EXISTS idx_crm_invoices_currency_amount ON crm_invoices (currency, total_amount)",
+        "CREATE INDEX IF NOT EXISTS idx_crm_invoices_currency_due_date ON crm_invoices (currency, due_date)",
+        # Trigram full-text index over the party names, kept in sync by triggers
+        "CREATE VIRTUAL TABLE IF NOT EXISTS crm_invoices_fts USING fts5(customer_name, shipper, consignee, content='crm_invoices', content_rowid='id', tokenize='trigram')",
+        '''
+        CREATE TRIGGER IF NOT EXISTS crm_invoices_fts_insert AFTER INSERT ON crm_invoices BEGIN
+            INSERT INTO crm_invoices_fts (rowid, customer_name, shipper, consignee)
+            VALUES (new.id, new.customer_name, new.shipper, new.consignee);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS crm_invoices_fts_delete AFTER DELETE ON crm_invoices BEGIN
+            INSERT INTO crm_invoices_fts (crm_invoices_fts, rowid, customer_name, shipper, consignee)
+            VALUES ('delete', old.id, old.customer_name, old.shipper, old.consignee);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS crm_invoices_fts_update AFTER UPDATE OF customer_name, shipper, consignee ON crm_invoices BEGIN
+            INSERT INTO crm_invoices_fts (crm_invoices_fts, rowid, customer_name, shipper, consignee)
+            VALUES ('delete', old.id, old.customer_name, old.shipper, old.consignee);
+            INSERT INTO crm_invoices_fts (rowid, customer_name, shipper, consignee)
+            VALUES (new.id, new.customer_name, new.shipper, new.consignee);
+        END
+        ''',
+        "INSERT INTO crm_invoices_fts (crm_invoices_fts) VALUES ('rebuild')",
+    ]),
+    (6, "ISO due dates", [
+        # due_date_v6() is registered on the connection by migrate()
+        '''
+        UPDATE crm_invoices SET due_date = due_date_v6(due_date)
+        WHERE due_date IS NOT NULL AND due_date IS NOT due_date_v6(due_date)
+        ''',
+    ]),
+    (7, "charge description index", [
+        '''
+        CREATE TABLE IF NOT EXISTS charge_descriptions (
+            description_key TEXT PRIMARY KEY,
+            description TEXT NOT NULL,
+            internal_code TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS charge_aliases (
+            alias_key TEXT PRIMARY KEY,
+            description_key TEXT NOT NULL,
+            source TEXT NOT NULL,
+            score INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        ''',
+        # description_key() is registered on the connection by migrate()
+        '''
+        INSERT OR IGNORE INTO charge_descriptions (description_key, description, internal_code)
+        SELECT description_key(description), description, internal_code FROM crm_line_items
+        WHERE description IS NOT NULL AND description_key(description) != ''
+        ORDER BY id
+        ''',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Date formats as of migration 6. Frozen: later changes to
+# reconciler.normalize_date must not change what this migration writes.
+_DUE_DATE_FORMATS_V6 = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%m/%d/%Y", "%d %b %Y", "%d-%b-%Y", "%d %B %Y", "%b %d, %Y")
+
+def _due_date_v6(value: Optional[str]) -> Optional[str]:
+    text = str(value or "").strip()
+    for fmt in _DUE_DATE_FORMATS_V6:
+        try:
+            return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return text or None
+
+# Description key as of migration 7. Frozen: later changes to
+# charge_index.description_key must not change what this migration writes
+# (charge_index.rebuild_charge_descriptions re-keys with the current one).
+def _description_key_v7(description: Optional[str]) -> str:
+    return " ".join(sorted(re.findall(r"[^\W_]+", str(description or "").lower())))
+
+# SQL functions the migrations call, registered on the connection by migrate()
+_MIGRATION_FUNCTIONS: Dict[str, Callable] = {
+    "due_date_v6": _due_date_v6,
+    "description_key": _description_key_v7,
+}
+
+
+class SchemaVersionError(RuntimeError):
+    """The CRM database is missing, or behind SCHEMA_VERSION."""
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def read_schema_version(db_path: str) -> int:
+    """Applied schema version of `db_path`, read without creating or migrating the file."""
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    except sqlite3.OperationalError as e:
+        raise SchemaVersionError(f"CRM database {db_path} cannot be opened: {e}") from e
+    try:
+        return get_schema_version(conn)
+    finally:
+        conn.close()
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Applies every pending migration, each in its own transaction.
+    Returns the resulting schema version.
+    """
+    current = get_schema_version(conn)
+    for name, function in _MIGRATION_FUNCTIONS.items():
+        conn.create_function(name, 1, function, deterministic=True)
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+
+        logger.info(f"Applying CRM schema migration {version}: {description}")
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            # PRAGMA does not accept bound parameters
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        current = version
+
+    return current
+
+def migrate_db(db_path: str) -> int:
+    """Opens `db_path` and brings its schema up to date."""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str, params=()) -> List[str]:
+    """Returns the `detail` column of EXPLAIN QUERY PLAN for `sql`."""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
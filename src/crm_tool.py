@@ -1,71 +1,516 @@
-from langchain_community.utilities import SQLDatabase
+import re
+import sqlite3
 import logging
+import threading
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from src.crm_schema import SCHEMA_VERSION, SchemaVersionError, explain_query_plan, migrate_db, read_schema_version
+from src.config import getenv
+from src.metrics import record_error, timed
+from src.models import InvoiceData
+
+if TYPE_CHECKING:
+    from src.line_items import LineItemArray
 
 logger = logging.getLogger(__name__)
 
-def fetch_crm_data(job_reference: str = None, mbl_no: str = None, hbl_no: str = None, invoice_number: str = None, db_path: str = "data/crm.db") -> dict:
+DEFAULT_DB_PATH = "data/crm.db"
+
+# Process-wide engines keyed by database path. Each engine owns a connection pool
+# and is created once, without schema reflection.
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+# Lookup columns in priority order; each one is backed by an index (see crm_schema)
+_LOOKUP_FIELDS = ("job_reference", "mbl_no", "hbl_no", "invoice_number")
+
+_LINE_ITEMS_QUERY = text(
+    "SELECT internal_code, description, amount FROM crm_line_items WHERE job_reference = :job_reference"
+)
+
+_LINE_ITEMS_BULK_QUERY = text(
+    "SELECT job_reference, internal_code, description, amount FROM crm_line_items WHERE job_reference IN :job_references ORDER BY id"
+).bindparams(bindparam("job_references", expanding=True))
+
+# Bookkeeping columns that are not part of the CRM record handed to the comparator
+_INTERNAL_COLUMNS = ("lookup_priority", "source_file")
+
+# Keys per bulk statement; keeps bound parameters well under SQLite's limit
+BULK_CHUNK_SIZE = 1000
+
+# Bulk lookup key: (job_reference, mbl_no, hbl_no, invoice_number)
+CRMKey = Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]
+
+def _check_schema(db_path: str, migrate: bool):
+    """
+    Applies pending migrations when `migrate` is set, then requires the schema to
+    be current. A failed migration propagates, so nothing runs on a half-migrated CRM.
+    """
+    version = migrate_db(db_path) if migrate else read_schema_version(db_path)
+    if version < SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"CRM database {db_path} is at schema version {version}, expected {SCHEMA_VERSION}. "
+            f"Run `python scripts/migrate_crm.py --db {db_path}` (or set CRM_AUTO_MIGRATE=1)."
+        )
+
+def init_crm(db_path: str = DEFAULT_DB_PATH, migrate: Optional[bool] = None) -> Engine:
+    """
+    Creates (or returns) the shared pooled engine for `db_path`. Call at process
+    start-up; pair with dispose_crm() on shutdown.
+
+    Raises SchemaVersionError when the schema is not current, so the API and CLI
+    refuse to start instead of serving from an outdated CRM. Pending migrations
+    are applied here only when `migrate` is true (default: CRM_AUTO_MIGRATE=1);
+    large CRMs are migrated ahead of time with scripts/migrate_crm.py.
+    """
+    if migrate is None:
+        migrate = getenv("CRM_AUTO_MIGRATE", "0") == "1"
+    with _engines_lock:
+        engine = _engines.get(db_path)
+        if engine is None:
+            _check_schema(db_path, migrate)
+            engine = create_engine(
+                f"sqlite:///{db_path}",
+                poolclass=QueuePool,
+                pool_size=int(getenv("CRM_POOL_SIZE", "5")),
+                max_overflow=int(getenv("CRM_POOL_MAX_OVERFLOW", "10")),
+                connect_args={"check_same_thread": False}
+            )
+            _engines[db_path] = engine
+            logger.info(f"CRM engine initialised for {db_path}")
+        return engine
+
+def dispose_crm(db_path: Optional[str] = None):
+    """
+    Closes pooled connections for `db_path`, or for every engine if omitted.
+    """
+    with _engines_lock:
+        paths = [db_path] if db_path else list(_engines)
+        for path in paths:
+            engine = _engines.pop(path, None)
+            if engine is not None:
+                engine.dispose()
+                logger.info(f"CRM engine disposed for {path}")
+
+def get_crm_engine(db_path: str = DEFAULT_DB_PATH) -> Engine:
+    engine = _engines.get(db_path)
+    return engine if engine is not None else init_crm(db_path)
+
+def build_lookup_sql(fields: Tuple[str, ...]) -> str:
+    """
+    Header lookup as a UNION ALL of single-column equality probes instead of one
+    `OR` predicate, so every branch is an index search. The first branch (in
+    _LOOKUP_FIELDS priority order) that finds a row wins.
+    """
+    branches = [
+        f"SELECT * FROM (SELECT {priority} AS lookup_priority, * FROM crm_invoices WHERE {field} = :{field} LIMIT 1)"
+        for priority, field in enumerate(fields)
+    ]
+    return " UNION ALL ".join(branches) + " ORDER BY lookup_priority LIMIT 1"
+
+@lru_cache(maxsize=None)
+def _invoice_query(fields: Tuple[str, ...]):
+    """Builds (once per field combination) the header lookup statement."""
+    return text(build_lookup_sql(fields))
+
+@timed("crm_lookup")
+def fetch_crm_data(job_reference: str = None, mbl_no: str = None, hbl_no: str = None, invoice_number: str = None, db_path: str = DEFAULT_DB_PATH) -> dict:
     """
     Fetches invoice data from the CRM SQL database using Job Reference or other fields.
     """
-    # SQLAlchemy connection string for SQLite
-    uri = f"sqlite:///{db_path}"
-    
     try:
-        db = SQLDatabase.from_uri(uri)
-        
-        # Using SQLAlchemy engine directly for cleaner dict return
-        from sqlalchemy import text
-        with db._engine.connect() as connection:
-            # Build query dynamically based on available fields
-            conditions = []
-            params = {}
-            
-            if job_reference:
-                conditions.append("job_reference = :job_reference")
-                params["job_reference"] = job_reference
-            if mbl_no:
-                conditions.append("mbl_no = :mbl_no")
-                params["mbl_no"] = mbl_no
-            if hbl_no:
-                conditions.append("hbl_no = :hbl_no")
-                params["hbl_no"] = hbl_no
-            if invoice_number:
-                # Assuming invoice_number might match job_reference or some other field if needed, 
-                # but usually it matches invoice_number if we had that column. 
-                # Current schema doesn't seem to have invoice_number column in crm_invoices?
-                # Let's check setup_db.py. It has job_reference, customer_name, mbl, hbl, ports, amount.
-                # It does NOT have invoice_number. So we can't match on it unless we add it.
-                # For now, let's skip invoice_number matching or assume it might be job_reference.
-                pass
-
-            if not conditions:
+        engine = get_crm_engine(db_path)
+
+        with engine.connect() as connection:
+            # Build query based on available fields
+            params = {
+                field: value
+                for field, value in zip(_LOOKUP_FIELDS, (job_reference, mbl_no, hbl_no, invoice_number))
+                if value
+            }
+
+            if not params:
                 logger.warning("No search criteria provided for CRM lookup.")
                 return {}
 
-            where_clause = " OR ".join(conditions)
-            invoice_query = f"SELECT * FROM crm_invoices WHERE {where_clause} LIMIT 1"
-            
+            invoice_query = _invoice_query(tuple(params))
+
             logger.info(f"Executing CRM query: {invoice_query} with params {params}")
-            invoice_result = connection.execute(text(invoice_query), params).mappings().one_or_none()
-            
+            invoice_result = connection.execute(invoice_query, params).mappings().one_or_none()
+
             if not invoice_result:
                 logger.warning(f"No CRM data found for criteria: {params}")
                 return {}
-            
+
             invoice_data = dict(invoice_result)
-            
+            for column in _INTERNAL_COLUMNS:
+                invoice_data.pop(column, None)
+
             # Fetch Line Items using the found job_reference (primary key for items)
             found_job_ref = invoice_data.get("job_reference")
             if found_job_ref:
-                items_query = "SELECT internal_code, description, amount FROM crm_line_items WHERE job_reference = :job_reference"
-                items_result = connection.execute(text(items_query), {"job_reference": found_job_ref}).mappings().all()
+                items_result = connection.execute(_LINE_ITEMS_QUERY, {"job_reference": found_job_ref}).mappings().all()
                 invoice_data['line_items'] = [dict(item) for item in items_result]
             else:
                 invoice_data['line_items'] = []
-            
+
             logger.info(f"Found CRM data for Job Reference {found_job_ref}")
             return invoice_data
-            
+
     except Exception as e:
+        record_error("crm_lookup")
         logger.error(f"Error fetching CRM data: {e}")
         return {}
+
+@timed("crm_lookup_bulk")
+def fetch_line_item_arrays(job_references: Iterable[str], db_path: str = DEFAULT_DB_PATH) -> Dict[str, "LineItemArray"]:
+    """
+    Line items of many CRM records as LineItemArrays, built with
+    LineItemArray.from_rows from the cursor rows (no dict per line). For
+    high-volume total and amount checks; job references without line items
+    map to an empty array.
+    """
+    # NumPy is only loaded by callers that ask for arrays
+    from src.line_items import LineItemArray
+
+    unique_refs = list(dict.fromkeys(ref for ref in job_references if ref))
+    rows_by_ref: Dict[str, list] = {ref: [] for ref in unique_refs}
+    try:
+        engine = get_crm_engine(db_path)
+        with engine.connect() as connection:
+            for start in range(0, len(unique_refs), BULK_CHUNK_SIZE):
+                chunk = unique_refs[start:start + BULK_CHUNK_SIZE]
+                for job_reference, *row in connection.execute(_LINE_ITEMS_BULK_QUERY, {"job_references": chunk}):
+                    rows_by_ref[job_reference].append(row)
+    except Exception as e:
+        record_error("crm_lookup_bulk")
+        logger.error(f"Error fetching CRM line items: {e}")
+    return {ref: LineItemArray.from_rows(rows) for ref, rows in rows_by_ref.items()}
+
+def crm_key(job_reference: str = None, mbl_no: str = None, hbl_no: str = None, invoice_number: str = None) -> CRMKey:
+    """Builds a key for fetch_crm_data_bulk, with the same arguments as fetch_crm_data."""
+    return (job_reference or None, mbl_no or None, hbl_no or None, invoice_number or None)
+
+def build_bulk_lookup_sql(key_count: int) -> str:
+    """
+    Resolves `key_count` lookup keys in one statement. Keys are joined against
+    each indexed lookup column; per key, the match from the highest-priority
+    column wins, as in fetch_crm_data.
+    """
+    values = ", ".join(["(?, ?, ?, ?, ?)"] * key_count)
+    probes = " UNION ALL ".join(
+        f"SELECT k.key_index, {priority} AS lookup_priority, i.id FROM lookup_keys k JOIN crm_invoices i ON i.{field} = k.{field}"
+        for priority, field in enumerate(_LOOKUP_FIELDS)
+    )
+    return f"""
+    WITH lookup_keys (key_index, {", ".join(_LOOKUP_FIELDS)}) AS (VALUES {values}),
+    matches AS ({probes}),
+    ranked AS (
+        SELECT key_index, id, ROW_NUMBER() OVER (PARTITION BY key_index ORDER BY lookup_priority, id) AS match_rank
+        FROM matches
+    )
+    SELECT ranked.key_index, crm_invoices.*
+    FROM ranked JOIN crm_invoices ON crm_invoices.id = ranked.id
+    WHERE ranked.match_rank = 1
+    """
+
+@timed("crm_lookup_bulk")
+def fetch_crm_data_bulk(keys: Iterable[CRMKey], db_path: str = DEFAULT_DB_PATH) -> Dict[CRMKey, dict]:
+    """
+    Bulk variant of fetch_crm_data. Resolves all invoice headers with one query
+    and all of their line items with one `IN` query (per BULK_CHUNK_SIZE keys),
+    instead of two queries per key.
+
+    Returns a dict mapping every requested key to its CRM record, or to {} when
+    the key has no criteria or no match.
+    """
+    unique_keys: List[CRMKey] = list(dict.fromkeys(tuple(key) for key in keys))
+    results: Dict[CRMKey, dict] = {key: {} for key in unique_keys}
+    searchable = [key for key in unique_keys if any(key)]
+    if not searchable:
+        return results
+
+    try:
+        engine = get_crm_engine(db_path)
+
+        with engine.connect() as connection:
+            for start in range(0, len(searchable), BULK_CHUNK_SIZE):
+                chunk = searchable[start:start + BULK_CHUNK_SIZE]
+                params = tuple(value for index, key in enumerate(chunk) for value in (index, *key))
+
+                rows = connection.exec_driver_sql(build_bulk_lookup_sql(len(chunk)), params).mappings().all()
+                for row in rows:
+                    invoice_data = dict(row)
+                    invoice_data.pop("key_index")
+                    for column in _INTERNAL_COLUMNS:
+                        invoice_data.pop(column, None)
+                    invoice_data["line_items"] = []
+                    results[chunk[row["key_index"]]] = invoice_data
+
+                # One query for the line items of every header found in this chunk
+                by_job_ref: Dict[str, List[dict]] = {}
+                for key in chunk:
+                    found_job_ref = results[key].get("job_reference")
+                    if found_job_ref:
+                        by_job_ref.setdefault(found_job_ref, [])
+                if by_job_ref:
+                    items_result = connection.execute(_LINE_ITEMS_BULK_QUERY, {"job_references": list(by_job_ref)}).mappings().all()
+                    for item in items_result:
+                        item = dict(item)
+                        by_job_ref[item.pop("job_reference")].append(item)
+
+                for key in chunk:
+                    found_job_ref = results[key].get("job_reference")
+                    if found_job_ref:
+                        results[key]["line_items"] = [dict(item) for item in by_job_ref[found_job_ref]]
+
+        found = sum(1 for record in results.values() if record)
+        logger.info(f"Bulk CRM lookup resolved {found}/{len(unique_keys)} keys")
+        return results
+
+    except Exception as e:
+        record_error("crm_lookup_bulk")
+        logger.error(f"Error fetching CRM data in bulk: {e}")
+        return results
+
+
+# --- Candidate retrieval ---
+# Used when an invoice carries no lookup key that fetch_crm_data can resolve.
+# Settings are read per call, so `.env` overrides apply whenever it is loaded.
+
+
+class CandidateSettings(NamedTuple):
+    """CRM_CANDIDATE_* settings for one find_crm_candidates call."""
+    k: int
+    # Rows the amount and due-date channels may each contribute before scoring
+    channel_limit: int
+    # Newest name matches scored; bm25 ordering would visit every match of a common name
+    name_scan_limit: int
+    # Relative distance at which the amount score reaches 0
+    amount_tolerance: float
+    # Days between due dates at which the date score reaches 0
+    date_window_days: int
+    # Candidates scoring below this are not returned
+    min_score: float
+
+def candidate_settings() -> CandidateSettings:
+    """Current CRM_CANDIDATE_* settings."""
+    return CandidateSettings(
+        k=int(getenv("CRM_CANDIDATE_K", "5")),
+        channel_limit=int(getenv("CRM_CANDIDATE_CHANNEL_LIMIT", "50")),
+        name_scan_limit=int(getenv("CRM_CANDIDATE_NAME_SCAN_LIMIT", "500")),
+        amount_tolerance=float(getenv("CRM_CANDIDATE_AMOUNT_TOLERANCE", "0.05")),
+        date_window_days=int(getenv("CRM_CANDIDATE_DATE_WINDOW_DAYS", "30")),
+        min_score=float(getenv("CRM_CANDIDATE_MIN_SCORE", "0.3")),
+    )
+
+def candidate_retrieval_enabled() -> bool:
+    """Whether lookups that find nothing fall back to find_crm_candidates (CRM_CANDIDATE_RETRIEVAL)."""
+    return getenv("CRM_CANDIDATE_RETRIEVAL", "1") != "0"
+
+# Share of the candidate score per feature; features the invoice lacks are left out
+_CANDIDATE_WEIGHTS = {"name": 0.5, "amount": 0.35, "date": 0.15}
+
+_NAME_COLUMNS = ("customer_name", "shipper", "consignee")
+
+# Company-name words too common to narrow a full-text search
+_NAME_STOPWORDS = frozenset({
+    "the", "and", "llc", "ltd", "limited", "inc", "corp", "company", "co", "fze", "fzco", "fzc",
+    "general", "trading", "group", "international", "intl", "services", "logistics", "shipping",
+})
+
+_NAME_SEARCH_QUERY = text(
+    "SELECT rowid AS id FROM crm_invoices_fts WHERE crm_invoices_fts MATCH :query ORDER BY rowid DESC LIMIT :limit"
+)
+
+# Nearest rows on each side of the target within one currency: two index seeks, no sort
+_NEAREST_SQL = """
+SELECT id FROM (SELECT id FROM crm_invoices WHERE currency = :currency AND {column} >= :target AND {column} <= :high ORDER BY {column} LIMIT :limit)
+UNION ALL
+SELECT id FROM (SELECT id FROM crm_invoices WHERE currency = :currency AND {column} < :target AND {column} >= :low ORDER BY {column} DESC LIMIT :limit)
+"""
+_AMOUNT_SEARCH_QUERY = text(_NEAREST_SQL.format(column="total_amount"))
+_DUE_DATE_SEARCH_QUERY = text(_NEAREST_SQL.format(column="due_date"))
+
+_CANDIDATE_HEADERS_QUERY = text(
+    "SELECT * FROM crm_invoices WHERE id IN :ids"
+).bindparams(bindparam("ids", expanding=True))
+
+
+class Candidate(NamedTuple):
+    """A CRM record retrieved for an invoice, with its 0-1 score and per-feature scores."""
+    score: float
+    crm_data: dict
+    features: Dict[str, float]
+
+def candidate_summary(candidates: List[Candidate]) -> List[dict]:
+    """Compact description of retrieved candidates for responses and logs."""
+    return [
+        {"job_reference": c.crm_data.get("job_reference"), "invoice_number": c.crm_data.get("invoice_number"), "score": c.score}
+        for c in candidates
+    ]
+
+def build_name_query(*names: Optional[str]) -> Optional[str]:
+    """
+    FTS5 query matching any distinctive word of `names`. Words shorter than the
+    trigram length, and generic company words, are dropped.
+    """
+    words = []
+    for name in names:
+        for word in re.findall(r"\w+", (name or "").lower()):
+            if len(word) >= 3 and word not in _NAME_STOPWORDS and word not in words:
+                words.append(word)
+    if not words:
+        return None
+    return " OR ".join(f'"{word}"' for word in words[:8])
+
+def _parse_date(value) -> Optional[date]:
+    # Same normalisation the loader applies to crm_invoices.due_date
+    from src.reconciler import normalize_date
+
+    try:
+        return date.fromisoformat(normalize_date(value)[:10])
+    except ValueError:
+        return None
+
+def _candidate_features(extracted: InvoiceData, record: dict, settings: CandidateSettings) -> Dict[str, float]:
+    """0-1 similarity per feature the invoice carries."""
+    from rapidfuzz import fuzz, utils
+
+    features = {}
+    names = [name for name in (extracted.customer_name, extracted.supplier) if name]
+    if names:
+        features["name"] = max(
+            fuzz.token_set_ratio(name, record.get(column) or "", processor=utils.default_process) / 100
+            for name in names for column in _NAME_COLUMNS
+        )
+
+    if extracted.total_amount is not None:
+        crm_amount = record.get("total_amount")
+        if crm_amount is None or (record.get("currency") or "USD") != extracted.currency:
+            features["amount"] = 0.0
+        else:
+            scale = max(abs(extracted.total_amount), 1.0) * settings.amount_tolerance
+            features["amount"] = max(0.0, 1.0 - abs(crm_amount - extracted.total_amount) / scale)
+
+    due_date = _parse_date(extracted.due_date)
+    if due_date is not None:
+        crm_due_date = _parse_date(record.get("due_date"))
+        days = abs((crm_due_date - due_date).days) if crm_due_date else None
+        features["date"] = 0.0 if days is None else max(0.0, 1.0 - days / settings.date_window_days)
+
+    return features
+
+def score_candidate(features: Dict[str, float]) -> float:
+    """Weighted mean of the available feature scores."""
+    total_weight = sum(_CANDIDATE_WEIGHTS[name] for name in features)
+    if not total_weight:
+        return 0.0
+    return sum(_CANDIDATE_WEIGHTS[name] * value for name, value in features.items()) / total_weight
+
+@timed("crm_candidates")
+def find_crm_candidates(extracted: InvoiceData, k: int = None, db_path: str = DEFAULT_DB_PATH) -> List[Candidate]:
+    """
+    Retrieves the `k` CRM records most likely to belong to `extracted`, best
+    first, for invoices whose job/invoice number lookup found nothing.
+
+    Three bounded channels gather candidate rows: the newest matches of a
+    trigram full-text search on the party names, the nearest total amounts
+    within the invoice currency and the nearest due dates within the invoice
+    currency (both index seeks on `(currency, ...)`). The union is scored on
+    name similarity, amount closeness and due-date distance; the shortlisted
+    records come with their line items.
+    """
+    settings = candidate_settings()
+    k = k or settings.k
+    limit = settings.channel_limit
+    try:
+        engine = get_crm_engine(db_path)
+
+        with engine.connect() as connection:
+            ids = []
+            name_query = build_name_query(extracted.customer_name, extracted.supplier)
+            if name_query:
+                ids += connection.execute(_NAME_SEARCH_QUERY, {"query": name_query, "limit": settings.name_scan_limit}).scalars().all()
+
+            if extracted.total_amount is not None:
+                spread = max(abs(extracted.total_amount), 1.0) * settings.amount_tolerance
+                ids += connection.execute(_AMOUNT_SEARCH_QUERY, {
+                    "currency": extracted.currency, "target": extracted.total_amount,
+                    "low": extracted.total_amount - spread, "high": extracted.total_amount + spread, "limit": limit
+                }).scalars().all()
+
+            due_date = _parse_date(extracted.due_date)
+            if due_date is not None:
+                window = timedelta(days=settings.date_window_days)
+                ids += connection.execute(_DUE_DATE_SEARCH_QUERY, {
+                    "currency": extracted.currency, "target": due_date.isoformat(),
+                    "low": (due_date - window).isoformat(), "high": (due_date + window).isoformat(), "limit": limit
+                }).scalars().all()
+
+            ids = list(dict.fromkeys(ids))
+            if not ids:
+                logger.warning("No CRM candidates found for extracted invoice")
+                return []
+
+            candidates = []
+            for row in connection.execute(_CANDIDATE_HEADERS_QUERY, {"ids": ids}).mappings():
+                record = dict(row)
+                for column in _INTERNAL_COLUMNS:
+                    record.pop(column, None)
+                features = _candidate_features(extracted, record, settings)
+                score = score_candidate(features)
+                if score >= settings.min_score:
+                    candidates.append(Candidate(round(score, 4), record, features))
+
+            candidates.sort(key=lambda candidate: (-candidate.score, candidate.crm_data["id"]))
+            candidates = candidates[:k]
+
+            # Line items for the shortlisted records only, in one query
+            by_job_ref: Dict[str, List[dict]] = {
+                candidate.crm_data["job_reference"]: [] for candidate in candidates if candidate.crm_data.get("job_reference")
+            }
+            if by_job_ref:
+                for item in connection.execute(_LINE_ITEMS_BULK_QUERY, {"job_references": list(by_job_ref)}).mappings():
+                    item = dict(item)
+                    by_job_ref[item.pop("job_reference")].append(item)
+            for candidate in candidates:
+                job_ref = candidate.crm_data.get("job_reference")
+                candidate.crm_data["line_items"] = [dict(item) for item in by_job_ref[job_ref]] if job_ref else []
+
+        logger.info(f"Retrieved {len(candidates)} CRM candidate(s) from {len(ids)} rows: {candidate_summary(candidates)}")
+        return candidates
+
+    except Exception as e:
+        record_error("crm_candidates")
+        logger.error(f"Error retrieving CRM candidates: {e}")
+        return []
+
+
+# --- Query plan checks ---
+
+def lookup_query_plans(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+    """EXPLAIN QUERY PLAN details of every CRM lookup statement, by lookup name."""
+    lookups = {
+        "header lookup (all keys)": (build_lookup_sql(_LOOKUP_FIELDS), {field: "x" for field in _LOOKUP_FIELDS}),
+        "line items": (_LINE_ITEMS_QUERY.text, {"job_reference": "x"}),
+        "bulk header lookup": (build_bulk_lookup_sql(2), (0, "a", "b", "c", "d", 1, "e", None, None, "f")),
+        "bulk line items": (_LINE_ITEMS_BULK_QUERY.text.replace(":job_references", "(?, ?)"), ("a", "b")),
+        "candidate names": (_NAME_SEARCH_QUERY.text, {"query": '"acme"', "limit": 50}),
+        "candidate amounts": (_AMOUNT_SEARCH_QUERY.text, {"currency": "USD", "target": 100.0, "low": 95.0, "high": 105.0, "limit": 50}),
+        "candidate due dates": (_DUE_DATE_SEARCH_QUERY.text, {"currency": "USD", "target": "2025-01-31", "low": "2025-01-01", "high": "2025-03-02", "limit": 50}),
+    }
+    for field in _LOOKUP_FIELDS:
+        lookups[f"header lookup ({field})"] = (build_lookup_sql((field,)), {field: "x"})
+    return {name: explain_query_plan(conn, sql, params) for name, (sql, params) in lookups.items()}
+
+def plan_scans(plan: List[str]) -> List[str]:
+    """Steps of a query plan that scan a CRM table instead of searching an index."""
+    # FTS5 reports its own index lookups as "SCAN <table> VIRTUAL TABLE INDEX ..."
+    return [step for step in plan if step.startswith("SCAN crm_") and "VIRTUAL TABLE INDEX" not in step]
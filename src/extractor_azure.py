@@ -1,152 +1,405 @@
+import io
 import sys
 import os
+import json
+import asyncio
+import hashlib
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
-from dotenv import load_dotenv
 
 # --- PATH FIX: Add project root to sys.path to allow 'src' imports ---
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from src.models import InvoiceData, InvoiceItem
-from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.core.credentials import AzureKeyCredential
-
-# Load env vars early
-load_dotenv()
+from src.pdf_source import PdfSource, read_pdf_bytes, describe_source
+from src.cache import DiskCache
+from src.rate_limit import TokenBucket, call_with_retry, acall_with_retry, outbound_limit
+from src.metrics import timed
+from src.config import getenv
 
 logger = logging.getLogger(__name__)
 
-def extract_invoice_data_llm(file_path: str) -> InvoiceData:
+MODEL_ID = "PI_Extraction"
+# Bump whenever the field mapping below changes so stale cache entries are ignored
+EXTRACTOR_VERSION = "3"
+
+# PDFs longer than AZURE_PAGE_SPLIT_THRESHOLD pages (default 12, 0 disables
+# splitting) are analysed as ranges of AZURE_PAGES_PER_CHUNK pages (default 6),
+# at most AZURE_CHUNK_CONCURRENCY (default 4) at a time
+def _chunk_concurrency() -> int:
+    return int(getenv("AZURE_CHUNK_CONCURRENCY", "4"))
+
+# Header fields a continuation document fills in when the invoice so far lacks them
+_HEADER_FIELDS = ("supplier", "supplier_inv_no", "supplier_inv_date", "due_date", "job_no", "currency", "total_amount", "customer_name")
+
+_extraction_cache: Optional[DiskCache] = None
+_extraction_cache_lock = threading.Lock()
+
+def get_extraction_cache() -> Optional[DiskCache]:
     """
-    Extracts structured invoice data from a PDF file using Azure Document Intelligence.
-    Model ID: PI_Extraction
+    Returns the process-wide extraction cache, or None if disabled via EXTRACTION_CACHE=0.
     """
-    endpoint = os.getenv("AZURE_FORM_ENDPOINT")
-    key = os.getenv("AZURE_FORM_KEY")
-    model_id = "PI_Extraction"
+    global _extraction_cache
+    if getenv("EXTRACTION_CACHE", "1") == "0":
+        return None
+    with _extraction_cache_lock:
+        if _extraction_cache is None:
+            _extraction_cache = DiskCache(
+                db_path=getenv("EXTRACTION_CACHE_PATH", "data/extraction_cache.db"),
+                namespace="azure_extraction",
+                max_bytes=int(getenv("EXTRACTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+                ttl_seconds=int(getenv("EXTRACTION_CACHE_TTL", str(30 * 24 * 3600)))
+            )
+    return _extraction_cache
+
+def extraction_cache_key(pdf_bytes: bytes) -> str:
+    """Cache key: content hash of the PDF plus the model id and extractor version."""
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    return f"{digest}:{MODEL_ID}:{EXTRACTOR_VERSION}"
+
+def _dump_invoices(invoices: List[InvoiceData]) -> str:
+    # exclude_unset: a currency no page carried stays a default after a cache hit
+    return json.dumps([invoice.model_dump(mode="json", exclude_unset=True) for invoice in invoices])
+
+def _load_invoices(cached: str) -> List[InvoiceData]:
+    return [InvoiceData.model_validate(invoice) for invoice in json.loads(cached)]
+
+def _azure_credentials():
+    endpoint = getenv("AZURE_FORM_ENDPOINT")
+    key = getenv("AZURE_FORM_KEY")
 
     if not endpoint or not key:
         raise ValueError("Azure credentials (AZURE_FORM_ENDPOINT, AZURE_FORM_KEY) are missing.")
+    return endpoint, key
+
+def split_page_ranges(pdf_bytes: bytes, pages_per_chunk: Optional[int] = None, threshold: Optional[int] = None) -> List[bytes]:
+    """
+    Splits a PDF longer than `threshold` pages into consecutive ranges of
+    `pages_per_chunk` pages, each a standalone PDF. Shorter PDFs (and PDFs
+    pypdf cannot read) are returned whole, as a single chunk.
+    """
+    pages_per_chunk = pages_per_chunk or int(getenv("AZURE_PAGES_PER_CHUNK", "6"))
+    threshold = int(getenv("AZURE_PAGE_SPLIT_THRESHOLD", "12")) if threshold is None else threshold
+    if threshold <= 0:
+        return [pdf_bytes]
 
-    logger.info(f"Processing PDF (Azure Doc Intelligence): {file_path}")
+    from pypdf import PdfReader, PdfWriter
 
     try:
-        client = DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key))
-        
-        with open(file_path, "rb") as f:
-            poller = client.begin_analyze_document(
-                model_id=model_id, 
-                body=f,
-                content_type="application/pdf"
-            )
-        
-        result = poller.result()
-        
-        if not result.documents:
-            raise ValueError("No documents analyzed by Azure.")
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        page_count = len(reader.pages)
+    except Exception as e:
+        logger.info(f"Could not read page count, analysing the PDF whole: {e}")
+        return [pdf_bytes]
+    if page_count <= threshold:
+        return [pdf_bytes]
+
+    chunks = []
+    for start in range(0, page_count, pages_per_chunk):
+        writer = PdfWriter()
+        for page in reader.pages[start:start + pages_per_chunk]:
+            writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        chunks.append(buffer.getvalue())
+    logger.info(f"Split {page_count} pages into {len(chunks)} ranges of up to {pages_per_chunk} pages")
+    return chunks
+
+def _analyze_documents(pdf_bytes: bytes, endpoint: str, key: str, rate_limiter: Optional[TokenBucket]) -> list:
+    """
+    Analyses the PDF, one page range per Azure call with up to AZURE_CHUNK_CONCURRENCY
+    calls in flight, and returns every analysed document in page order.
+    """
+    # The Azure SDK is only loaded once an extraction actually needs it
+    # retry_status=0: 429/5xx surface to call_with_retry instead of being retried
+    # inside the SDK first (connection errors are still retried by the SDK)
+    from azure.ai.documentintelligence import DocumentIntelligenceClient
+    from azure.core.credentials import AzureKeyCredential
+
+    client = DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key), retry_status=0)
+    chunks = split_page_ranges(pdf_bytes)
+
+    def analyze_chunk(body: bytes):
+        def analyze():
+            # Process-wide cap on Azure calls, shared with every other request and job
+            with outbound_limit("azure").hold():
+                poller = client.begin_analyze_document(
+                    model_id=MODEL_ID,
+                    body=body,
+                    content_type="application/pdf"
+                )
+                return poller.result()
+        return call_with_retry(analyze, limiter=rate_limiter)
+
+    if len(chunks) == 1:
+        results = [analyze_chunk(chunks[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(_chunk_concurrency(), len(chunks))) as executor:
+            results = list(executor.map(analyze_chunk, chunks))
+    return [doc for result in results for doc in (result.documents or [])]
+
+async def _analyze_documents_async(pdf_bytes: bytes, endpoint: str, key: str) -> list:
+    """Async counterpart of _analyze_documents on the aio client."""
+    from azure.ai.documentintelligence.aio import DocumentIntelligenceClient as AsyncDocumentIntelligenceClient
+    from azure.core.credentials import AzureKeyCredential
+
+    chunks = await asyncio.to_thread(split_page_ranges, pdf_bytes)
+    limit = asyncio.Semaphore(_chunk_concurrency())
+
+    async with AsyncDocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key), retry_status=0) as client:
+        async def analyze_chunk(body: bytes):
+            async def analyze():
+                async with outbound_limit("azure").ahold():
+                    poller = await client.begin_analyze_document(
+                        model_id=MODEL_ID,
+                        body=body,
+                        content_type="application/pdf"
+                    )
+                    return await poller.result()
+            async with limit:
+                return await acall_with_retry(analyze)
+
+        results = await asyncio.gather(*(analyze_chunk(chunk) for chunk in chunks))
+    return [doc for result in results for doc in (result.documents or [])]
+
+def _extract(source: PdfSource, use_cache: bool, rate_limiter: Optional[TokenBucket]) -> List[InvoiceData]:
+    endpoint, key = _azure_credentials()
+
+    logger.info(f"Processing PDF (Azure Doc Intelligence): {describe_source(source)}")
+
+    pdf_bytes = read_pdf_bytes(source)
+
+    cache = get_extraction_cache() if use_cache else None
+    cache_key = extraction_cache_key(pdf_bytes)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Extraction cache hit for {describe_source(source)}")
+            return _load_invoices(cached)
+
+    try:
+        invoices = parse_documents(_analyze_documents(pdf_bytes, endpoint, key, rate_limiter))
+
+        if cache is not None:
+            cache.set(cache_key, _dump_invoices(invoices))
+
+        return invoices
+
+    except Exception as e:
+        logger.error(f"Azure extraction failed: {e}")
+        raise
+
+def _first_invoice(invoices: List[InvoiceData], source: PdfSource) -> InvoiceData:
+    if len(invoices) > 1:
+        logger.warning(f"{describe_source(source)} holds {len(invoices)} invoices; using the first (see extract_invoices)")
+    return invoices[0]
+
+@timed("extraction")
+def extract_invoice_data_llm(source: PdfSource, use_cache: bool = True, rate_limiter: Optional[TokenBucket] = None) -> InvoiceData:
+    """
+    Extracts structured invoice data from a PDF using Azure Document Intelligence.
+    Model ID: PI_Extraction
+
+    `source` may be a file path, raw bytes or a binary stream, so callers holding
+    the PDF in memory never need to write it to disk.
 
-        doc = result.documents[0]
-        fields = doc.fields
+    Long PDFs are analysed as page ranges in parallel (see split_page_ranges)
+    and the documents found across ranges are merged back into one invoice.
 
-        # Helper to get string value safely
-        def get_str(field_name):
+    Results are cached on disk by the PDF's SHA-256, so re-submitting the same
+    document skips the Azure round trip. When a `rate_limiter` is given, every
+    Azure call takes a token from it; 429 responses are retried either way.
+    """
+    return _first_invoice(_extract(source, use_cache, rate_limiter), source)
+
+@timed("extraction")
+def extract_invoices(source: PdfSource, use_cache: bool = True, rate_limiter: Optional[TokenBucket] = None) -> List[InvoiceData]:
+    """
+    Like extract_invoice_data_llm, but returns every invoice in the PDF (e.g. a
+    statement bundling several supplier invoices), in page order.
+    """
+    return _extract(source, use_cache, rate_limiter)
+
+@timed("extraction")
+async def extract_invoice_data_async(source: PdfSource, use_cache: bool = True) -> InvoiceData:
+    """
+    Async variant of extract_invoice_data_llm built on the aio Document Intelligence
+    client. Reading `source` and cache I/O run in worker threads so the event loop stays free.
+    """
+    endpoint, key = _azure_credentials()
+
+    logger.info(f"Processing PDF (Azure Doc Intelligence, async): {describe_source(source)}")
+
+    pdf_bytes = await asyncio.to_thread(read_pdf_bytes, source)
+
+    cache = get_extraction_cache() if use_cache else None
+    cache_key = extraction_cache_key(pdf_bytes)
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            logger.info(f"Extraction cache hit for {describe_source(source)}")
+            return _first_invoice(_load_invoices(cached), source)
+
+    try:
+        invoices = parse_documents(await _analyze_documents_async(pdf_bytes, endpoint, key))
+
+        if cache is not None:
+            await asyncio.to_thread(cache.set, cache_key, _dump_invoices(invoices))
+
+        return _first_invoice(invoices, source)
+
+    except Exception as e:
+        logger.error(f"Azure extraction failed: {e}")
+        raise
+
+def parse_analyze_result(result) -> InvoiceData:
+    """
+    Maps an Azure AnalyzeResult from the PI_Extraction model onto InvoiceData
+    (the first invoice when it holds several).
+    """
+    return parse_documents(result.documents)[0]
+
+def parse_documents(documents: list) -> List[InvoiceData]:
+    """
+    Maps analysed documents, in page order, onto invoices. A document whose
+    invoice number is missing or equal to the current invoice's continues that
+    invoice (e.g. the next page range of a long statement): its line items are
+    appended and it fills header fields still missing. A document with a
+    different invoice number starts a new invoice.
+
+    Currency counts as missing until a document states it, so the InvoiceData
+    default ("USD") only applies when no document of the invoice has one.
+    """
+    if not documents:
+        raise ValueError("No documents analyzed by Azure.")
+
+    invoices: List[InvoiceData] = []
+    for doc in documents:
+        invoice = parse_document(doc)
+        current = invoices[-1] if invoices else None
+        if current is None or (invoice.supplier_inv_no and current.supplier_inv_no and invoice.supplier_inv_no.strip() != current.supplier_inv_no.strip()):
+            invoices.append(invoice)
+            continue
+
+        current.items.extend(invoice.items)
+        for field in _HEADER_FIELDS:
+            if _has_field(invoice, field) and not _has_field(current, field):
+                setattr(current, field, getattr(invoice, field))
+
+    if len(documents) > 1:
+        logger.info(f"Merged {len(documents)} analysed documents into {len(invoices)} invoice(s)")
+    return invoices
+
+def _has_field(invoice: InvoiceData, field: str) -> bool:
+    # Fields left to their model default (currency) were not read from the document
+    return field in invoice.model_fields_set and getattr(invoice, field) is not None
+
+def parse_document(doc) -> InvoiceData:
+    """
+    Maps one analysed PI_Extraction document onto InvoiceData. A currency the
+    document does not state is left unset (the model default).
+    """
+    fields = doc.fields
+
+    # Helper to get string value safely
+    def get_str(field_name):
+        f = fields.get(field_name)
+        if f:
+            return f.value_string if f.value_string else f.content
+        return None
+
+    # Helper for float
+    def get_float(field_name, text_value=None):
+        val_str = text_value
+        if not val_str:
             f = fields.get(field_name)
-            if f:
-                return f.value_string if f.value_string else f.content
-            return None
-
-        # Helper for float
-        def get_float(field_name, text_value=None):
-            val_str = text_value
-            if not val_str:
-                f = fields.get(field_name)
-                if not f: return 0.0
-                val_str = f.value_string if f.value_string else f.content
-            
-            if not val_str: return 0.0
-            
-            # Clean string
-            val_str = val_str.replace(',', '').replace('$', '').strip()
-            try:
-                return float(val_str)
-            except:
-                return 0.0
-
-        # Extract Fields
-        supplier = get_str("supplier")
-        supplier_inv_no = get_str("supplier_inv_no")
-        supplier_inv_date = get_str("supplier_inv_date") # You might want to normalize date format if needed
-        due_date = get_str("due_date")
-        currency = get_str("currency") or "USD"
-        
-        # Extract Total Amount (try common field names for custom models)
-        total_amount = get_float("total_amount")
-        if total_amount == 0.0:
-             total_amount = get_float("InvoiceTotal") # Fallback to prebuilt model name
+            if not f: return 0.0
+            val_str = f.value_string if f.value_string else f.content
         
-        # Missing fields in model - explicit None
-        job_no = None
-        customer_name = None 
+        if not val_str: return 0.0
         
-        # Line Items
-        items_data = []
-        line_items_field = fields.get("line_items")
-        if line_items_field and line_items_field.value_array:
-            for item in line_items_field.value_array:
-                # item is a DocumentField, likely type 'object', so value_object is the dict
-                if item.value_object:
-                    item_fields = item.value_object
-                    
-                    # Extract item properties
-                    desc_f = item_fields.get("charge_description")
-                    qty_f = item_fields.get("Qty")
-                    amt_f = item_fields.get("Amount")
-                    
-                    desc = desc_f.content if desc_f else "Unknown"
+        # Clean string
+        val_str = val_str.replace(',', '').replace('$', '').strip()
+        try:
+            return float(val_str)
+        except:
+            return 0.0
+
+    # Extract Fields
+    supplier = get_str("supplier")
+    supplier_inv_no = get_str("supplier_inv_no")
+    supplier_inv_date = get_str("supplier_inv_date") # You might want to normalize date format if needed
+    due_date = get_str("due_date")
+    currency = get_str("currency")
+    
+    # Extract Total Amount (try common field names for custom models)
+    total_amount = get_float("total_amount")
+    if total_amount == 0.0:
+         total_amount = get_float("InvoiceTotal") # Fallback to prebuilt model name
+    if total_amount == 0.0:
+         total_amount = None # Not found; don't let the comparator read it as a zero total
+    
+    # Missing fields in model - explicit None
+    job_no = None
+    customer_name = None 
+    
+    # Line Items
+    items_data = []
+    line_items_field = fields.get("line_items")
+    if line_items_field and line_items_field.value_array:
+        for item in line_items_field.value_array:
+            # item is a DocumentField, likely type 'object', so value_object is the dict
+            if item.value_object:
+                item_fields = item.value_object
+                
+                # Extract item properties
+                desc_f = item_fields.get("charge_description")
+                qty_f = item_fields.get("Qty")
+                amt_f = item_fields.get("Amount")
+                
+                desc = desc_f.content if desc_f else "Unknown"
+                
+                # Clean number strings
+                qty_content = qty_f.content if (qty_f and qty_f.content) else "1"
+                qty_str = qty_content.replace(',', '').strip()
+                try:
+                    qty = float(qty_str) if qty_str else 1.0
+                except:
+                    qty = 1.0
+
+                amt_content = amt_f.content if (amt_f and amt_f.content) else "0"
+                amt_str = amt_content.replace(',', '').replace('$', '').strip()
+                try:
+                    amount = float(amt_str) if amt_str else 0.0
+                except:
+                    amount = 0.0
                     
-                    # Clean number strings
-                    qty_content = qty_f.content if (qty_f and qty_f.content) else "1"
-                    qty_str = qty_content.replace(',', '').strip()
-                    try:
-                        qty = float(qty_str) if qty_str else 1.0
-                    except:
-                        qty = 1.0
-
-                    amt_content = amt_f.content if (amt_f and amt_f.content) else "0"
-                    amt_str = amt_content.replace(',', '').replace('$', '').strip()
-                    try:
-                        amount = float(amt_str) if amt_str else 0.0
-                    except:
-                        amount = 0.0
-                        
-                    # Calculate unit price
-                    unit_price = amount / qty if qty != 0 else 0.0
-
-                    items_data.append(InvoiceItem(
-                        description=desc,
-                        quantity=qty,
-                        unit_price=unit_price,
-                        amount=amount
-                    ))
-
-        extracted_data = InvoiceData(
-            supplier=supplier,
-            supplier_inv_no=supplier_inv_no,
-            supplier_inv_date=supplier_inv_date,
-            due_date=due_date,
-            job_no=job_no,
-            currency=currency,
-            total_amount=total_amount,
-            customer_name=customer_name,
-            items=items_data
-        )
-
-        logger.info(f"Extraction successful. Supplier: {extracted_data.supplier}, Inv No: {extracted_data.supplier_inv_no}")
-        return extracted_data
+                # Calculate unit price
+                unit_price = amount / qty if qty != 0 else 0.0
 
-    except Exception as e:
-        logger.error(f"Azure extraction failed: {e}")
-        raise
+                items_data.append(InvoiceItem(
+                    description=desc,
+                    quantity=qty,
+                    unit_price=unit_price,
+                    amount=amount
+                ))
+
+    extracted_data = InvoiceData(
+        supplier=supplier,
+        supplier_inv_no=supplier_inv_no,
+        supplier_inv_date=supplier_inv_date,
+        due_date=due_date,
+        job_no=job_no,
+        total_amount=total_amount,
+        customer_name=customer_name,
+        items=items_data,
+        **({"currency": currency} if currency else {})
+    )
+
+    logger.info(f"Extraction successful. Supplier: {extracted_data.supplier}, Inv No: {extracted_data.supplier_inv_no}")
+    return extracted_data
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -1,64 +1,33 @@
+import io
 import sys
 import os
 import time
 import logging
-import google.generativeai as genai
-from dotenv import load_dotenv
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 # --- PATH FIX: Add project root to sys.path to allow 'src' imports ---
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from src.models import InvoiceData
-
-# Load env vars early
-load_dotenv()
+from src.pdf_source import PdfSource, read_pdf_bytes, describe_source
+from src.config import getenv
+from src.metrics import timed
+from src.rate_limit import outbound_limit
 
 logger = logging.getLogger(__name__)
 
-def extract_invoice_data_llm(file_path: str) -> InvoiceData:
-    """
-    Extracts structured invoice data from a PDF file using Gemini's native
-    multimodal capabilities (File API). This performs 'Visual Extraction' 
-    which is equivalent to, and often better than, traditional OCR.
-    
-    It supports scanned PDFs and images associated with the PDF.
-    """
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY environment variable is not set.")
+MODEL_NAME = "gemini-2.0-flash"
 
-    # Configure the Gemini SDK
-    genai.configure(api_key=api_key)
+# A PDF is sent inline when the whole generate request stays within
+# GEMINI_INLINE_MAX_BYTES; larger ones go through the File API. Gemini caps a
+# request at 20 MB, and inline data travels base64-encoded (4 bytes per 3).
+DEFAULT_INLINE_MAX_BYTES = 20 * 1000 * 1000
+# JSON envelope and field names around the encoded PDF and the prompt
+_REQUEST_OVERHEAD_BYTES = 16 * 1024
 
-    logger.info(f"Uploading {file_path} to Gemini for processing...")
-    
-    try:
-        # Upload the file to Google's GenAI File API
-        # This allows Gemini to 'view' the PDF directly.
-        sample_file = genai.upload_file(path=file_path, display_name="Invoice Document")
-        
-        # Wait for the file to be processed (usually very fast)
-        while sample_file.state.name == "PROCESSING":
-            time.sleep(1)
-            sample_file = genai.get_file(sample_file.name)
-            
-        if sample_file.state.name == "FAILED":
-            raise ValueError(f"File upload failed with state: {sample_file.state.name}")
-            
-        logger.info("File processed successfully. invoking Gemini 2.0 Flash...")
-
-        # Initialize the model
-        # Using gemini-2.0-flash as per available models
-        model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash",
-            generation_config={
-                "temperature": 0,
-                "response_mime_type": "application/json",
-                "response_schema": InvoiceData
-            }
-        )
-
-        prompt = """You are an expert data extraction assistant specialized in Logistics and Freight Forwarding invoices.
+EXTRACTION_PROMPT = """You are an expert data extraction assistant specialized in Logistics and Freight Forwarding invoices.
 
     Your task is to analyze the provided document and extract specific fields into a structured JSON format.
 
@@ -102,8 +71,119 @@ def extract_invoice_data_llm(file_path: str) -> InvoiceData:
     Return the output as valid JSON only. Do not include markdown formatting.
     """
 
-        # Generate content using the uploaded file and the prompt
-        response = model.generate_content([sample_file, prompt])
+_model = None
+_model_key: Optional[str] = None
+_model_lock = threading.Lock()
+_cleanup_executor: Optional[ThreadPoolExecutor] = None
+
+def _get_model(api_key: str):
+    """
+    Returns the process-wide Gemini model, configuring the SDK and building
+    the GenerativeModel only on first use (or after the API key changes).
+    """
+    global _model, _model_key
+    with _model_lock:
+        if _model is None or _model_key != api_key:
+            import google.generativeai as genai
+
+            genai.configure(api_key=api_key)
+            _model = genai.GenerativeModel(
+                model_name=MODEL_NAME,
+                generation_config={
+                    "temperature": 0,
+                    "response_mime_type": "application/json",
+                    "response_schema": InvoiceData
+                }
+            )
+            _model_key = api_key
+        return _model
+
+def _inline_request_bytes(pdf_bytes: bytes) -> int:
+    """Size of a generate request carrying `pdf_bytes` inline with the extraction prompt."""
+    encoded = 4 * -(-len(pdf_bytes) // 3)
+    return encoded + len(EXTRACTION_PROMPT.encode("utf-8")) + _REQUEST_OVERHEAD_BYTES
+
+def _upload_and_wait(pdf_bytes: bytes):
+    """
+    Uploads a PDF through the File API and polls until Gemini has processed
+    it, with exponential backoff instead of a fixed one-second sleep.
+    """
+    import google.generativeai as genai
+
+    sample_file = genai.upload_file(path=io.BytesIO(pdf_bytes), mime_type="application/pdf", display_name="Invoice Document")
+
+    # First poll delay, backoff cap and overall timeout (seconds)
+    delay = float(getenv("GEMINI_FILE_POLL_INITIAL", "0.1"))
+    max_delay = float(getenv("GEMINI_FILE_POLL_MAX", "2.0"))
+    timeout = float(getenv("GEMINI_FILE_POLL_TIMEOUT", "120"))
+    deadline = time.monotonic() + timeout
+    while sample_file.state.name == "PROCESSING":
+        if time.monotonic() >= deadline:
+            _delete_file_later(sample_file.name)
+            raise TimeoutError(f"Gemini did not finish processing {sample_file.name} within {timeout:.0f}s")
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+        sample_file = genai.get_file(sample_file.name)
+
+    if sample_file.state.name == "FAILED":
+        _delete_file_later(sample_file.name)
+        raise ValueError(f"File upload failed with state: {sample_file.state.name}")
+    return sample_file
+
+def _delete_file(name: str):
+    import google.generativeai as genai
+    try:
+        genai.delete_file(name)
+    except Exception as e:
+        logger.debug(f"Could not delete uploaded file {name}: {e}") # Non-critical
+
+def _delete_file_later(name: str):
+    """
+    Deletes an uploaded file on a background thread so cleanup never delays
+    the extraction result. Pending deletions finish before the interpreter exits.
+    """
+    global _cleanup_executor
+    with _model_lock:
+        if _cleanup_executor is None:
+            _cleanup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-cleanup")
+    _cleanup_executor.submit(_delete_file, name)
+
+@timed("extraction")
+def extract_invoice_data_llm(source: PdfSource) -> InvoiceData:
+    """
+    Extracts structured invoice data from a PDF file using Gemini's native
+    multimodal capabilities. This performs 'Visual Extraction'
+    which is equivalent to, and often better than, traditional OCR.
+
+    It supports scanned PDFs and images associated with the PDF.
+    `source` may be a file path, raw bytes or a binary stream.
+
+    PDFs whose base64-encoded request fits in GEMINI_INLINE_MAX_BYTES are sent
+    inline in the generate request (one round trip). Larger ones are uploaded through the File API and deleted
+    again in the background once the answer is in.
+    """
+    api_key = getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable is not set.")
+
+    model = _get_model(api_key)
+    pdf_bytes = read_pdf_bytes(source)
+    uploaded = None
+
+    try:
+        if _inline_request_bytes(pdf_bytes) <= int(getenv("GEMINI_INLINE_MAX_BYTES", str(DEFAULT_INLINE_MAX_BYTES))):
+            logger.info(f"Sending {describe_source(source)} inline to Gemini ({len(pdf_bytes)} bytes)...")
+            document = {"mime_type": "application/pdf", "data": pdf_bytes}
+        else:
+            logger.info(f"Uploading {describe_source(source)} to Gemini File API ({len(pdf_bytes)} bytes)...")
+            with outbound_limit("gemini").hold():
+                uploaded = _upload_and_wait(pdf_bytes)
+            document = uploaded
+            logger.info("File processed successfully.")
+
+        # Generate content using the document and the prompt
+        with outbound_limit("gemini").hold():
+            response = model.generate_content([document, EXTRACTION_PROMPT])
 
         # Validate and parse the response into our Pydantic model
         if not response.text:
@@ -112,20 +192,17 @@ def extract_invoice_data_llm(file_path: str) -> InvoiceData:
         result = InvoiceData.model_validate_json(response.text)
         
         logger.info(f"Extraction successful. Invoice Number: {result.supplier_inv_no}")
-        
-        # Clean up: Delete the uploaded file to avoid clutter in the cloud storage
-        # (Optional but recommended for privacy/hygiene)
-        try:
-            genai.delete_file(sample_file.name)
-        except Exception:
-            pass # Non-critical if delete fails
-
         return result
 
     except Exception as e:
         logger.error(f"Gemini Native extraction failed: {e}")
         raise
 
+    finally:
+        # Clean up the uploaded copy (privacy/hygiene) off the critical path
+        if uploaded is not None:
+            _delete_file_later(uploaded.name)
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     
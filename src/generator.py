@@ -1,129 +1,250 @@
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-from pypdf import PdfReader, PdfWriter
+from pypdf import PdfReader, PdfWriter, PageObject
+from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject, NumberObject
 import io
 import os
 import logging
+import threading
+from typing import Dict, Iterable
 from src.models import InvoiceData
+from src.metrics import timed
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_TEMPLATE_PATH = "data/VoucherPrintingBatch.pdf"
+_TEMPLATE_XOBJECT = "/VoucherTemplate"
+
+def _build_overlay(data: InvoiceData) -> PageObject:
+    """
+    Draws the verified-invoice data (and the masks hiding the template's sample
+    data) onto a one-page PDF and returns that page.
+    """
+    # Create an overlay PDF
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=A4)
+    
+    # Font settings
+    can.setFont("Helvetica", 9)
+    
+    # --- Masking Old Data (White Rectangles) ---
+    # Adjust these coordinates and sizes based on the template layout
+    can.setFillColorRGB(1, 1, 1) # White
+    can.setStrokeColorRGB(1, 1, 1)
+    
+    # Mask Header Info
+    can.rect(15, 655, 80, 15, fill=1) # Voucher No
+    can.rect(100, 655, 80, 15, fill=1) # Voucher Date
+    can.rect(100, 620, 40, 15, fill=1) # Currency
+    can.rect(240, 620, 150, 15, fill=1) # Payable To
+    can.rect(410, 620, 150, 15, fill=1) # Supplier Invoice No
+    
+    # Mask Totals
+    can.rect(480, 360, 80, 15, fill=1) # Sub Total
+    can.rect(480, 340, 80, 15, fill=1) # Tax Total
+    can.rect(480, 325, 80, 15, fill=1) # Total
+    can.rect(480, 310, 80, 15, fill=1) # Amount Due
+    can.rect(430, 290, 150, 15, fill=1) # In Words line 1
+    can.rect(430, 280, 150, 10, fill=1) # In Words line 2
+    can.rect(430, 270, 150, 10, fill=1) # In Words line 3
+    
+    # Mask Shipper and Consignee Blocks (Name + Address)
+    # Shipper: x=64, y=588. Address lines below.
+    can.rect(60, 535, 230, 65, fill=1) 
+    # Consignee: x=360, y=588. Address lines below.
+    can.rect(355, 535, 230, 65, fill=1)
+
+    # Mask Table Rows (Masking a large block for the table body)
+    # Assuming table starts around y=490 and goes down
+    can.rect(20, 400, 550, 100, fill=1) 
+
+    # --- Drawing New Data ---
+    can.setFillColorRGB(0, 0, 0) # Black
+    
+    # Header Data
+    can.drawString(110, 624, str(data.currency))
+    can.drawString(243, 624, str(data.customer_name))
+    
+    # Supplier Invoice No & Date
+    supplier_ref = f"{data.supplier_inv_no} / {data.supplier_inv_date}"
+    can.drawString(418, 624, supplier_ref)
+    
+    # Shipper and Consignee (not part of every extraction model)
+    shipper = getattr(data, "shipper", None)
+    consignee = getattr(data, "consignee", None)
+    if shipper:
+        can.drawString(65, 588, str(shipper))
+    if consignee:
+        can.drawString(360, 588, str(consignee))
+    
+    # Table Data
+    y_start = 487
+    row_height = 15
+    y = y_start
+    
+    for i, item in enumerate(data.items):
+        if y < 400: # Stop if we run out of space
+            break
+        
+        can.drawString(28, y, str(i + 1))
+        can.drawString(47, y, str(item.description)[:40]) # Truncate if too long
+        can.drawString(457, y, f"{item.amount:.2f}")
+        
+        y -= row_height
+        
+    # Totals (fall back to the line-item sum if no total was extracted)
+    total_amount = data.total_amount if data.total_amount is not None else sum(item.amount for item in data.items)
+    can.drawString(490, 362, f"{data.currency} {total_amount:.2f}") # Sub Total
+    can.drawString(490, 345, f"{data.currency} 0.00") # Tax Total
+    can.drawString(490, 328, f"{data.currency} {total_amount:.2f}") # Total
+    can.drawString(490, 311, f"{data.currency} {total_amount:.2f}") # Amount Due
+    
+    can.save()
+    
+    # Move to the beginning of the StringIO buffer
+    packet.seek(0)
+    return PdfReader(packet).pages[0]
+
+class VoucherGenerator:
+    """
+    Stamps verified invoices onto the VoucherPrintingBatch template.
+
+    The template is read and parsed once. Its page content is placed on every
+    output page as a shared Form XObject, so each voucher only adds its own
+    overlay, and many vouchers can be written into one multi-page PDF.
+    """
+
+    def __init__(self, template_path: str = DEFAULT_TEMPLATE_PATH):
+        if not os.path.exists(template_path):
+            raise FileNotFoundError(f"Template not found at {template_path}")
+
+        self.template_path = template_path
+        with open(template_path, "rb") as f:
+            self._template_reader = PdfReader(io.BytesIO(f.read()))
+
+        self._template_page = self._template_reader.pages[0]
+        contents = self._template_page.get_contents()
+        self._template_content = contents.get_data() if contents is not None else b""
+        self._mediabox = self._template_page.mediabox
+        # Page attributes may be inherited from the page tree; merge_page kept them too
+        self._resources = self._template_page.get_inherited("/Resources")
+        self._cropbox = self._template_page.get_inherited("/CropBox")
+        self._rotate = self._template_page.get_inherited("/Rotate", 0)
+        self._annots = self._template_page.get("/Annots")
+        # pypdf objects are not safe to share across threads
+        self._lock = threading.Lock()
+        logger.info(f"Loaded voucher template {template_path}")
+
+    def _template_xobject(self, writer: PdfWriter):
+        """Adds the template page to `writer` once, as a Form XObject."""
+        content = DecodedStreamObject()
+        content.set_data(self._template_content)
+        form = content.flate_encode()
+        form.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): ArrayObject([FloatObject(v) for v in self._mediabox]),
+            NameObject("/Resources"): self._resources.get_object().clone(writer) if self._resources is not None else DictionaryObject(),
+        })
+        return writer._add_object(form)
+
+    def _add_voucher_page(self, writer: PdfWriter, template_ref, data: InvoiceData):
+        overlay = _build_overlay(data)
+        page = writer.add_blank_page(width=self._mediabox.width, height=self._mediabox.height)
+        page[NameObject("/MediaBox")] = ArrayObject([FloatObject(v) for v in self._mediabox])
+        if self._cropbox is not None:
+            page[NameObject("/CropBox")] = ArrayObject([FloatObject(v) for v in self._cropbox.get_object()])
+        if self._rotate:
+            page[NameObject("/Rotate")] = NumberObject(self._rotate)
+        if self._annots is not None:
+            # Each page owns its copy of the template's annotations
+            annots = ArrayObject()
+            for annot in self._annots.get_object():
+                copy = annot.get_object().clone(writer, force_duplicate=True)
+                copy[NameObject("/P")] = page.indirect_reference
+                annots.append(copy.indirect_reference or writer._add_object(copy))
+            page[NameObject("/Annots")] = annots
+
+        # Overlay resources (fonts) plus the shared template XObject
+        resources = DictionaryObject()
+        overlay_resources = overlay.get("/Resources")
+        if overlay_resources is not None:
+            for category, entries in overlay_resources.get_object().clone(writer).items():
+                resources[NameObject(category)] = entries
+        xobjects = resources.get("/XObject", DictionaryObject()).get_object()
+        xobjects[NameObject(_TEMPLATE_XOBJECT)] = template_ref
+        resources[NameObject("/XObject")] = xobjects
+        page[NameObject("/Resources")] = resources
+
+        content = DecodedStreamObject()
+        content.set_data(f"q {_TEMPLATE_XOBJECT} Do Q\n".encode("latin-1") + overlay.get_contents().get_data())
+        page[NameObject("/Contents")] = writer._add_object(content)
+
+    def generate(self, data: InvoiceData, output_path: str):
+        """Writes a single verified invoice to `output_path`."""
+        self.generate_batch([data], output_path)
+
+    def generate_batch(self, invoices: Iterable[InvoiceData], output_path: str) -> int:
+        """
+        Writes every invoice in `invoices` as one page of a single PDF at `output_path`.
+        Returns the number of pages written.
+        """
+        with self._lock:
+            output = PdfWriter()
+            template_ref = self._template_xobject(output)
+
+            count = 0
+            for data in invoices:
+                self._add_voucher_page(output, template_ref, data)
+                count += 1
+
+            # Ensure output directory exists
+            directory = os.path.dirname(output_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            # Write the output
+            with open(output_path, "wb") as outputStream:
+                output.write(outputStream)
+
+        logger.info(f"Wrote {count} verified invoice page(s) to {output_path}")
+        return count
+
+_generators: Dict[str, VoucherGenerator] = {}
+_generators_lock = threading.Lock()
+
+def get_voucher_generator(template_path: str = DEFAULT_TEMPLATE_PATH) -> VoucherGenerator:
+    """Returns the process-wide generator for `template_path`, loading the template on first use."""
+    with _generators_lock:
+        generator = _generators.get(template_path)
+        if generator is None:
+            generator = VoucherGenerator(template_path)
+            _generators[template_path] = generator
+        return generator
+
+@timed("pdf_generation")
 def generate_verified_invoice(data: InvoiceData, output_path: str):
     """
     Generates a verified invoice PDF using the VoucherPrintingBatch template.
     """
     try:
         logger.info(f"Generating verified invoice at {output_path}")
-        
-        # Template path
-        template_path = "data/VoucherPrintingBatch.pdf"
-        if not os.path.exists(template_path):
-            raise FileNotFoundError(f"Template not found at {template_path}")
-
-        # Create an overlay PDF
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=A4)
-        
-        # Font settings
-        can.setFont("Helvetica", 9)
-        
-        # --- Masking Old Data (White Rectangles) ---
-        # Adjust these coordinates and sizes based on the template layout
-        can.setFillColorRGB(1, 1, 1) # White
-        can.setStrokeColorRGB(1, 1, 1)
-        
-        # Mask Header Info
-        can.rect(15, 655, 80, 15, fill=1) # Voucher No
-        can.rect(100, 655, 80, 15, fill=1) # Voucher Date
-        can.rect(100, 620, 40, 15, fill=1) # Currency
-        can.rect(240, 620, 150, 15, fill=1) # Payable To
-        can.rect(410, 620, 150, 15, fill=1) # Supplier Invoice No
-        
-        # Mask Totals
-        can.rect(480, 360, 80, 15, fill=1) # Sub Total
-        can.rect(480, 340, 80, 15, fill=1) # Tax Total
-        can.rect(480, 325, 80, 15, fill=1) # Total
-        can.rect(480, 310, 80, 15, fill=1) # Amount Due
-        can.rect(430, 290, 150, 15, fill=1) # In Words line 1
-        can.rect(430, 280, 150, 10, fill=1) # In Words line 2
-        can.rect(430, 270, 150, 10, fill=1) # In Words line 3
-        
-        # Mask Shipper and Consignee Blocks (Name + Address)
-        # Shipper: x=64, y=588. Address lines below.
-        can.rect(60, 535, 230, 65, fill=1) 
-        # Consignee: x=360, y=588. Address lines below.
-        can.rect(355, 535, 230, 65, fill=1)
-
-        # Mask Table Rows (Masking a large block for the table body)
-        # Assuming table starts around y=490 and goes down
-        can.rect(20, 400, 550, 100, fill=1) 
-
-        # --- Drawing New Data ---
-        can.setFillColorRGB(0, 0, 0) # Black
-        
-        # Header Data
-        # can.drawString(17, 658, str(data.invoice_number)) # Moved to Supplier Invoice No
-        # can.drawString(110, 658, str(data.invoice_date)) # Moved to Supplier Invoice No
-        can.drawString(110, 624, str(data.currency))
-        can.drawString(243, 624, str(data.customer_name))
-        
-        # Supplier Invoice No & Date
-        supplier_ref = f"{data.invoice_number} / {data.invoice_date}"
-        can.drawString(418, 624, supplier_ref)
-        
-        # Shipper and Consignee
-        if data.shipper:
-            can.drawString(65, 588, str(data.shipper))
-        if data.consignee:
-            can.drawString(360, 588, str(data.consignee))
-        
-        # Table Data
-        y_start = 487
-        row_height = 15
-        y = y_start
-        
-        for i, item in enumerate(data.items):
-            if y < 400: # Stop if we run out of space
-                break
-            
-            can.drawString(28, y, str(i + 1))
-            can.drawString(47, y, str(item.description)[:40]) # Truncate if too long
-            # can.drawString(193, y, "Job No") 
-            can.drawString(457, y, f"{item.amount:.2f}")
-            # can.drawString(549, y, "0.00") # Credit
-            
-            y -= row_height
-            
-        # Totals
-        can.drawString(490, 362, f"{data.currency} {data.total_amount:.2f}") # Sub Total
-        can.drawString(490, 345, f"{data.currency} 0.00") # Tax Total
-        can.drawString(490, 328, f"{data.currency} {data.total_amount:.2f}") # Total
-        can.drawString(490, 311, f"{data.currency} {data.total_amount:.2f}") # Amount Due
-        
-        can.save()
-        
-        # Move to the beginning of the StringIO buffer
-        packet.seek(0)
-        new_pdf = PdfReader(packet)
-        
-        # Read the existing PDF
-        existing_pdf = PdfReader(open(template_path, "rb"))
-        output = PdfWriter()
-        
-        # Merge
-        page = existing_pdf.pages[0]
-        page.merge_page(new_pdf.pages[0])
-        output.add_page(page)
-        
-        # Ensure output directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        
-        # Write the output
-        with open(output_path, "wb") as outputStream:
-            output.write(outputStream)
-            
+        get_voucher_generator().generate(data, output_path)
         logger.info("PDF generation successful.")
 
     except Exception as e:
         logger.error(f"Error generating PDF: {e}")
         raise
+
+@timed("pdf_generation_batch")
+def generate_verified_invoices(invoices: Iterable[InvoiceData], output_path: str) -> int:
+    """
+    Batch mode: stamps many verified invoices into one multi-page PDF.
+    """
+    try:
+        logger.info(f"Generating verified invoice batch at {output_path}")
+        return get_voucher_generator().generate_batch(invoices, output_path)
+
+    except Exception as e:
+        logger.error(f"Error generating PDF batch: {e}")
+        raise
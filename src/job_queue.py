@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when the queue already holds its maximum number of unfinished jobs."""
+
+
+class JobQueue:
+    """
+    Persistent, bounded FIFO of invoice-matching jobs backed by SQLite.
+
+    Jobs keep their PDF payload until they finish, so work that was pending or
+    running when the process stopped is picked up again after a restart.
+    Every claim counts as an attempt; a job that was running when the process
+    stopped `max_attempts` times (e.g. one that crashes or hangs the worker) is
+    failed at start-up instead of being re-queued again.
+    Finished (done or failed) jobs are deleted by purge_finished() once they are
+    older than `ttl_seconds` (0 keeps them forever).
+    """
+
+    def __init__(self, db_path: str = "data/jobs.db", max_pending: int = 100, ttl_seconds: int = 7 * 24 * 3600, max_attempts: int = 3):
+        self.db_path = db_path
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            filename TEXT,
+            payload BLOB,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        ''')
+        # Queue files created before attempts were counted
+        if "attempts" not in {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_updated ON jobs (status, updated_at)")
+
+        # Jobs interrupted mid-flight go back to the queue, unless they have used up their attempts
+        now = time.time()
+        abandoned = self._conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, payload = NULL, updated_at = ? WHERE status = ? AND attempts >= ?",
+            (FAILED, f"Interrupted {max_attempts} time(s); not retried", now, RUNNING, max_attempts)
+        ).rowcount
+        if abandoned:
+            logger.warning(f"Failed {abandoned} job(s) interrupted {max_attempts} time(s)")
+        recovered = self._conn.execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?", (PENDING, now, RUNNING)
+        ).rowcount
+        if recovered:
+            logger.info(f"Re-queued {recovered} interrupted job(s)")
+
+    def enqueue(self, filename: str, payload: bytes) -> str:
+        """Adds a job and returns its id. Raises QueueFullError when the queue is at capacity."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                unfinished = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (PENDING, RUNNING)
+                ).fetchone()[0]
+                if unfinished >= self.max_pending:
+                    raise QueueFullError(f"Job queue is full ({unfinished}/{self.max_pending})")
+
+                self._conn.execute(
+                    "INSERT INTO jobs (id, status, filename, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, PENDING, filename, payload, now, now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def claim(self) -> Optional[Tuple[str, str, bytes]]:
+        """Marks the oldest pending job as running (one more attempt) and returns (id, filename, payload), or None."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, filename, payload FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (PENDING,)
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?", (RUNNING, time.time(), row[0])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return (row[0], row[1], bytes(row[2])) if row else None
+
+    def complete(self, job_id: str, result: dict):
+        self._finish(job_id, DONE, result=json.dumps(result, default=str))
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, FAILED, error=error)
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        # The payload is no longer needed once a job is finished
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL, updated_at = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id)
+            )
+
+    def purge_finished(self) -> int:
+        """Deletes done and failed jobs that finished more than `ttl_seconds` ago; returns how many."""
+        if not self.ttl_seconds:
+            return 0
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, time.time() - self.ttl_seconds)
+            ).rowcount
+        if deleted:
+            logger.info(f"Purged {deleted} finished job(s) older than {self.ttl_seconds}s")
+        return deleted
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, filename, result, error, attempts, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "filename": row[2],
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": row[4],
+            "attempts": row[5],
+            "created_at": row[6],
+            "updated_at": row[7],
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,106 @@
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.models import InvoiceItem
+
+# Same rounding allowance the reconciler and the LLM prompt use
+DEFAULT_TOLERANCE = 0.05
+
+
+class LineItemArray:
+    """
+    Column-oriented line items: descriptions (and CRM internal codes) as
+    lists, amounts as a float64 NumPy array (missing amounts read as 0.0).
+
+    Building one still walks the items or cursor rows once in Python; what it
+    saves is the per-item work afterwards, since totals, sum checks and amount
+    matching run as array operations instead of loops over the items.
+    """
+
+    __slots__ = ("descriptions", "amounts", "codes")
+
+    def __init__(self, descriptions: List[str], amounts: np.ndarray, codes: Optional[List[Optional[str]]] = None):
+        self.descriptions = descriptions
+        self.amounts = np.asarray(amounts, dtype=np.float64)
+        self.codes = codes
+
+    @classmethod
+    def from_items(cls, items: Sequence[InvoiceItem]) -> "LineItemArray":
+        """From extractor output (InvoiceData.items)."""
+        return cls(
+            [str(item.description) for item in items],
+            np.fromiter((item.amount or 0.0 for item in items), dtype=np.float64, count=len(items)),
+        )
+
+    @classmethod
+    def from_crm_items(cls, line_items: Sequence[dict]) -> "LineItemArray":
+        """From the `line_items` dicts of a CRM record (see crm_tool.fetch_crm_data)."""
+        return cls(
+            [str(item.get("description") or "") for item in line_items],
+            np.fromiter((float(item.get("amount") or 0.0) for item in line_items), dtype=np.float64, count=len(line_items)),
+            codes=[item.get("internal_code") for item in line_items],
+        )
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[Optional[str], Optional[str], Optional[float]]]) -> "LineItemArray":
+        """From (internal_code, description, amount) cursor rows, without building a dict per row."""
+        codes, descriptions, amounts = [], [], []
+        for code, description, amount in rows:
+            codes.append(code)
+            descriptions.append(description or "")
+            amounts.append(amount or 0.0)
+        return cls(descriptions, np.array(amounts, dtype=np.float64), codes=codes)
+
+    def __len__(self) -> int:
+        return len(self.descriptions)
+
+    def total(self) -> float:
+        """Sum of the line amounts, rounded to cents."""
+        return round(float(self.amounts.sum()), 2)
+
+    def sum_matches(self, total: Optional[float], tolerance: float = DEFAULT_TOLERANCE) -> bool:
+        """Whether the line amounts add up to `total` within `tolerance`."""
+        return total is not None and abs(self.total() - float(total)) <= tolerance + 1e-9
+
+    def amounts_close(self, amounts: np.ndarray, tolerance: float = DEFAULT_TOLERANCE) -> np.ndarray:
+        """Element-wise: whether each line amount is within `tolerance` of the aligned entry of `amounts`."""
+        return np.abs(self.amounts - np.asarray(amounts, dtype=np.float64)) <= tolerance + 1e-9
+
+    def match_amounts(self, other: "LineItemArray", tolerance: float = DEFAULT_TOLERANCE) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pairs lines of `self` with lines of `other` one-to-one where the amounts
+        agree within `tolerance`, maximizing the number of pairs. Returns two
+        aligned index arrays (into self, into other).
+        """
+        own_order = np.argsort(self.amounts, kind="stable")
+        other_order = np.argsort(other.amounts, kind="stable")
+        own_sorted, other_sorted = self.amounts[own_order], other.amounts[other_order]
+
+        # Common case: same multiset of amounts, so the sorted sides align exactly
+        if len(own_sorted) == len(other_sorted) and np.all(np.abs(own_sorted - other_sorted) <= tolerance + 1e-9):
+            return own_order, other_order
+
+        # Greedy sweep over both sorted sides; optimal for a fixed tolerance window
+        own_matched, other_matched = [], []
+        own_values, other_values = own_sorted.tolist(), other_sorted.tolist()
+        i = j = 0
+        while i < len(own_values) and j < len(other_values):
+            difference = own_values[i] - other_values[j]
+            if abs(difference) <= tolerance + 1e-9:
+                own_matched.append(i)
+                other_matched.append(j)
+                i += 1
+                j += 1
+            elif difference < 0:
+                i += 1
+            else:
+                j += 1
+        return own_order[own_matched], other_order[other_matched]
+
+    def pairs_with(self, other: "LineItemArray", tolerance: float = DEFAULT_TOLERANCE) -> bool:
+        """Whether every line on both sides pairs one-to-one by amount."""
+        if len(self) != len(other):
+            return False
+        own, _ = self.match_amounts(other, tolerance)
+        return len(own) == len(self)
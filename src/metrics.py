@@ -0,0 +1,151 @@
+import time
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# Latency histogram buckets in seconds, spanning DB lookups to slow LLM calls
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class StageMetrics:
+    """Latency histogram, error count and in-flight gauge for one pipeline stage."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.in_flight = 0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def copy(self) -> "StageMetrics":
+        snapshot = StageMetrics(self.buckets)
+        snapshot.bucket_counts = list(self.bucket_counts)
+        snapshot.count, snapshot.total, snapshot.max = self.count, self.total, self.max
+        snapshot.errors, snapshot.in_flight = self.errors, self.in_flight
+        return snapshot
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile: upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+_stages: Dict[str, StageMetrics] = {}
+_lock = threading.Lock()
+
+def _stage(name: str) -> StageMetrics:
+    metrics = _stages.get(name)
+    if metrics is None:
+        metrics = _stages.setdefault(name, StageMetrics())
+    return metrics
+
+@contextmanager
+def track(stage: str):
+    """Times the enclosed block as one `stage` call; exceptions count as errors."""
+    with _lock:
+        _stage(stage).in_flight += 1
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record_error(stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            metrics = _stage(stage)
+            metrics.in_flight -= 1
+            metrics.observe(elapsed)
+
+def record_error(stage: str):
+    """Counts an error for a stage that handles its own exceptions."""
+    with _lock:
+        _stage(stage).errors += 1
+
+def timed(stage: str):
+    """Decorator form of track(), for both plain and async functions."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with track(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _snapshot() -> List[Tuple[str, StageMetrics]]:
+    with _lock:
+        return [(name, metrics.copy()) for name, metrics in sorted(_stages.items())]
+
+def render_prometheus() -> str:
+    """All stage metrics in the Prometheus text exposition format."""
+    snapshot = _snapshot()
+    lines = [
+        "# HELP pipeline_stage_duration_seconds Latency of each invoice pipeline stage.",
+        "# TYPE pipeline_stage_duration_seconds histogram",
+    ]
+    for name, metrics in snapshot:
+        cumulative = 0
+        for bound, bucket_count in zip(metrics.buckets, metrics.bucket_counts):
+            cumulative += bucket_count
+            lines.append(f'pipeline_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'pipeline_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {metrics.count}')
+        lines.append(f'pipeline_stage_duration_seconds_sum{{stage="{name}"}} {metrics.total:.6f}')
+        lines.append(f'pipeline_stage_duration_seconds_count{{stage="{name}"}} {metrics.count}')
+
+    lines += [
+        "# HELP pipeline_stage_errors_total Errors raised by each pipeline stage.",
+        "# TYPE pipeline_stage_errors_total counter",
+    ]
+    lines += [f'pipeline_stage_errors_total{{stage="{name}"}} {metrics.errors}' for name, metrics in snapshot]
+
+    lines += [
+        "# HELP pipeline_stage_in_flight Calls currently executing in each pipeline stage.",
+        "# TYPE pipeline_stage_in_flight gauge",
+    ]
+    lines += [f'pipeline_stage_in_flight{{stage="{name}"}} {metrics.in_flight}' for name, metrics in snapshot]
+    return "\n".join(lines) + "\n"
+
+def format_summary() -> str:
+    """Per-stage timing table for the end of a CLI run."""
+    snapshot = _snapshot()
+    if not snapshot:
+        return "No pipeline stages recorded."
+    header = f"{'Stage':<18}{'Calls':>7}{'Errors':>8}{'Total (s)':>11}{'Mean (s)':>10}{'p95 (s)':>9}{'Max (s)':>9}"
+    lines = [header, "-" * len(header)]
+    for name, metrics in snapshot:
+        mean = metrics.total / metrics.count if metrics.count else 0.0
+        lines.append(
+            f"{name:<18}{metrics.count:>7}{metrics.errors:>8}{metrics.total:>11.3f}{mean:>10.3f}{metrics.quantile(0.95):>9.3f}{metrics.max:>9.3f}"
+        )
+    return "\n".join(lines)
+
+def reset():
+    with _lock:
+        _stages.clear()
@@ -16,6 +16,7 @@ class InvoiceData(BaseModel):
     due_date: Optional[str] = Field(default=None, description="Date payment is due (YYYY-MM-DD)")
     job_no: Optional[str] = Field(default=None, description="Internal job tracking number (e.g., Job No, Ref)")
     currency: str = Field(default="USD", description="Currency code (e.g., USD, EUR)")
+    total_amount: Optional[float] = Field(default=None, description="The final invoice total including taxes and charges")
     
     # Customer Logic
     customer_name: Optional[str] = Field(default=None, description="The entity responsible for paying the invoice (Bill To)")
@@ -47,4 +48,10 @@ class FieldComparison(BaseModel):
 class ComparisonResult(BaseModel):
     status: str = Field(..., description="'MATCH' or 'MISMATCH'")
     analysis: str = Field(..., description="Overall analysis of the comparison")
-    field_level_comparison: Dict[str, Any] = Field(default_factory=dict, description="Key-value pairs of field names and their match status/notes")
\ No newline at end of file
+    field_level_comparison: Dict[str, Any] = Field(default_factory=dict, description="Key-value pairs of field names and their match status/notes")
+
+class KeyedComparisonResult(ComparisonResult):
+    invoice_key: str = Field(..., description="The invoice_key of the comparison this result belongs to, copied unchanged")
+
+class BatchComparisonResult(BaseModel):
+    results: List[KeyedComparisonResult] = Field(default_factory=list, description="One result per compared invoice")
@@ -0,0 +1,31 @@
+import os
+from typing import BinaryIO, Union
+
+# A PDF given as a filesystem path, raw bytes, or a binary file-like object
+# (e.g. an upload's SpooledTemporaryFile or an io.BytesIO).
+PdfSource = Union[str, os.PathLike, bytes, bytearray, BinaryIO]
+
+def read_pdf_bytes(source: PdfSource) -> bytes:
+    """
+    Returns the PDF content of `source`. Streams are read from their current
+    position and rewound afterwards, so the caller can reuse them.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+
+    start = source.tell() if source.seekable() else None
+    data = source.read()
+    if start is not None:
+        source.seek(start)
+    return data
+
+def describe_source(source: PdfSource) -> str:
+    """Human-readable name for logging."""
+    if isinstance(source, (str, os.PathLike)):
+        return str(source)
+    if isinstance(source, (bytes, bytearray)):
+        return f"<{len(source)} bytes in memory>"
+    return str(getattr(source, "name", None) or "<stream>")
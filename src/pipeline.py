@@ -0,0 +1,150 @@
+import os
+import asyncio
+import logging
+from typing import AsyncIterator, List, Tuple
+
+from src.models import InvoiceData
+from src.pdf_source import PdfSource
+from src.extractor_azure import extract_invoice_data_async
+from src.crm_tool import candidate_retrieval_enabled, candidate_summary, crm_key, fetch_crm_data, fetch_crm_data_bulk, find_crm_candidates
+from src.comparator import compare_invoice_data_async, compare_with_candidates
+from src.config import getenv
+
+logger = logging.getLogger(__name__)
+
+async def match_extracted_async(extracted_data: InvoiceData, filename: str, output_dir: str = "output") -> dict:
+    """
+    Runs the post-extraction stages (CRM lookup, comparison, voucher generation)
+    without blocking the event loop. Blocking DB and PDF work is offloaded to
+    worker threads; the LLM call is awaited natively.
+    """
+    # Step 3: Fetch CRM Data
+    crm_data = await asyncio.to_thread(
+        fetch_crm_data,
+        job_reference=extracted_data.job_no,
+        invoice_number=extracted_data.supplier_inv_no
+    )
+    return await match_with_crm_async(extracted_data, crm_data, filename, output_dir=output_dir)
+
+async def match_with_crm_async(extracted_data: InvoiceData, crm_data: dict, filename: str, output_dir: str = "output") -> dict:
+    """
+    Comparison and voucher generation for an invoice whose CRM record has
+    already been looked up. An empty `crm_data` means no record was found by
+    key; the invoice is then compared against the top retrieved CRM candidates.
+    """
+    candidates = []
+    if not crm_data and candidate_retrieval_enabled():
+        candidates = await asyncio.to_thread(find_crm_candidates, extracted_data)
+
+    if not crm_data and not candidates:
+        return {
+            "status": "MISMATCH",
+            "analysis": f"Job Reference {extracted_data.job_no} not found in CRM.",
+            "differences": {"job_reference": "Not Found"}
+        }
+
+    # Step 4: AI Comparison (Hybrid: Fuzzy + LLM)
+    if candidates:
+        comparison_result, crm_data = await asyncio.to_thread(
+            compare_with_candidates, extracted_data, [candidate.crm_data for candidate in candidates]
+        )
+    else:
+        comparison_result = await compare_invoice_data_async(extracted_data, crm_data)
+
+    # Step 5: Prepare Response
+    response_data = {
+        "status": comparison_result.status,
+        "analysis": comparison_result.analysis,
+        "field_level_comparison": comparison_result.field_level_comparison,
+        "extracted": extracted_data.model_dump(),
+        "crm": crm_data
+    }
+    if candidates:
+        response_data["crm_candidates"] = candidate_summary(candidates)
+
+    # Generate Verified Invoice if MATCH
+    if comparison_result.status == "MATCH":
+        output_pdf_path = os.path.join(output_dir, f"verified_{filename}")
+        try:
+            # reportlab/pypdf load on the first MATCH rather than at worker start
+            from src.generator import generate_verified_invoice
+            await asyncio.to_thread(generate_verified_invoice, extracted_data, output_pdf_path)
+            response_data["verified_invoice_path"] = output_pdf_path
+        except Exception as e:
+            logger.error(f"Failed to generate verified invoice: {e}")
+            response_data["verified_invoice_error"] = str(e)
+
+    return response_data
+
+async def process_invoice_async(source: PdfSource, filename: str, output_dir: str = "output") -> dict:
+    """
+    Full pipeline for one PDF: extraction followed by match_extracted_async.
+    Extraction errors propagate to the caller.
+    """
+    extracted_data = await extract_invoice_data_async(source)
+    return await match_extracted_async(extracted_data, filename, output_dir=output_dir)
+
+async def process_batch_async(documents: List[Tuple[str, bytes]], output_dir: str = "output") -> AsyncIterator[dict]:
+    """
+    Runs many PDFs through the pipeline with per-stage concurrency and yields one
+    result dict per document, in completion order.
+
+    - Extraction: at most BATCH_EXTRACT_CONCURRENCY Azure calls in flight.
+    - CRM lookup: whatever has been extracted so far is resolved together with
+      one fetch_crm_data_bulk call, so lookups batch up naturally under load.
+    - Comparison + voucher: at most BATCH_COMPARE_CONCURRENCY in flight.
+    """
+    extract_limit = asyncio.Semaphore(int(getenv("BATCH_EXTRACT_CONCURRENCY", "8")))
+    compare_limit = asyncio.Semaphore(int(getenv("BATCH_COMPARE_CONCURRENCY", "8")))
+    extracted_queue: asyncio.Queue = asyncio.Queue()
+    results: asyncio.Queue = asyncio.Queue()
+    tasks = []
+
+    async def extract(index: int, filename: str, payload: bytes):
+        async with extract_limit:
+            try:
+                extracted_data = await extract_invoice_data_async(payload)
+            except Exception as e:
+                logger.error(f"Batch extraction failed for {filename}: {e}")
+                await results.put({"filename": filename, "status": "ERROR", "error": f"Failed to extract data: {e}"})
+                extracted_data = None
+        await extracted_queue.put((index, filename, extracted_data))
+
+    async def finish(index: int, filename: str, extracted_data: InvoiceData, crm_data: dict):
+        async with compare_limit:
+            try:
+                # Index prefix keeps same-named files in one batch from overwriting each other's voucher
+                result = await match_with_crm_async(extracted_data, crm_data, f"{index}_{filename}", output_dir=output_dir)
+            except Exception as e:
+                logger.error(f"Batch comparison failed for {filename}: {e}")
+                result = {"status": "ERROR", "error": str(e)}
+        await results.put({"filename": filename, **result})
+
+    async def resolve_crm():
+        remaining = len(documents)
+        while remaining:
+            # Wait for one extraction, then take everything else that is ready
+            ready = [await extracted_queue.get()]
+            while not extracted_queue.empty():
+                ready.append(extracted_queue.get_nowait())
+            remaining -= len(ready)
+
+            ready = [entry for entry in ready if entry[2] is not None]
+            if not ready:
+                continue
+
+            keys = {index: crm_key(job_reference=data.job_no, invoice_number=data.supplier_inv_no) for index, _, data in ready}
+            crm_records = await asyncio.to_thread(fetch_crm_data_bulk, list(keys.values()))
+            for index, filename, data in ready:
+                tasks.append(asyncio.create_task(finish(index, filename, data, crm_records.get(keys[index], {}))))
+
+    tasks.extend(asyncio.create_task(extract(i, name, payload)) for i, (name, payload) in enumerate(documents))
+    tasks.append(asyncio.create_task(resolve_crm()))
+
+    try:
+        for _ in range(len(documents)):
+            yield await results.get()
+    finally:
+        # Stop outstanding work if the consumer goes away early
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,201 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from src.config import getenv
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. `rate` tokens are added per second up to `capacity`;
+    each call to acquire() takes one token, blocking until it is available.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Stops handing out tokens for `seconds`, e.g. after the server returned 429."""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0
+            self._updated = now
+
+
+class ConcurrencyLimit:
+    """
+    Cap on concurrent calls, shared by every thread and event loop in the
+    process. hold() blocks the calling thread; ahold() waits without blocking
+    the event loop.
+    """
+
+    def __init__(self, limit: int):
+        if limit <= 0:
+            raise ValueError("limit must be positive")
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+
+    @contextmanager
+    def hold(self):
+        self._slots.acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def ahold(self):
+        # Polls instead of parking a worker thread on the semaphore per waiter
+        delay = 0.005
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+_outbound_limits: Dict[str, ConcurrencyLimit] = {}
+_outbound_limits_lock = threading.Lock()
+
+def outbound_limit(service: str) -> ConcurrencyLimit:
+    """
+    Process-wide limit on calls in flight to `service` ("azure" or "gemini"),
+    read from AZURE_MAX_CONCURRENCY / GEMINI_MAX_CONCURRENCY (default 8). Holds
+    across every entry point: /match, /match/batch, job workers and the CLI.
+    """
+    with _outbound_limits_lock:
+        limit = _outbound_limits.get(service)
+        if limit is None:
+            limit = ConcurrencyLimit(int(getenv(f"{service.upper()}_MAX_CONCURRENCY", "8")))
+            _outbound_limits[service] = limit
+        return limit
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Reads the server-requested delay (seconds) from a throttling error, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("x-ms-retry-after-ms", 0.001), ("Retry-After", 1.0)):
+        value = headers.get(header)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                continue
+    return None
+
+
+# Transient server errors retried with backoff (without pausing the shared limiter)
+_TRANSIENT_STATUSES = {408, 500, 502, 503, 504}
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_throttled(error: Exception) -> bool:
+    return _status_code(error) == 429
+
+
+def is_retryable(error: Exception) -> bool:
+    return is_throttled(error) or _status_code(error) in _TRANSIENT_STATUSES
+
+
+def _describe(error: Exception) -> str:
+    return "Throttled (429)" if is_throttled(error) else f"Server error ({_status_code(error)})"
+
+
+def _retry_delay(error: Exception, attempt: int, base_delay: float, max_delay: float) -> float:
+    """Retry-After plus jitter when the server asked for a delay, else jittered exponential backoff."""
+    retry_after = get_retry_after(error)
+    backoff = min(max_delay, base_delay * (2 ** attempt))
+    if retry_after is not None:
+        return retry_after + random.uniform(0, backoff / 2)
+    return random.uniform(backoff / 2, backoff)
+
+
+def call_with_retry(func: Callable[[], T], limiter: Optional[TokenBucket] = None, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0) -> T:
+    """
+    Calls `func`, taking a token from `limiter` before every attempt.
+
+    On a 429 the call is retried, waiting for the server's Retry-After when present,
+    otherwise for a jittered exponential backoff. The shared limiter is paused for the
+    same period so other workers back off too. Transient 5xx responses are retried
+    with the same backoff. SDK clients called here must have their own status
+    retries disabled, so attempts do not multiply and the limiter pauses on the first 429.
+    """
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.acquire()
+        try:
+            return func()
+        except Exception as e:
+            if not is_retryable(e) or attempt >= max_retries:
+                raise
+
+            delay = _retry_delay(e, attempt, base_delay, max_delay)
+            attempt += 1
+            logger.warning(f"{_describe(e)}. Retry {attempt}/{max_retries} in {delay:.1f}s")
+            if limiter and is_throttled(e):
+                limiter.pause(delay)
+            else:
+                time.sleep(delay)
+
+
+async def acall_with_retry(func: Callable[[], Awaitable[T]], max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0) -> T:
+    """
+    Async counterpart of call_with_retry: awaits `func()` and retries on 429 and
+    transient 5xx without blocking the event loop.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await func()
+        except Exception as e:
+            if not is_retryable(e) or attempt >= max_retries:
+                raise
+
+            delay = _retry_delay(e, attempt, base_delay, max_delay)
+            attempt += 1
+            logger.warning(f"{_describe(e)}. Retry {attempt}/{max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
@@ -0,0 +1,204 @@
+import re
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.models import ComparisonResult, InvoiceData
+from src.config import getenv
+from src.line_items import LineItemArray
+
+logger = logging.getLogger(__name__)
+
+# Same rounding allowance the LLM prompt uses for totals
+AMOUNT_TOLERANCE = 0.05
+
+# Legal-form suffixes ignored when comparing company names
+_COMPANY_SUFFIXES = {
+    "inc", "incorporated", "ltd", "limited", "llc", "llp", "co", "corp", "corporation",
+    "company", "pvt", "private", "plc", "gmbh", "sa", "bv", "fze", "fzco", "fzc", "fzllc"
+}
+
+# Active ISO 4217 codes; a currency outside this set is never decided on locally
+_ISO_CURRENCIES = frozenset("""
+AED AFN ALL AMD ANG AOA ARS AUD AWG AZN BAM BBD BDT BGN BHD BIF BMD BND BOB BRL BSD BTN BWP BYN BZD
+CAD CDF CHF CLP CNY COP CRC CUP CVE CZK DJF DKK DOP DZD EGP ERN ETB EUR FJD FKP GBP GEL GHS GIP GMD
+GNF GTQ GYD HKD HNL HTG HUF IDR ILS INR IQD IRR ISK JMD JOD JPY KES KGS KHR KMF KPW KRW KWD KYD KZT
+LAK LBP LKR LRD LSL LYD MAD MDL MGA MKD MMK MNT MOP MRU MUR MVR MWK MXN MYR MZN NAD NGN NIO NOK NPR
+NZD OMR PAB PEN PGK PHP PKR PLN PYG QAR RON RSD RUB RWF SAR SBD SCR SDG SEK SGD SHP SLE SOS SRD SSP
+STN SVC SYP SZL THB TJS TMT TND TOP TRY TTD TWD TZS UAH UGX USD UYU UZS VES VND VUV WST XAF XCD XOF
+XPF YER ZAR ZMW ZWL
+""".split())
+
+# Symbols and names that stand for exactly one currency. Bare "$", "¥" or "Rs"
+# are shared by several currencies and stay unresolved.
+_CURRENCY_ALIASES = {
+    "US$": "USD", "USD$": "USD", "U S $": "USD", "US DOLLAR": "USD", "US DOLLARS": "USD",
+    "€": "EUR", "EURO": "EUR", "EUROS": "EUR",
+    "£": "GBP", "POUND STERLING": "GBP", "POUNDS STERLING": "GBP",
+    "₹": "INR", "RMB": "CNY", "S$": "SGD", "SG$": "SGD", "HK$": "HKD", "A$": "AUD", "AU$": "AUD",
+    "C$": "CAD", "CA$": "CAD", "NZ$": "NZD",
+    "DIRHAM": "AED", "DIRHAMS": "AED", "UAE DIRHAM": "AED", "UAE DIRHAMS": "AED",
+    "SAUDI RIYAL": "SAR", "SAUDI RIYALS": "SAR",
+}
+
+_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%m/%d/%Y", "%d %b %Y", "%d-%b-%Y", "%d %B %Y", "%b %d, %Y")
+
+_stats = {"fast_path": 0, "escalated": 0}
+_stats_lock = threading.Lock()
+
+def normalize_name(value: Optional[str]) -> str:
+    """Lower-cases, strips punctuation and drops legal-form suffixes."""
+    tokens = re.sub(r"[^a-z0-9 ]", " ", str(value or "").lower()).split()
+    return " ".join(token for token in tokens if token not in _COMPANY_SUFFIXES)
+
+def normalize_reference(value: Optional[str]) -> str:
+    """Reference numbers compare on their alphanumeric characters only."""
+    return re.sub(r"[^A-Z0-9]", "", str(value or "").upper())
+
+def normalize_date(value: Optional[str]) -> str:
+    text = str(value or "").strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return text
+
+def normalize_currency(value: Optional[str]) -> Optional[str]:
+    """ISO 4217 code for a currency code, symbol or name, or None when it does not name exactly one."""
+    text = " ".join(re.sub(r"[.,]", " ", str(value or "")).upper().split())
+    if text in _ISO_CURRENCIES:
+        return text
+    return _CURRENCY_ALIASES.get(text) or _CURRENCY_ALIASES.get(text.replace(" ", ""))
+
+def amounts_match(a: Optional[float], b: Optional[float], tolerance: float = AMOUNT_TOLERANCE) -> bool:
+    if a is None or b is None:
+        return False
+    return abs(float(a) - float(b)) <= tolerance + 1e-9
+
+def _field(status: str, reasoning: str) -> dict:
+    # Same shape as FieldComparison(...).model_dump(), without validating one model per line item
+    return {"status": status, "reasoning": reasoning}
+
+def _line_key(index: int, description: str) -> str:
+    # Numbered, so lines with the same description keep separate entries
+    return f"line_item {index + 1}: {description}"
+
+def reconcile(extracted: InvoiceData, crm_data: dict, fuzzy_results: List[dict], min_score: Optional[int] = None) -> Optional[ComparisonResult]:
+    """
+    Rule-based reconciliation that runs before the LLM.
+
+    Returns a ComparisonResult when the outcome is unambiguous:
+    - MISMATCH when the currencies (both resolved to ISO codes) differ or the totals
+      differ by more than the tolerance.
+    - MATCH when every header field present on both sides agrees after normalization,
+      totals agree within tolerance, the line items add up to the invoice total, and
+      every line item pairs one-to-one with a CRM line of the same amount whose fuzzy
+      description score is at least `min_score`.
+
+    Returns None for everything else so the caller can escalate to the LLM.
+    """
+    if min_score is None:
+        min_score = int(getenv("FAST_PATH_MIN_SCORE", "100"))
+
+    fields: Dict[str, dict] = {}
+    ambiguous: List[str] = []
+
+    # --- Decisive header checks ---
+    # Only currencies that resolve to an ISO code are decided here. The model
+    # default (no currency found on the invoice) is not evidence either way.
+    crm_currency = normalize_currency(crm_data.get("currency"))
+    invoice_currency = normalize_currency(extracted.currency) if "currency" in extracted.model_fields_set else None
+    if invoice_currency and crm_currency:
+        if invoice_currency != crm_currency:
+            fields["currency"] = _field("MISMATCH", f"Invoice currency {extracted.currency} differs from CRM currency {crm_data.get('currency')}.")
+            return _decide("MISMATCH", f"Currency mismatch ({invoice_currency} vs {crm_currency}).", fields)
+        fields["currency"] = _field("MATCH", f"Both records use {invoice_currency}.")
+    elif crm_data.get("currency"):
+        ambiguous.append("currency")
+
+    crm_total = crm_data.get("total_amount")
+    invoice_total = extracted.total_amount
+    if invoice_total is not None and crm_total is not None:
+        if not amounts_match(invoice_total, crm_total):
+            fields["total_amount"] = _field("MISMATCH", f"Invoice total {invoice_total:.2f} differs from CRM total {float(crm_total):.2f} by more than {AMOUNT_TOLERANCE}.")
+            return _decide("MISMATCH", f"Total amount mismatch ({invoice_total:.2f} vs {float(crm_total):.2f}).", fields)
+        fields["total_amount"] = _field("MATCH", f"Totals agree within {AMOUNT_TOLERANCE}.")
+    else:
+        ambiguous.append("total_amount")
+
+    # --- Soft header checks: disagreement is left to the LLM ---
+    soft_checks = (
+        ("supplier_inv_no", extracted.supplier_inv_no, crm_data.get("invoice_number"), normalize_reference),
+        ("customer_name", extracted.customer_name, crm_data.get("customer_name"), normalize_name),
+        ("due_date", extracted.due_date, crm_data.get("due_date"), normalize_date),
+        ("supplier", extracted.supplier, crm_data.get("supplier_name") or crm_data.get("supplier"), normalize_name),
+    )
+    for name, invoice_value, crm_value, normalize in soft_checks:
+        if not invoice_value or not crm_value:
+            continue
+        if normalize(invoice_value) == normalize(crm_value):
+            fields[name] = _field("MATCH", f"'{invoice_value}' matches '{crm_value}' after normalization.")
+        else:
+            ambiguous.append(name)
+
+    # --- Line items: one-to-one by amount, confirmed by description score ---
+    crm_line_items = crm_data.get("line_items", [])
+    if len(extracted.items) != len(crm_line_items):
+        ambiguous.append("line_items")
+    else:
+        invoice_lines = LineItemArray.from_items(extracted.items)
+        if not invoice_lines.pairs_with(LineItemArray.from_crm_items(crm_line_items), AMOUNT_TOLERANCE):
+            ambiguous.append("line_items")
+        # Lines that do not add up to the total (tax, a missed or extra line) are for the LLM to explain
+        if len(invoice_lines) and not invoice_lines.sum_matches(invoice_total, AMOUNT_TOLERANCE):
+            ambiguous.append("line_items_total")
+
+        # Score and amount of the CRM line each invoice line was paired with by fuzzy scoring
+        scores = np.array([match.get("similarity_score", 0) for match in fuzzy_results], dtype=np.float64)
+        paired_amounts = np.array([
+            np.nan if (match.get("crm_item_details") or {}).get("amount") is None else float(match["crm_item_details"]["amount"])
+            for match in fuzzy_results
+        ], dtype=np.float64)
+        if len(fuzzy_results) != len(invoice_lines):
+            confirmed = np.zeros(len(invoice_lines), dtype=bool)
+        else:
+            confirmed = (scores >= min_score) & invoice_lines.amounts_close(paired_amounts, AMOUNT_TOLERANCE)
+
+        if confirmed.all():
+            for index, (item, match) in enumerate(zip(extracted.items, fuzzy_results)):
+                fields[_line_key(index, item.description)] = _field(
+                    "MATCH", f"Matched CRM line '{match['best_crm_match']}' (fuzzy score {match['similarity_score']}) with amount {item.amount:.2f}."
+                )
+        else:
+            ambiguous.extend(_line_key(i, extracted.items[i].description) for i in np.flatnonzero(~confirmed))
+
+    if ambiguous:
+        logger.info(f"Fast path inconclusive on: {', '.join(ambiguous)}")
+        record_outcome(fast_path=False)
+        return None
+
+    return _decide("MATCH", "Deterministic reconciliation: header fields, total and all line items match.", fields)
+
+def _decide(status: str, analysis: str, fields: Dict[str, dict]) -> ComparisonResult:
+    record_outcome(fast_path=True)
+    logger.info(f"Fast path decided {status}. {analysis}")
+    return ComparisonResult(status=status, analysis=analysis, field_level_comparison=fields)
+
+def record_outcome(fast_path: bool):
+    with _stats_lock:
+        _stats["fast_path" if fast_path else "escalated"] += 1
+
+def get_fast_path_stats() -> dict:
+    """Counts of comparisons decided by rules vs escalated to the LLM."""
+    with _stats_lock:
+        fast_path, escalated = _stats["fast_path"], _stats["escalated"]
+    total = fast_path + escalated
+    return {
+        "fast_path": fast_path,
+        "escalated": escalated,
+        "hit_ratio": (fast_path / total) if total else 0.0,
+    }